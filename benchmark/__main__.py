@@ -1,51 +1,37 @@
-import shelve
-import timeit
-from collections import Callable
-from tempfile import TemporaryDirectory
-
-from pickledir import PickleDir
-from diskcache import Cache
-
-ITEMS = 10
-RUNS = 100
-
-
-def write_and_read(cache):
-    for i in range(ITEMS):
-        cache[str(i)] = {"data": i, "other": None}
-    for i in range(ITEMS):
-        _ = cache[str(i)]
-
-
-def run_pickledir():
-    with TemporaryDirectory() as td:
-        cache = PickleDir(td)
-        write_and_read(cache)
-
-
-def run_diskcache():
-    with TemporaryDirectory() as td:
-        with Cache(td) as cache:
-            write_and_read(cache)
-
-
-def run_shelve():
-    with TemporaryDirectory() as td:
-        with shelve.open(td + "/file") as cache:
-            write_and_read(cache)
-
-
-def bench(name: str, func: Callable):
-    time = timeit.timeit(
-        stmt=func,
-        number=RUNS)
-    print(f"{name} | {time:.2f}")
+import argparse
+
+from benchmark import harness
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('compare',
+                        help='compare with shelve and diskcache (default)')
+    run = commands.add_parser('run', help='run the scenarios, print JSON')
+    run.add_argument('--preset', choices=sorted(harness.PRESETS),
+                     default='quick')
+    run.add_argument('--only', nargs='*', metavar='NAME',
+                     help='run only the scenarios with these names')
+    run.add_argument('--output', '-o', help='write JSON to the file')
+    run.add_argument('--seed', type=int, default=0)
+    commands.add_parser('list', help='list the scenarios of the presets')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        scenarios = harness.PRESETS[args.preset]
+        if args.only:
+            scenarios = [s for s in scenarios if s.name in args.only]
+        harness.run(scenarios, output=args.output, seed=args.seed)
+    elif args.command == 'list':
+        for preset, scenarios in harness.PRESETS.items():
+            for s in scenarios:
+                print(f'{preset}\t{s.name}')
+    else:
+        # imported here, since it needs diskcache
+        from benchmark import compare
+        compare.main()
 
 
 if __name__ == "__main__":
-    print("Storage | Time")
-    print("--------|-----")
-    for _ in range(2):
-        bench("PickleDir", run_pickledir)
-        bench("shelve", run_shelve)
-        bench("diskcache", run_diskcache)
+    main()
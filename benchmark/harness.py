@@ -0,0 +1,236 @@
+# Parameterized scenarios. Each scenario fills a fresh directory, runs
+# the operations timing each of them, and reports the latency percentiles.
+#
+#   python -m benchmark run --preset quick --output results.json
+#
+# The JSON output is meant to be compared between releases.
+
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import timedelta, datetime, timezone
+from tempfile import TemporaryDirectory
+from typing import *
+
+import pickledir
+from pickledir import PickleDir
+
+KB = 1024
+MB = 1024 * KB
+
+
+@dataclass
+class Scenario:
+    name: str
+    items: int = 10_000
+    value_size: int = 100
+    # the number of timed get/set operations (per process)
+    ops: int = 10_000
+    # the fraction of the operations that are reads
+    reads: float = 0.9
+    processes: int = 1
+    # the fraction of the items written already expired
+    expired: float = 0.0
+    # the number of full passes over the items with `items()` and `scan()`
+    scans: int = 0
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+def _scaling(items_list: Iterable[int]) -> List[Scenario]:
+    return [Scenario(f'items_{n}', items=n, ops=min(n, 20_000))
+            for n in items_list]
+
+
+def _durability(items: int, ops: int) -> List[Scenario]:
+    # the throughput of the writes with each durability mode
+    return [Scenario(f'durability_{mode}', items=items, ops=ops, reads=0.0,
+                     options={'durability': mode})
+            for mode in ('none', 'fsync', 'group')]
+
+
+def _value_sizes(sizes: Iterable[int], total: int) -> List[Scenario]:
+    # the number of items is limited by the total size of the values
+    result = []
+    for size in sizes:
+        items = max(4, min(10_000, total // size))
+        result.append(Scenario(f'value_{size}', items=items,
+                               value_size=size, ops=min(items * 4, 2_000)))
+    return result
+
+
+PRESETS: Dict[str, List[Scenario]] = {
+    'quick': [
+        *_scaling([1_000, 10_000]),
+        *_value_sizes([100, 10 * KB, 1 * MB], total=64 * MB),
+        Scenario('write_heavy', reads=0.1),
+        Scenario('read_only', reads=1.0),
+        Scenario('processes_4', processes=4, ops=2_000,
+                 options={'concurrent': True}),
+        Scenario('expiry_heavy', expired=0.5, ops=5_000),
+        Scenario('scan', ops=0, scans=3),
+        *_durability(items=10_000, ops=1_000),
+    ],
+    'full': [
+        *_scaling([10_000, 100_000, 1_000_000]),
+        *_value_sizes([100, 10 * KB, 1 * MB, 100 * MB], total=1024 * MB),
+        Scenario('write_heavy', items=100_000, reads=0.1),
+        Scenario('read_only', items=100_000, reads=1.0),
+        Scenario('mixed_50', items=100_000, reads=0.5),
+        *[Scenario(f'processes_{n}', items=100_000, processes=n,
+                   ops=5_000, options={'concurrent': True})
+          for n in (2, 4, 8)],
+        Scenario('expiry_heavy', items=100_000, expired=0.5),
+        Scenario('expiry_all', items=100_000, expired=1.0),
+        Scenario('scan_100k', items=100_000, ops=0, scans=3),
+        Scenario('scan_1m', items=1_000_000, ops=0, scans=1),
+        Scenario('lru', items=100_000, options={'lru_buckets': 4096}),
+        Scenario('zlib', items=100_000, value_size=10 * KB,
+                 options={'codec': 'zlib'}),
+        *_durability(items=100_000, ops=10_000),
+    ],
+}
+
+
+def _value(size: int) -> bytes:
+    # random bytes, so the compression does not make the values tiny
+    return os.urandom(size)
+
+
+def _populate(cache: PickleDir, scenario: Scenario):
+    value = _value(scenario.value_size)
+    expired_every = round(1 / scenario.expired) if scenario.expired else 0
+    chunk = max(1, min(10_000, 64 * MB // max(scenario.value_size, 1)))
+    for start in range(0, scenario.items, chunk):
+        fresh, expired = dict(), dict()
+        for i in range(start, min(start + chunk, scenario.items)):
+            if expired_every and i % expired_every == 0:
+                expired[i] = value
+            else:
+                fresh[i] = value
+        cache.set_many(fresh)
+        if expired:
+            cache.set_many(expired, max_age=timedelta(seconds=-1))
+
+
+def _run_ops(dirpath: str, scenario: Scenario, seed: int) \
+        -> Dict[str, List[int]]:
+    # returns the latencies in nanoseconds by the operation name
+    cache = PickleDir(dirpath, **scenario.options)
+    rnd = random.Random(seed)
+    value = _value(scenario.value_size)
+    latencies: Dict[str, List[int]] = {'get': [], 'set': []}
+    clock = time.perf_counter_ns
+    for _ in range(scenario.ops):
+        key = rnd.randrange(scenario.items)
+        if rnd.random() < scenario.reads:
+            started = clock()
+            cache.get(key)
+            latencies['get'].append(clock() - started)
+        else:
+            started = clock()
+            cache.set(key, value)
+            latencies['set'].append(clock() - started)
+    if scenario.options.get('durability') == 'group':
+        # the writes are not durable until the last window is synced
+        started = clock()
+        cache.sync()
+        latencies['sync'] = [clock() - started]
+    return latencies
+
+
+def _run_ops_star(args) -> Dict[str, List[int]]:
+    return _run_ops(*args)
+
+
+def _percentiles(values: List[int]) -> Dict[str, float]:
+    values = sorted(values)
+
+    def rank(p: float) -> float:
+        # nearest-rank percentile, in microseconds
+        idx = max(0, min(len(values) - 1, int(round(p * len(values))) - 1))
+        return values[idx] / 1000
+
+    return {
+        'count': len(values),
+        'mean_us': sum(values) / len(values) / 1000,
+        'p50_us': rank(0.50),
+        'p90_us': rank(0.90),
+        'p99_us': rank(0.99),
+        'p999_us': rank(0.999),
+        'max_us': values[-1] / 1000,
+    }
+
+
+def run_scenario(scenario: Scenario, seed: int = 0) -> Dict[str, Any]:
+    result: Dict[str, Any] = {'scenario': asdict(scenario)}
+    with TemporaryDirectory() as td:
+        cache = PickleDir(td, **scenario.options)
+
+        started = time.perf_counter()
+        _populate(cache, scenario)
+        result['populate_s'] = time.perf_counter() - started
+
+        latencies: Dict[str, List[int]] = {}
+        started = time.perf_counter()
+        if scenario.ops:
+            jobs = [(td, scenario, seed + i)
+                    for i in range(scenario.processes)]
+            if scenario.processes == 1:
+                parts = [_run_ops_star(jobs[0])]
+            else:
+                with multiprocessing.Pool(scenario.processes) as pool:
+                    parts = pool.map(_run_ops_star, jobs)
+            for part in parts:
+                for op, values in part.items():
+                    latencies.setdefault(op, []).extend(values)
+        elapsed = time.perf_counter() - started
+        result['ops_s'] = elapsed
+        result['ops_per_s'] = \
+            scenario.ops * scenario.processes / elapsed if elapsed else None
+
+        for _ in range(scenario.scans):
+            for op, iterate in (('items', cache.items), ('scan', cache.scan)):
+                started = time.perf_counter_ns()
+                for _ in iterate():
+                    pass
+                latencies.setdefault(op, []).append(
+                    time.perf_counter_ns() - started)
+
+        if scenario.expired:
+            started = time.perf_counter_ns()
+            cache.sweep()
+            latencies['sweep'] = [time.perf_counter_ns() - started]
+
+        result['latency'] = {op: _percentiles(values)
+                             for op, values in latencies.items() if values}
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        'pickledir': pickledir.__version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def run(scenarios: List[Scenario], output: Optional[str] = None,
+        seed: int = 0) -> Dict[str, Any]:
+    report = {'environment': environment(), 'results': []}
+    for scenario in scenarios:
+        print(f'{scenario.name}...', file=sys.stderr, flush=True)
+        report['results'].append(run_scenario(scenario, seed=seed))
+    text = json.dumps(report, indent=2)
+    if output is None:
+        print(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text)
+    return report
@@ -2,4 +2,10 @@
 # SPDX-License-Identifier: MIT
 
 from ._pickledir import PickleDir
+from ._async import AsyncPickleDir
+from ._sharded import ShardedPickleDir
+from ._codecs import Codec, PickleCodec, ZlibCodec, LzmaCodec
+from ._metrics import Metrics, BucketStats
+from ._transaction import Transaction
+from ._snapshot import PickleDirSnapshot
 from ._constants import __version__
@@ -0,0 +1,225 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from concurrent.futures import Executor
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from typing import *
+
+from pickledir._format import Record, Encoded, decode_value
+from pickledir._pickledir import PickleDir, TKey, TValue
+
+# smaller values are unpickled right in the event loop thread: it is faster
+# than passing them to the executor and back
+_INLINE_DECODE_LIMIT = 16 * 1024
+
+# number of items fetched from the executor at once by `items()`
+_ITEMS_BATCH = 64
+
+
+class AsyncPickleDir(Generic[TKey, TValue]):
+    """Asyncio interface to `PickleDir`.
+
+    The file I/O and unpickling run on the `executor` (the default executor
+    of the event loop if not specified). Concurrent reads of keys stored in
+    the same file share a single load of that file.
+
+    :param dirpath: The directory or an existing `PickleDir` object.
+
+    Other keyword arguments are passed to the `PickleDir` constructor.
+    """
+
+    def __init__(self, dirpath: Union[str, Path, PickleDir],
+                 executor: Executor = None, **kwargs):
+        if isinstance(dirpath, PickleDir):
+            if kwargs:
+                raise ValueError("Arguments for an existing PickleDir")
+            self.sync: PickleDir[TKey, TValue] = dirpath
+        else:
+            self.sync = PickleDir(dirpath, **kwargs)
+        self.executor = executor
+        self._loads: Dict[Path, asyncio.Future] = dict()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          partial(func, *args, **kwargs))
+
+    def _key_to_file_sync(self, key: TKey) -> Tuple[bytes, Path]:
+        key_bytes = self.sync._key_to_bytes(key)
+        return key_bytes, self.sync._key_bytes_to_file(key_bytes)
+
+    async def _key_to_file(self, key: TKey) -> Tuple[bytes, Path]:
+        # the layout is checked on the disk, and during resharding the old
+        # bucket is moved first, so this runs on the executor
+        return await self._run(self._key_to_file_sync, key)
+
+    async def _group_by_file(self, keys: List[TKey]) \
+            -> Dict[Path, List[Tuple[int, bytes]]]:
+        # see `_key_to_file`
+        return await self._run(self.sync._group_by_file, keys)
+
+    async def _load(self, filepath: Path) -> Dict[bytes, Record]:
+        # Loads the records from the file. If the file is already being
+        # loaded for another coroutine, waits for the same result.
+        # The returned dict is shared, it must not be modified
+        future = self._loads.get(filepath)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.executor, partial(self.sync._load_file, filepath,
+                                       for_read=True))
+            self._loads[filepath] = future
+
+            def forget(f, p=filepath):
+                if self._loads.get(p) is f:
+                    del self._loads[p]
+
+            future.add_done_callback(forget)
+
+        # one of the waiting coroutines may be cancelled, it must not
+        # cancel the load for others
+        return await asyncio.shield(future)
+
+    def _forget_load(self, filepath: Path):
+        # the file is being written. A load that started earlier may return
+        # the old data, so new readers should not join it
+        self._loads.pop(filepath, None)
+
+    async def _decode(self, data: Any) -> Any:
+        if isinstance(data, Encoded) and (
+                data.buffers is not None
+                or len(data.blob) > _INLINE_DECODE_LIMIT):
+            return await self._run(decode_value, data, self.sync._blobs)
+        return decode_value(data, self.sync._blobs)
+
+    def _is_young(self, rec: Record, max_age: Optional[timedelta]) -> bool:
+        return max_age is None or rec.created >= self.sync._now() - max_age
+
+    async def get(self, key: TKey, max_age: timedelta = None,
+                  default=None) -> TValue:
+        if self.sync._log is not None:
+            return await self._run(self.sync.get, key, max_age=max_age,
+                                   default=default)
+        key_bytes, filepath = await self._key_to_file(key)
+        rec = (await self._load(filepath)).get(key_bytes)
+        if rec is None or not self._is_young(rec, max_age):
+            if default == KeyError:
+                raise KeyError
+            return default
+        return await self._decode(rec.data)
+
+    async def contains(self, key: TKey) -> bool:
+        if self.sync._log is not None:
+            return await self._run(self.sync.__contains__, key)
+        key_bytes, filepath = await self._key_to_file(key)
+        return key_bytes in await self._load(filepath)
+
+    async def set(self, key: TKey, value: TValue,
+                  max_age: timedelta = None) -> None:
+        _, filepath = await self._key_to_file(key)
+        self._forget_load(filepath)
+        try:
+            await self._run(self.sync.set, key, value, max_age=max_age)
+        finally:
+            self._forget_load(filepath)
+
+    async def delete(self, key: TKey) -> None:
+        _, filepath = await self._key_to_file(key)
+        self._forget_load(filepath)
+        try:
+            await self._run(self.sync.__delitem__, key)
+        finally:
+            self._forget_load(filepath)
+
+    async def _modify(self, method: Callable, key: TKey, *args, **kwargs):
+        _, filepath = await self._key_to_file(key)
+        self._forget_load(filepath)
+        try:
+            return await self._run(method, key, *args, **kwargs)
+        finally:
+            self._forget_load(filepath)
+
+    async def update(self, key: TKey, func: Callable[[TValue], TValue],
+                     default: TValue = None,
+                     max_age: timedelta = None) -> TValue:
+        """See `PickleDir.update`. The function runs on the executor."""
+        return await self._modify(self.sync.update, key, func,
+                                  default=default, max_age=max_age)
+
+    async def compare_and_set(self, key: TKey, expected: TValue, new: TValue,
+                              max_age: timedelta = None) -> bool:
+        return await self._modify(self.sync.compare_and_set, key, expected,
+                                  new, max_age=max_age)
+
+    async def incr(self, key: TKey, delta: Union[int, float] = 1,
+                   max_age: timedelta = None) -> Union[int, float]:
+        return await self._modify(self.sync.incr, key, delta,
+                                  max_age=max_age)
+
+    async def get_many(self, keys: Iterable[TKey],
+                       max_age: timedelta = None,
+                       default=None) -> List[TValue]:
+        keys = list(keys)
+        if self.sync._log is not None:
+            # the log is not split into files, so there is nothing to share
+            return await self._run(self.sync.get_many, keys,
+                                   max_age=max_age, default=default)
+        groups = await self._group_by_file(keys)
+        paths = list(groups)
+        loaded = await asyncio.gather(*(self._load(p) for p in paths))
+
+        result = [default] * len(keys)
+        for filepath, items_dict in zip(paths, loaded):
+            for idx, key_bytes in groups[filepath]:
+                rec = items_dict.get(key_bytes)
+                if rec is not None and self._is_young(rec, max_age):
+                    result[idx] = await self._decode(rec.data)
+        return result
+
+    async def set_many(self,
+                       items: Union[Mapping[TKey, TValue],
+                                    Iterable[Tuple[TKey, TValue]]],
+                       max_age: timedelta = None) -> None:
+        if isinstance(items, Mapping):
+            items = items.items()
+        pairs = list(items)
+        paths = list(await self._group_by_file([k for k, _ in pairs]))
+        for p in paths:
+            self._forget_load(p)
+        try:
+            await self._run(self.sync.set_many, pairs, max_age=max_age)
+        finally:
+            for p in paths:
+                self._forget_load(p)
+
+    async def delete_many(self, keys: Iterable[TKey]) -> None:
+        keys = list(keys)
+        paths = list(await self._group_by_file(keys))
+        for p in paths:
+            self._forget_load(p)
+        try:
+            await self._run(self.sync.delete_many, keys)
+        finally:
+            for p in paths:
+                self._forget_load(p)
+
+    async def items(self) -> AsyncIterator[Tuple[TKey, TValue]]:
+        iterator = iter(self.sync.items())
+
+        def next_batch():
+            batch = []
+            for pair in iterator:
+                batch.append(pair)
+                if len(batch) >= _ITEMS_BATCH:
+                    break
+            return batch
+
+        while True:
+            batch = await self._run(next_batch)
+            if not batch:
+                return
+            for pair in batch:
+                yield pair
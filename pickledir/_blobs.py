@@ -0,0 +1,221 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Files that keep the data too large to be stored inside the bucket files.
+# Each blob file is referenced from a record in some bucket file and removed
+# when the record is overwritten or deleted.
+#
+# The exception are the shared files named by the hash of their content.
+# They may be referenced by many records, and are removed only by
+# `remove_unreferenced`.
+
+import hashlib
+import mmap
+import os
+import pickle
+import time
+import uuid
+from pathlib import Path
+from typing import *
+
+from pickledir._durability import Durability
+
+BLOBS_DIRNAME = 'blobs'
+
+# offsets of the out-of-band buffers are aligned, so arrays mapped from the
+# file have the alignment expected by vectorized code
+_ALIGN = 64
+
+# (blob file name, [(offset, length), ...])
+BuffersRef = Tuple[str, List[Tuple[int, int]]]
+
+
+class BlobStore:
+
+    def __init__(self, root: Path, durability: Durability = None):
+        self.root = root / BLOBS_DIRNAME
+        self._durability = durability or Durability()
+
+    def path(self, name: str) -> Path:
+        return self.root / name[:2] / name
+
+    def new_name(self) -> str:
+        return uuid.uuid4().hex
+
+    def create(self, name: str) -> BinaryIO:
+        path = self.path(name)
+        try:
+            return path.open('xb')
+        except FileNotFoundError:
+            self._durability.make_dirs(path.parent)
+            return path.open('xb')
+
+    @staticmethod
+    def is_shared(name: str) -> bool:
+        # the other blob files have 32-character names
+        return len(name) == 64
+
+    def write_shared(self, pieces: Sequence[Any]) -> str:
+        """Saves the concatenated bytes-like pieces to the shared blob file
+        named by their SHA-256, unless the file already exists. Returns
+        the name."""
+        digest = hashlib.sha256()
+        for piece in pieces:
+            digest.update(piece)
+        name = digest.hexdigest()
+        path = self.path(name)
+        try:
+            # the new modification time protects the file from
+            # `remove_unreferenced` until the record referring to it
+            # is written
+            os.utime(str(path))
+            return name
+        except FileNotFoundError:
+            pass
+        # other processes may be writing the same content. Each writes its
+        # own temporary file, and the renames leave one of the equal files
+        temp = f'{name}.{uuid.uuid4().hex[:8]}'
+        nbytes = 0
+        with self.create(temp) as f:
+            for piece in pieces:
+                nbytes += f.write(piece)
+            self._durability.sync_data(f)
+        os.replace(str(self.path(temp)), str(path))
+        self._durability.written(path, nbytes)
+        return name
+
+    def remove(self, name: str):
+        if self.is_shared(name):
+            # may be referenced by other records
+            return
+        try:
+            os.remove(str(self.path(name)))
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows does not allow removing the files that are mapped
+            # to memory. The file will be left as garbage
+            pass
+
+    def iter_names(self) -> Iterator[str]:
+        try:
+            subdirs = os.listdir(str(self.root))
+        except FileNotFoundError:
+            return
+        for sub in subdirs:
+            try:
+                names = os.listdir(str(self.root / sub))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            yield from names
+
+    def remove_unreferenced(self, referenced: Set[str],
+                            min_age: float) -> int:
+        """Removes the blob files that are not in `referenced` and were
+        not modified for `min_age` seconds. The younger files may belong
+        to the records being written right now. Returns the number of
+        removed files."""
+        cutoff = time.time() - min_age
+        removed = 0
+        for name in list(self.iter_names()):
+            if name in referenced:
+                continue
+            path = self.path(name)
+            try:
+                if os.stat(str(path)).st_mtime > cutoff:
+                    continue
+                os.remove(str(path))
+            except (FileNotFoundError, PermissionError):
+                continue
+            self._durability.removed(path)
+            removed += 1
+        return removed
+
+    def write_buffers(self, buffers: List[pickle.PickleBuffer],
+                      shared: bool = False) -> BuffersRef:
+        # with `shared` the file is named by its content, so the equal
+        # buffers of different records are stored once
+        pieces = []
+        spans = []
+        offset = 0
+        for buf in buffers:
+            raw = buf.raw()
+            padding = -offset % _ALIGN
+            if padding:
+                pieces.append(b'\0' * padding)
+                offset += padding
+            pieces.append(raw)
+            spans.append((offset, raw.nbytes))
+            offset += raw.nbytes
+        if shared:
+            return self.write_shared(pieces), spans
+        name = self.new_name()
+        with self.create(name) as f:
+            for piece in pieces:
+                f.write(piece)
+            self._durability.sync_data(f)
+        self._durability.written(self.path(name), offset)
+        return name, spans
+
+    def map_buffers(self, ref: BuffersRef) -> List[memoryview]:
+        name, spans = ref
+        with self.path(name).open('rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # zero-length files cannot be mapped
+                return [memoryview(b'') for _ in spans]
+            # the mapping remains valid after the file is closed
+            # (and even after it is removed)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        return [view[offset:offset + length] for offset, length in spans]
+
+
+def dumps_out_of_band(value: Any, blobs: BlobStore, threshold: int,
+                      shared_threshold: int = None) \
+        -> Tuple[bytes, Optional[BuffersRef]]:
+    """Pickles the value with protocol 5. The buffers of `threshold` bytes
+    or larger are written to a separate blob file instead of the pickle.
+    If they take `shared_threshold` bytes or more, the file is shared by
+    the equal values."""
+
+    buffers: List[pickle.PickleBuffer] = []
+
+    def callback(buf: pickle.PickleBuffer) -> bool:
+        try:
+            nbytes = buf.raw().nbytes
+        except BufferError:
+            # non-contiguous buffer
+            return True
+        if nbytes < threshold:
+            return True  # in-band
+        buffers.append(buf)
+        return False
+
+    blob = pickle.dumps(value, 5, buffer_callback=callback)
+    if not buffers:
+        return blob, None
+    shared = shared_threshold is not None and sum(
+        buf.raw().nbytes for buf in buffers) >= shared_threshold
+    return blob, blobs.write_buffers(buffers, shared)
+
+
+def loads_out_of_band(blob: bytes, ref: BuffersRef,
+                      blobs: BlobStore) -> Any:
+    return pickle.loads(blob, buffers=blobs.map_buffers(ref))
+
+
+def loads_copied(blob: bytes, ref: BuffersRef, blobs: BlobStore) -> Any:
+    """Unpickles the value with the out-of-band buffers copied to bytes
+    instead of mapped. Such a value can be pickled again: the read-only
+    buffers (like `PickleBuffer`) are unpickled as bytes, not as
+    memoryview."""
+    return pickle.loads(blob, buffers=[bytes(buf) for buf in
+                                       blobs.map_buffers(ref)])
+
+
+def inline_out_of_band(blob: bytes, ref: BuffersRef,
+                       blobs: BlobStore) -> bytes:
+    """Returns the pickle that contains the out-of-band buffers
+    in-band."""
+    return pickle.dumps(loads_copied(blob, ref, blobs),
+                        pickle.HIGHEST_PROTOCOL)
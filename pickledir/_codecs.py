@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Compression of the pickled values.
+#
+# The id of the codec is stored with each record, so the records written
+# with different codecs (or not compressed because they are small) can be
+# mixed in the same file. Decompression needs only the id: the level and
+# the threshold matter only when writing.
+
+import lzma
+import zlib
+from typing import *
+
+
+class Codec:
+    """Compresses the pickled values.
+
+    :param level: The compression level. The meaning depends on the codec.
+    :param min_size: The pickled values shorter than `min_size` bytes are
+    stored uncompressed.
+    """
+
+    id = 0
+    name = 'pickle'
+    default_level: Optional[int] = None
+
+    def __init__(self, level: int = None, min_size: int = 256):
+        self.level = self.default_level if level is None else level
+        self.min_size = min_size
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def __repr__(self):
+        return f'{type(self).__name__}(level={self.level!r}, ' \
+               f'min_size={self.min_size!r})'
+
+
+class PickleCodec(Codec):
+    """Stores the pickled values as they are."""
+
+
+class ZlibCodec(Codec):
+    id = 1
+    name = 'zlib'
+    default_level = 6
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCodec(Codec):
+    id = 2
+    name = 'lzma'
+    default_level = 6
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+_CODECS: Dict[int, Codec] = {c.id: c for c in
+                             (PickleCodec(), ZlibCodec(), LzmaCodec())}
+_NAMES: Dict[str, Type[Codec]] = {c.name: type(c) for c in _CODECS.values()}
+
+
+def get_codec(codec: Union[Codec, str, None]) -> Codec:
+    """Returns the codec by its name. Codec objects of the new types are
+    registered, so the values they wrote can be decompressed."""
+    if codec is None:
+        return _CODECS[PickleCodec.id]
+    if isinstance(codec, str):
+        try:
+            return _NAMES[codec]()
+        except KeyError:
+            raise ValueError(f"Unknown codec: {codec!r}") from None
+    registered = _CODECS.setdefault(codec.id, codec)
+    if type(registered) is not type(codec):
+        raise ValueError(f"Codec id {codec.id} is already used by "
+                         f"{type(registered).__name__}")
+    return codec
+
+
+def compress(codec: Codec, data: bytes) -> Tuple[bytes, int]:
+    """Returns the compressed data and the id of the codec. Returns the
+    data unchanged (and id 0) if compressing does not make it smaller."""
+    if codec.id == PickleCodec.id or len(data) < codec.min_size:
+        return data, PickleCodec.id
+    compressed = codec.compress(data)
+    if len(compressed) >= len(data):
+        return data, PickleCodec.id
+    return compressed, codec.id
+
+
+def decompress(data: bytes, codec_id: int) -> bytes:
+    if codec_id == PickleCodec.id:
+        return data
+    try:
+        codec = _CODECS[codec_id]
+    except KeyError:
+        raise ValueError(f"Unknown codec id: {codec_id}") from None
+    return codec.decompress(data)
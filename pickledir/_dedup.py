@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Deduplication of large values.
+#
+# The pickle of a large value is saved to a blob file named by its SHA-256,
+# so the equal values written under different keys share a single file. The
+# record in the bucket is the pickle of a call `load_content(buffer, codec)`
+# with the buffer out-of-band, referring to the whole shared file. Reading
+# it needs nothing beyond the usual out-of-band path.
+#
+# The values pickled with out-of-band buffers keep them mapped on reading:
+# the file with the buffers is shared instead (see `dumps_out_of_band`).
+#
+# The shared files are not removed with the records: a file may be
+# referenced by other keys. They are removed by `collect_blobs`, which marks
+# the files referenced from the buckets and the log and removes the rest.
+
+import pickle
+from typing import *
+
+from pickledir._blobs import BlobStore
+from pickledir._codecs import Codec, compress, decompress
+from pickledir._format import Encoded
+
+
+def load_content(data: memoryview, codec_id: int) -> Any:
+    # the records refer to this function as `pickledir._dedup.load_content`,
+    # so it must not be moved or renamed
+    return pickle.loads(decompress(data, codec_id))
+
+
+class _ContentRef:
+    # pickled instead of the value: unpickling calls `load_content`
+
+    def __init__(self, data: bytes, codec_id: int):
+        self.data = data
+        self.codec_id = codec_id
+
+    def __reduce_ex__(self, protocol):
+        return load_content, (pickle.PickleBuffer(self.data), self.codec_id)
+
+
+def encode_deduplicated(blob: bytes, blobs: BlobStore,
+                        codec: Codec) -> Encoded:
+    """Saves the pickle to the shared blob file. Returns the value
+    referring to it."""
+    data, codec_id = compress(codec, blob)
+    name = blobs.write_shared([data])
+    ref = pickle.dumps(_ContentRef(data, codec_id), 5,
+                       buffer_callback=lambda _: False)
+    return Encoded(ref, (name, [(0, len(data))]))
@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Making the writes survive a power loss.
+#
+# A new file content is durable when the data is fsynced, and a new or
+# renamed file is durable when its directory is fsynced. The bucket files
+# are written to a temporary file that replaces the bucket file, so with
+# "fsync" the temp file is fsynced before the replace (otherwise the bucket
+# could come back empty after a crash) and the directory after it.
+#
+# A new directory is an entry in its parent directory, so it is made durable
+# the same way as a new file.
+#
+# With "group" nothing is fsynced during the writes. The written files and
+# the changed directories are collected and fsynced together when the
+# window ends: after `interval` seconds since the first unsynced write or
+# when `max_bytes` are written. A power loss may lose the writes of the last
+# window (and, on some file systems, leave the replaced files truncated).
+
+import os
+import threading
+from pathlib import Path
+from typing import *
+
+DURABILITY_MODES = ('none', 'fsync', 'group')
+
+
+def fsync_file(path: Path):
+    # Windows flushes only the files opened for writing
+    flags = os.O_RDWR | getattr(os, 'O_BINARY', 0) if os.name == 'nt' \
+        else os.O_RDONLY
+    fd = os.open(str(path), flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path: Path):
+    if os.name == 'nt':
+        # directories cannot be opened on Windows, and NTFS journals
+        # the renames itself
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Durability:
+
+    def __init__(self, mode: str = 'none', interval: float = 0.1,
+                 max_bytes: int = 16 * 1024 * 1024):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {mode!r}")
+        self.mode = mode
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.fsyncs = 0
+        self._lock = threading.Lock()
+        self._files: Set[Path] = set()
+        self._dirs: Set[Path] = set()
+        self._bytes = 0
+        self._timer: Optional[threading.Timer] = None
+
+    def sync_data(self, f: BinaryIO):
+        """Called before the written file is renamed or closed."""
+        if self.mode == 'fsync':
+            f.flush()
+            os.fsync(f.fileno())
+            self.fsyncs += 1
+
+    def written(self, path: Path, nbytes: int = 0, new_entry: bool = True):
+        """Called after the file was written, created or replaced.
+        `new_entry` means the directory has changed."""
+        if self.mode == 'fsync':
+            if new_entry:
+                fsync_dir(path.parent)
+                self.fsyncs += 1
+        elif self.mode == 'group':
+            self._add(path, path.parent if new_entry else None, nbytes)
+
+    def make_dirs(self, path: Path):
+        """Creates the directory and its missing parents."""
+        if self.mode == 'none':
+            path.mkdir(parents=True, exist_ok=True)
+            return
+        try:
+            path.mkdir()
+        except FileNotFoundError:
+            self.make_dirs(path.parent)
+            try:
+                path.mkdir()
+            except FileExistsError:
+                return
+        except FileExistsError:
+            return
+        if self.mode == 'fsync':
+            fsync_dir(path.parent)
+            self.fsyncs += 1
+        else:
+            self._add(None, path.parent, 0)
+
+    def removed(self, path: Path):
+        """Called after the file was removed."""
+        if self.mode == 'fsync':
+            fsync_dir(path.parent)
+            self.fsyncs += 1
+        elif self.mode == 'group':
+            self._add(None, path.parent, 0)
+
+    def _add(self, file: Optional[Path], directory: Optional[Path],
+             nbytes: int):
+        with self._lock:
+            if file is not None:
+                self._files.add(file)
+            if directory is not None:
+                self._dirs.add(directory)
+            self._bytes += nbytes
+            full = self._bytes >= self.max_bytes
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.sync()
+
+    def sync(self):
+        """Fsyncs the files and directories collected in "group" mode."""
+        with self._lock:
+            files, self._files = self._files, set()
+            dirs, self._dirs = self._dirs, set()
+            self._bytes = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        # the data first, then the directory entries pointing to it
+        for path in files:
+            try:
+                fsync_file(path)
+            except FileNotFoundError:
+                continue  # removed since written
+            self.fsyncs += 1
+        for path in dirs:
+            try:
+                fsync_dir(path)
+            except FileNotFoundError:
+                continue
+            self.fsyncs += 1
@@ -0,0 +1,184 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Bucket file formats.
+#
+# Format 1 is a single pickled tuple (format_version, data_version, items).
+# Reading any value means unpickling all of them.
+#
+# Format 2 keeps each value in a separately pickled byte range:
+#
+#   MAGIC | header length (uint32 LE) | header | value blobs
+#
+# The header is a pickled tuple (format_version, data_version, index), where
+# index maps key bytes to (created, expires, offset, length). Offsets are
+# relative to the first byte after the header. To get a single value we
+# unpickle the header and the one blob.
+#
+# Values pickled with out-of-band buffers have the index entry
+# (created, expires, offset, length, buffers_ref). The buffers are kept in
+# a separate blob file.
+#
+# Compressed values have the index entry
+# (created, expires, offset, length, buffers_ref or None, codec_id).
+# The files with such entries have the format version 3 in the header,
+# otherwise the layout is the same.
+
+import pickle
+import struct
+from datetime import datetime
+from typing import *
+
+from pickledir._blobs import BuffersRef, BlobStore, loads_out_of_band, \
+    loads_copied
+from pickledir._codecs import decompress
+
+FORMAT_MAGIC = b'PKD\x02'  # pickle streams start with 0x80, so no confusion
+_PREFIX = struct.Struct('<4sI')
+
+
+class Record(NamedTuple):
+    created: datetime
+    expires: Optional[datetime]
+    data: Any
+
+
+class Encoded:
+    """The pickled value read from a bucket file but not unpickled yet.
+    The records we do not need are written back without decoding."""
+
+    __slots__ = ('blob', 'buffers', 'codec')
+
+    def __init__(self, blob: bytes, buffers: BuffersRef = None,
+                 codec: int = 0):
+        self.blob = blob
+        # the reference to the out-of-band buffers
+        self.buffers = buffers
+        # the id of the codec that compressed the blob
+        self.codec = codec
+
+
+def decode_value(data: Any, blobs: BlobStore = None,
+                 copy_buffers: bool = False) -> Any:
+    # with `copy_buffers` the out-of-band buffers are read into memory
+    # instead of being mapped, so the value can be pickled again
+    if isinstance(data, Encoded):
+        blob = decompress(data.blob, data.codec)
+        if data.buffers is not None:
+            if copy_buffers:
+                return loads_copied(blob, data.buffers, blobs)
+            return loads_out_of_band(blob, data.buffers, blobs)
+        return pickle.loads(blob)
+    return data
+
+
+def encode_value(data: Any) -> Encoded:
+    if isinstance(data, Encoded):
+        return data
+    return Encoded(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+
+def decode_record(rec: Record, blobs: BlobStore = None) -> Record:
+    if isinstance(rec.data, Encoded):
+        return rec._replace(data=decode_value(rec.data, blobs))
+    return rec
+
+
+# (created, expires, offset, length) or
+# (created, expires, offset, length, buffers_ref) or
+# (created, expires, offset, length, buffers_ref or None, codec_id)
+IndexEntry = Tuple
+
+
+def entry_buffers(entry: IndexEntry) -> Optional[BuffersRef]:
+    return entry[4] if len(entry) > 4 else None
+
+
+def entry_codec(entry: IndexEntry) -> int:
+    return entry[5] if len(entry) > 5 else 0
+
+
+class Header(NamedTuple):
+    data_version: Any
+    index: Dict[bytes, IndexEntry]
+    # position of the first value blob in the file
+    data_start: int
+
+
+def read_header(f: BinaryIO) -> Optional[Header]:
+    """Reads the header of a format 2 file from the current position.
+    Returns None if the file has the format 1."""
+    prefix = f.read(_PREFIX.size)
+    if len(prefix) < _PREFIX.size or prefix[:4] != FORMAT_MAGIC:
+        return None
+    _, header_len = _PREFIX.unpack(prefix)
+    (_, data_version, index) = pickle.loads(f.read(header_len))
+    return Header(data_version, index, _PREFIX.size + header_len)
+
+
+def read_blob(f: BinaryIO, header: Header, entry: IndexEntry) -> Encoded:
+    offset, length = entry[2], entry[3]
+    f.seek(header.data_start + offset)
+    return Encoded(f.read(length), entry_buffers(entry), entry_codec(entry))
+
+
+def read_bucket(f: BinaryIO) -> Tuple[Any, Dict[bytes, Record]]:
+    """Reads all the records. The values from format 2 files are returned
+    as `Encoded` objects, the values from format 1 files are unpickled."""
+
+    data = f.read()
+    if data[:4] != FORMAT_MAGIC:
+        (_, data_version, items_dict) = pickle.loads(data)
+        return data_version, {key_bytes: Record(*rec)
+                              for key_bytes, rec in items_dict.items()}
+
+    _, header_len = _PREFIX.unpack_from(data)
+    data_start = _PREFIX.size + header_len
+    (_, data_version, index) = pickle.loads(data[_PREFIX.size:data_start])
+
+    view = memoryview(data)
+    items: Dict[bytes, Record] = dict()
+    for key_bytes, entry in index.items():
+        created, expires, offset, length = entry[:4]
+        start = data_start + offset
+        items[key_bytes] = Record(
+            created, expires,
+            Encoded(bytes(view[start:start + length]),
+                    entry_buffers(entry), entry_codec(entry)))
+    return data_version, items
+
+
+def write_bucket(f: BinaryIO, data_version: Any,
+                 items: Dict[bytes, Record],
+                 encode: Callable[[Any], Encoded] = encode_value) \
+        -> Dict[bytes, Record]:
+    """Writes the records to the file. Returns the same records with
+    the values replaced by their `Encoded` form."""
+    index: Dict[bytes, IndexEntry] = dict()
+    blobs: List[bytes] = []
+    written: Dict[bytes, Record] = dict()
+    offset = 0
+    format_version = 2
+    for key_bytes, rec in items.items():
+        encoded = encode(rec.data)
+        blob = encoded.blob
+        if encoded.codec:
+            format_version = 3
+            index[key_bytes] = (rec.created, rec.expires, offset, len(blob),
+                                encoded.buffers, encoded.codec)
+        elif encoded.buffers is not None:
+            index[key_bytes] = (rec.created, rec.expires, offset, len(blob),
+                                encoded.buffers)
+        else:
+            index[key_bytes] = (rec.created, rec.expires, offset, len(blob))
+        written[key_bytes] = Record(rec.created, rec.expires, encoded)
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = pickle.dumps((format_version, data_version, index),
+                          pickle.HIGHEST_PROTOCOL)
+    f.write(_PREFIX.pack(FORMAT_MAGIC, len(header)))
+    f.write(header)
+    for blob in blobs:
+        f.write(blob)
+    return written
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Generation subdirectories.
+#
+# With `generations=True` the data of each version is kept in its own
+# subdirectory of the root: `root/v1`, `root/v2`. The pointer file
+# `root/pickledir.current` names the subdirectory of the current version.
+# Changing the version only rewrites the pointer, and the reads never find
+# the files of other versions.
+#
+# The other generations are removed by `purge`. Each of them is first
+# renamed to a trash name starting with "~", so it disappears at once
+# (a PickleDir with the old version finds either all of its data or none),
+# and then the files are removed at the given rate.
+
+import hashlib
+import os
+import pickle
+import time
+import uuid
+from pathlib import Path
+from typing import *
+
+from pickledir._durability import Durability
+
+POINTER_BASENAME = 'pickledir.current'
+_PREFIX = 'v'
+_TRASH_PREFIX = '~'
+
+
+def generation_name(version: Any) -> str:
+    if type(version) is int:
+        return f'{_PREFIX}{version}'
+    # the versions of other types are named by the hash
+    return _PREFIX + hashlib.blake2b(pickle.dumps(version, 5),
+                                     digest_size=8).hexdigest()
+
+
+def read_current(root: Path) -> Optional[str]:
+    try:
+        return (root / POINTER_BASENAME).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def switch_generation(root: Path, name: str,
+                      durability: Durability = None) -> Path:
+    """Makes the generation current. Returns its directory."""
+    if read_current(root) != name:
+        durability = durability or Durability()
+        durability.make_dirs(root)
+        temp = root / f'{POINTER_BASENAME}.{uuid.uuid4().hex[:8]}.tmp'
+        with temp.open('w') as f:
+            f.write(name)
+            durability.sync_data(f)
+        temp.replace(root / POINTER_BASENAME)
+        durability.written(root / POINTER_BASENAME)
+    return root / name
+
+
+def _is_generation(name: str) -> bool:
+    return name.startswith(_PREFIX) and '.' not in name
+
+
+def purge_generations(root: Path, keep: Iterable[str],
+                      max_files: int = None,
+                      files_per_second: float = None) -> int:
+    """Removes the generations except `keep` and the current one.
+
+    :param max_files: The maximum number of files to remove. The next call
+    continues the work.
+    :param files_per_second: If set, the removal is slowed down to this
+    rate, so it does not compete with the live traffic for the disk.
+    :return: The number of removed files.
+    """
+    keep = set(keep)
+    try:
+        names = os.listdir(str(root))
+    except FileNotFoundError:
+        return 0
+    current = read_current(root)
+    if current is not None:
+        keep.add(current)
+
+    for name in names:
+        if _is_generation(name) and name not in keep \
+                and (root / name).is_dir():
+            try:
+                (root / name).rename(
+                    root / f'{_TRASH_PREFIX}{name}.{uuid.uuid4().hex[:8]}')
+            except FileNotFoundError:
+                pass  # renamed by another process
+
+    removed = 0
+    interval = 1 / files_per_second if files_per_second else 0
+    for name in os.listdir(str(root)):
+        if not name.startswith(_TRASH_PREFIX):
+            continue
+        for dirpath, dirnames, filenames in os.walk(str(root / name),
+                                                    topdown=False):
+            for filename in filenames:
+                if max_files is not None and removed >= max_files:
+                    return removed
+                try:
+                    os.remove(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                if interval:
+                    time.sleep(interval)
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass  # not empty or removed by another process
+    return removed
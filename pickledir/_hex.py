@@ -1,6 +1,11 @@
 # SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
 # SPDX-License-Identifier: MIT
 import zlib
+from typing import *
+
+# the names of the 4096 buckets. Taking the name from the table is several
+# times faster than formatting the number
+_HEX3 = tuple(f'{i:03x}' for i in range(4096))
 
 
 def padded_hex(x: int, width: int) -> str:
@@ -33,7 +38,40 @@ def hash_4096(data: bytes) -> str:
     # mixing all the bits together:
     # 0xAABBBCCC will be
     # 0x0AA xor 0xBBB xor 0xCCC
+    #
+    # the same as mask_4096(h ^ (h >> 12) ^ (h >> 24))
+
+    return _HEX3[(h ^ (h >> 12) ^ (h >> 24)) & 0xFFF]
+
+
+def hash_hex(data: bytes, digits: int) -> str:
+    # generalization of hash_4096 for 16^digits buckets
+
+    if digits == 3:
+        # the existing data must keep its places
+        return hash_4096(data)
+
+    # Folding the CRC32 into 16 or 20 bits leaves visible gaps for short
+    # similar inputs. Fibonacci hashing mixes the bits better: we multiply
+    # by 2^32/phi and take the highest bits of the product
+
+    bits = digits * 4
+    h = zlib.crc32(data)
+    h = ((h * 0x9E3779B1) & 0xFFFFFFFF) >> (32 - bits)
+    return f'{h:0{digits}x}'
 
-    h = h ^ (h >> 12) ^ (h >> 24)
 
-    return mask_4096(h)  # todo make less calls
+def hash_hex_many(items: Iterable[bytes], digits: int) -> List[str]:
+    """The same as `hash_hex` for each item, but faster for many items."""
+    crc32 = zlib.crc32
+    if digits == 3:
+        table = _HEX3
+        result = []
+        for data in items:
+            h = crc32(data)
+            result.append(table[(h ^ (h >> 12) ^ (h >> 24)) & 0xFFF])
+        return result
+    shift = 32 - digits * 4
+    fmt = f'0{digits}x'
+    return [format(((crc32(data) * 0x9E3779B1) & 0xFFFFFFFF) >> shift, fmt)
+            for data in items]
@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Commit journal of the transactions.
+#
+# A transaction writes the new content of each affected bucket to a
+# temporary file. Then it writes the journal: the list of
+# (temp file, bucket file) pairs, where the temp file is None if the bucket
+# file must be removed. The journal is written to a temporary name and
+# renamed, so it appears complete. That is the commit point. After that
+# the temp files replace the bucket files and the journal is removed.
+#
+# If the process crashes before the journal appears, the temp files are
+# garbage (they are removed like any other temp files). If the process
+# crashes after that, the journal is replayed by the next PickleDir created
+# on the directory.
+
+import os
+import pickle
+import time
+import uuid
+from pathlib import Path
+from typing import *
+
+from pickledir._durability import Durability
+
+JOURNAL_DIRNAME = 'journal'
+
+# (temp file or None, bucket file). The paths are relative to the storage
+# directory
+JournalEntry = Tuple[Optional[str], str]
+
+
+def write_journal(root: Path, entries: List[JournalEntry],
+                  durability: Durability = None) -> Path:
+    durability = durability or Durability()
+    journal_dir = root / JOURNAL_DIRNAME
+    name = uuid.uuid4().hex
+    temp_path = journal_dir / ('~' + name)
+    data = pickle.dumps(entries, pickle.HIGHEST_PROTOCOL)
+    try:
+        f = temp_path.open('wb')
+    except FileNotFoundError:
+        durability.make_dirs(journal_dir)
+        f = temp_path.open('wb')
+    with f:
+        f.write(data)
+        durability.sync_data(f)
+    path = journal_dir / name
+    temp_path.replace(path)
+    durability.written(path)
+    return path
+
+
+def read_journal(path: Path) -> List[JournalEntry]:
+    with path.open('rb') as f:
+        return pickle.loads(f.read())
+
+
+def remove_journal(path: Path):
+    try:
+        os.remove(str(path))
+    except FileNotFoundError:
+        pass
+
+
+def iter_journals(root: Path, remove_unfinished_older: float = None) \
+        -> Iterator[Path]:
+    """Yields the committed journals. The unfinished ones (written by the
+    processes that crashed before the commit point) are removed if they
+    are older than `remove_unfinished_older` seconds."""
+    journal_dir = root / JOURNAL_DIRNAME
+    try:
+        names = os.listdir(str(journal_dir))
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = journal_dir / name
+        if not name.startswith('~'):
+            yield path
+            continue
+        if remove_unfinished_older is None:
+            continue
+        try:
+            if time.time() - path.stat().st_mtime >= remove_unfinished_older:
+                remove_journal(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Pickling the keys.
+#
+# The pickled key is both stored in the files and hashed to choose the
+# bucket, so it must never change. We always pickle with protocol 5.
+#
+# The pickles of the repeated keys are cached for the single-key operations.
+# The cache only contains the keys of the exact types str, bytes and int:
+# the equal keys of these types are always pickled to the same bytes.
+# That is not true for the equal keys of other types: 1, 1.0 and True
+# are equal, but their pickles differ.
+#
+# A cache miss costs about twice as much as pickling, so the bulk
+# operations, where the keys rarely repeat, pickle without the cache.
+
+import pickle
+from typing import *
+
+# longer keys are not cached, so the cache does not take much memory
+_MAX_CACHED_LENGTH = 256
+_MAX_CACHED_KEYS = 65536
+
+_cache: Dict[Any, bytes] = dict()
+
+
+def pickle_key(key: Any) -> bytes:
+    # Protocol version 5 was added in Python 3.8. It adds support for
+    # out-of-band data and speedup for in-band data.
+
+    # We must be sure that the hashes will be the same even if user
+    # upgrades Python to a newer version. So for the keys protocol
+    # is always 5
+    return pickle.dumps(key, 5)
+
+
+def key_to_bytes(key: Any) -> bytes:
+    """The same as `pickle_key`, but the common keys are cached."""
+    t = type(key)
+    if t is not str and t is not int and t is not bytes:
+        # the lookup is only made for the cacheable keys: otherwise
+        # the key 1.0 would find the pickle of 1
+        return pickle.dumps(key, 5)
+    data = _cache.get(key)
+    if data is None:
+        data = pickle.dumps(key, 5)
+        if t is int or len(key) <= _MAX_CACHED_LENGTH:
+            if len(_cache) >= _MAX_CACHED_KEYS:
+                _cache.clear()
+            _cache[key] = data
+    return data
@@ -0,0 +1,117 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import json
+import os
+from pathlib import Path
+from typing import *
+
+from pickledir._durability import Durability
+from pickledir._hex import hash_hex
+
+DEFAULT_BUCKETS = 4096
+
+# the metadata file is only written when the layout differs from the
+# default one, so the directories created by the older versions of the
+# library have no metadata and are still valid
+META_BASENAME = 'pickledir.meta'
+
+_DIGITS_BY_BUCKETS = {16 ** 3: 3, 16 ** 4: 4, 16 ** 5: 5}
+
+
+class Layout:
+    """Maps the keys to the bucket files.
+
+    The default layout with 4096 buckets keeps all the files in a single
+    directory: `dir/abc`. The larger layouts split the hash into a two-digit
+    subdirectory and the rest: `dir/ab/cd` or `dir/ab/cde`. Thus no
+    directory contains more than 4096 entries.
+    """
+
+    def __init__(self, buckets: int = DEFAULT_BUCKETS):
+        if buckets not in _DIGITS_BY_BUCKETS:
+            raise ValueError(
+                f"Unsupported number of buckets: {buckets}. Expected one of "
+                f"{sorted(_DIGITS_BY_BUCKETS)}")
+        self.buckets = buckets
+        self.digits = _DIGITS_BY_BUCKETS[buckets]
+
+    def __eq__(self, other):
+        return isinstance(other, Layout) and other.buckets == self.buckets
+
+    def __hash__(self):
+        return hash(self.buckets)
+
+    def __repr__(self):
+        return f"Layout({self.buckets})"
+
+    @property
+    def is_flat(self) -> bool:
+        return self.digits == 3
+
+    def key_bytes_to_hash(self, key_bytes: bytes) -> str:
+        return hash_hex(key_bytes, self.digits)
+
+    def hash_to_file(self, root: Path, h: str) -> Path:
+        if self.is_flat:
+            return root / h
+        return root / h[:2] / h[2:]
+
+    def is_data_basename(self, basename: str) -> bool:
+        length = self.digits if self.is_flat else self.digits - 2
+        if basename.startswith('~'):
+            return True
+        return len(basename) == length and basename.isalnum()
+
+    def iter_files(self, root: Path) -> Iterator[Path]:
+        """Yields the bucket files and the temporary files of this layout.
+        Other files are ignored."""
+        if self.is_flat:
+            dirs = [root]
+        else:
+            try:
+                dirs = [root / d for d in os.listdir(str(root))
+                        if len(d) == 2 and d.isalnum()
+                        and (root / d).is_dir()]
+            except FileNotFoundError:
+                return
+        for d in dirs:
+            try:
+                names = os.listdir(str(d))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if self.is_data_basename(name) and (d / name).is_file():
+                    yield d / name
+
+
+class Meta(NamedTuple):
+    layout: Layout
+    # during resharding the data is moved from the previous layout
+    # to the current one
+    previous: Optional[Layout] = None
+
+
+def read_meta(dirpath: Path) -> Optional[Meta]:
+    try:
+        text = (dirpath / META_BASENAME).read_text()
+    except FileNotFoundError:
+        return None
+    d = json.loads(text)
+    previous = d.get('previous')
+    return Meta(Layout(d['buckets']),
+                Layout(previous) if previous else None)
+
+
+def write_meta(dirpath: Path, meta: Meta, durability: Durability = None):
+    d: Dict[str, Any] = {'buckets': meta.layout.buckets}
+    if meta.previous is not None:
+        d['previous'] = meta.previous.buckets
+    durability = durability or Durability()
+    durability.make_dirs(dirpath)
+    temp = dirpath / (META_BASENAME + '.tmp')
+    with temp.open('w') as f:
+        f.write(json.dumps(d))
+        durability.sync_data(f)
+    temp.replace(dirpath / META_BASENAME)
+    durability.written(dirpath / META_BASENAME)
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Advisory inter-process file locks. The lock files are created on demand
+# and never removed: removing a lock file while another process waits
+# for it would let two processes hold "the same" lock.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import *
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# the locks held by the current thread. Taking the same lock again
+# in the same thread does nothing instead of deadlocking
+_held = threading.local()
+
+
+def _open(path: Path) -> int:
+    flags = os.O_RDWR | os.O_CREAT
+    try:
+        return os.open(str(path), flags)
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return os.open(str(path), flags)
+
+
+def _try_lock(fd: int, shared: bool) -> bool:
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                        | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+    try:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def file_lock(path: Path, shared: bool = False,
+              blocking: bool = True) -> Iterator[bool]:
+    """Holds the lock while in the context.
+
+    The lock is also exclusive between the threads of the same process:
+    each call opens its own file descriptor, and `flock` locks are bound
+    to the descriptors. Nested calls for the same path in the same thread
+    are allowed. On Windows the shared locks are exclusive.
+
+    With `blocking=False` does not wait for the lock. The context value is
+    True if the lock is acquired, False otherwise.
+    """
+    held: Set[str] = _held.__dict__.setdefault('paths', set())
+    key = str(path)
+    if key in held:
+        yield True
+        return
+
+    fd = _open(path)
+    try:
+        if not blocking:
+            if not _try_lock(fd, shared):
+                yield False
+                return
+        elif fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    # LK_LOCK gives up after 10 seconds, so we retry
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.01)
+        held.add(key)
+        try:
+            yield True
+        finally:
+            held.discard(key)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
@@ -0,0 +1,264 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Append-only log of writes.
+#
+# The log is a sequence of numbered segment files in the "segments"
+# subdirectory. Each write appends a frame to the last segment:
+#
+#   meta length (uint32 LE) | blob length (uint32 LE) | meta | blob
+#
+# where meta is a pickled (key_bytes, created, expires, deleted, buffers)
+# or (key_bytes, created, expires, deleted, buffers, codec_id) for the
+# compressed values, and blob is the pickled value (empty for deletions).
+#
+# The frames of an atomic batch have the meta
+# (key_bytes, created, expires, deleted, buffers, codec_id, batch), where
+# batch is (batch id, number of the frames after this one). They are
+# indexed only when the last frame of the batch is read. A batch cut short
+# by a crash is followed by the frames of another batch and is ignored.
+#
+# The index of the log (key -> position of the last frame) is kept in
+# memory and updated by reading the frames appended since the last read,
+# including the frames appended by other processes.
+
+import os
+import pickle
+import struct
+import uuid
+from pathlib import Path
+from typing import *
+
+from pickledir._durability import Durability
+from pickledir._format import Record, Encoded
+
+SEGMENTS_DIRNAME = 'segments'
+
+_FRAME = struct.Struct('<II')
+
+
+class LogEntry(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+    record: Record  # the data is None here, it is read by `AppendLog.read`
+    deleted: bool
+    buffers: Any
+    codec: int = 0
+
+
+def _segment_name(n: int) -> str:
+    return f'{n:08d}'
+
+
+class AppendLog:
+
+    def __init__(self, root: Path, segment_bytes: int,
+                 durability: Durability = None):
+        self.root = root / SEGMENTS_DIRNAME
+        self.segment_bytes = segment_bytes
+        self._durability = durability or Durability()
+        self.index: Dict[bytes, LogEntry] = dict()
+        # how many bytes of each segment are already indexed
+        self._scanned: Dict[int, int] = dict()
+        # where the last complete frame of each segment ends
+        self._ends: Dict[int, int] = dict()
+
+    def segments(self) -> List[int]:
+        try:
+            names = os.listdir(str(self.root))
+        except FileNotFoundError:
+            return []
+        return sorted(int(n) for n in names if n.isdigit())
+
+    def _path(self, segment: int) -> Path:
+        return self.root / _segment_name(segment)
+
+    def size(self) -> int:
+        """The total size of the segment files in bytes."""
+        total = 0
+        for segment in self.segments():
+            try:
+                total += os.stat(str(self._path(segment))).st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def refresh(self):
+        """Indexes the frames appended since the last call."""
+        segments = self.segments()
+
+        gone = set(self._scanned) - set(segments)
+        if gone:
+            # the segments were compacted (maybe by another process)
+            for s in gone:
+                del self._scanned[s]
+                self._ends.pop(s, None)
+            self.index = {k: e for k, e in self.index.items()
+                          if e.segment not in gone}
+
+        for segment in segments:
+            scanned = self._scanned.get(segment, 0)
+            try:
+                if os.stat(str(self._path(segment))).st_size == scanned:
+                    continue
+                frames, consumed, end = self._read_frames(segment, scanned)
+            except FileNotFoundError:
+                continue
+            self._scanned[segment] = scanned + consumed
+            self._ends[segment] = scanned + end
+            for key_bytes, entry in frames:
+                old = self.index.get(key_bytes)
+                if old is None or (old.segment, old.offset) \
+                        < (entry.segment, entry.offset):
+                    self.index[key_bytes] = entry
+
+    def _read_frames(self, segment: int, start: int = 0) \
+            -> Tuple[List[Tuple[bytes, LogEntry]], int, int]:
+        # Returns the frames, the number of bytes they take and the number
+        # of bytes taken by all the complete frames. An incomplete frame or
+        # batch at the end is being written right now, it will be read
+        # next time
+        with self._path(segment).open('rb') as f:
+            f.seek(start)
+            data = f.read()
+
+        frames = []
+        # the frames of the batch which last frame is not read yet
+        pending = []
+        pending_id = None
+        pending_pos = 0
+        pos = 0
+        while pos + _FRAME.size <= len(data):
+            meta_len, blob_len = _FRAME.unpack_from(data, pos)
+            end = pos + _FRAME.size + meta_len + blob_len
+            if end > len(data):
+                break
+            meta_start = pos + _FRAME.size
+            meta = pickle.loads(data[meta_start:meta_start + meta_len])
+            (key_bytes, created, expires, deleted, buffers) = meta[:5]
+            frame = (key_bytes,
+                     LogEntry(segment, start + pos, end - pos,
+                              Record(created, expires, None),
+                              deleted, buffers,
+                              meta[5] if len(meta) > 5 else 0))
+            batch = meta[6] if len(meta) > 6 else None
+            if pending and (batch is None or batch[0] != pending_id):
+                # the batch was not completed
+                pending = []
+            if batch is None:
+                frames.append(frame)
+            elif batch[1] > 0:
+                if not pending:
+                    pending_id, pending_pos = batch[0], pos
+                pending.append(frame)
+            else:
+                frames.extend(pending)
+                frames.append(frame)
+                pending = []
+            pos = end
+        if pending:
+            # the rest of the batch is being written right now
+            return frames, pending_pos, pos
+        return frames, pos, pos
+
+    def iter_frames(self, segments: Iterable[int]) \
+            -> Iterator[Tuple[bytes, LogEntry]]:
+        """Yields all the frames of the segments, including the
+        overwritten ones."""
+        for segment in segments:
+            try:
+                frames, _, _ = self._read_frames(segment)
+            except FileNotFoundError:
+                continue
+            yield from frames
+
+    def read(self, entry: LogEntry) -> Record:
+        """Returns the record with the value as `Encoded`.
+        Raises FileNotFoundError if the segment was compacted."""
+        with self._path(entry.segment).open('rb') as f:
+            f.seek(entry.offset)
+            data = f.read(entry.length)
+        meta_len, blob_len = _FRAME.unpack_from(data)
+        blob = data[_FRAME.size + meta_len:]
+        return entry.record._replace(
+            data=Encoded(blob, entry.buffers, entry.codec))
+
+    def append(self, frames: List[Tuple[bytes, Record, Optional[Encoded]]],
+               atomic: bool = False) -> int:
+        """Appends the frames with a single write. Each frame is a tuple
+        (key_bytes, record, encoded value or None for deletion). Returns
+        the number of bytes written.
+
+        If `atomic` is True, the readers see either all the frames or none
+        of them, even if the writing process crashes halfway."""
+        batch_id = uuid.uuid4().hex[:16] if atomic and len(frames) > 1 \
+            else None
+        chunks = []
+        for i, (key_bytes, rec, encoded) in enumerate(frames):
+            blob = encoded.blob if encoded is not None else b''
+            buffers = encoded.buffers if encoded is not None else None
+            meta = (key_bytes, rec.created, rec.expires, encoded is None,
+                    buffers)
+            codec = encoded.codec if encoded is not None else 0
+            if batch_id is not None:
+                meta += (codec, (batch_id, len(frames) - 1 - i))
+            elif codec:
+                meta += (codec,)
+            meta = pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+            chunks.append(_FRAME.pack(len(meta), len(blob)))
+            chunks.append(meta)
+            chunks.append(blob)
+
+        self.refresh()
+        segments = self.segments()
+        segment = segments[-1] if segments else 1
+        path = self._path(segment)
+        try:
+            size = path.stat().st_size
+            # the segment may end with an incomplete frame left by
+            # a crashed writer. The frames appended after it would be
+            # unreadable
+            if size >= self.segment_bytes \
+                    or size != self._ends.get(segment, 0):
+                segment = self._create_segment(segment + 1)
+        except FileNotFoundError:
+            segment = self._create_segment(segment)
+
+        data = b''.join(chunks)
+        path = self._path(segment)
+        with path.open('ab') as f:
+            f.write(data)
+            self._durability.sync_data(f)
+        self._durability.written(path, len(data), new_entry=False)
+        self.refresh()
+        return len(data)
+
+    def _create_segment(self, segment: int) -> int:
+        self._durability.make_dirs(self.root)
+        try:
+            self._path(segment).open('xb').close()
+        except FileExistsError:
+            pass  # created by another process
+        else:
+            self._durability.written(self._path(segment))
+        return segment
+
+    def seal(self) -> List[int]:
+        """Starts a new segment for the future writes. Returns the numbers
+        of the previous segments, that will not change anymore."""
+        self.refresh()
+        segments = self.segments()
+        if not segments:
+            return []
+        self._create_segment(segments[-1] + 1)
+        self.refresh()
+        return segments
+
+    def remove_segments(self, segments: Iterable[int]):
+        for s in segments:
+            try:
+                os.remove(str(self._path(s)))
+            except FileNotFoundError:
+                pass
+        self.refresh()
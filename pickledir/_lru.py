@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import *
+
+# (st_mtime_ns, st_size, st_ino). When another process replaces the file,
+# at least the inode changes
+Signature = Tuple[int, int, int]
+
+
+def file_signature(st: os.stat_result) -> Signature:
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class LruCache:
+    """Keeps the recently used bucket contents in memory. Each entry is
+    valid only while the file has the same signature.
+
+    The size is limited by the number of entries, by their total
+    approximate size in bytes, or by both.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: 'OrderedDict[Path, Tuple[Signature, Any, int]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path: Path, signature: Signature) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            if entry[0] != signature:
+                self._remove(path)
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path: Path, signature: Signature, value: Any, size: int):
+        with self._lock:
+            self._remove(path)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[path] = (signature, value, size)
+            self.total_bytes += size
+            while (self.max_entries is not None
+                   and len(self._entries) > self.max_entries) \
+                    or (self.max_bytes is not None
+                        and self.total_bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def discard(self, path: Path):
+        with self._lock:
+            self._remove(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, path: Path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
@@ -0,0 +1,189 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Caching the results of functions.
+#
+# When several callers miss the same key at once, only one of them computes
+# the value. The others wait for it on a lock file and then read the value
+# from the storage. The lock files are shared by the keys with the same
+# hash, so their number is limited.
+
+import asyncio
+import functools
+import inspect
+import threading
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import *
+
+from pickledir._hex import hash_hex
+from pickledir._lock import file_lock
+
+if TYPE_CHECKING:
+    from pickledir._pickledir import PickleDir
+
+LOCKS_DIRNAME = 'memoize'
+
+# how often a coroutine checks the lock held by another process
+_POLL_INTERVAL = 0.005
+
+
+@asynccontextmanager
+async def _async_file_lock(path: Path, blocking: bool = True) \
+        -> AsyncIterator[bool]:
+    # the file lock is polled, so the event loop is not blocked
+    while True:
+        with file_lock(path, blocking=False) as acquired:
+            if acquired or not blocking:
+                yield acquired
+                return
+        await asyncio.sleep(_POLL_INTERVAL)
+
+
+class _Memoized:
+
+    def __init__(self, store: 'PickleDir', func: Callable,
+                 max_age: Optional[timedelta], version: Any,
+                 stale: Optional[timedelta]):
+        self.store = store
+        self.func = func
+        self.max_age = max_age
+        self.version = version
+        self.stale = stale
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        # the records are kept while they can be served as stale
+        self.keep = max_age + stale if max_age and stale else max_age
+        # in-process locks of the coroutines by the key, with the numbers
+        # of the coroutines using them. The file locks are per thread, so
+        # they do not separate the coroutines
+        self._async_locks: Dict[bytes, List] = dict()
+        self._async_locks_guard = threading.Lock()
+
+    def key(self, args: tuple, kwargs: dict) -> Any:
+        return ('memoize', self.name, self.version, args,
+                tuple(sorted(kwargs.items())))
+
+    def _lock_path(self, key: Any) -> Path:
+        key_bytes = self.store._key_to_bytes(key)
+        return self.store.dirpath / 'locks' / LOCKS_DIRNAME / \
+            hash_hex(key_bytes, 4)
+
+    def _lookup(self, key: Any) -> Tuple[bool, Any]:
+        # returns (is fresh, record or None)
+        rec = self.store._get_record(key)
+        if rec is None:
+            return False, None
+        if self.max_age is None:
+            return True, rec
+        return self.store._now() - rec.created < self.max_age, rec
+
+    def _compute(self, key: Any, args: tuple, kwargs: dict) -> Any:
+        value = self.func(*args, **kwargs)
+        self.store.set(key, value, max_age=self.keep)
+        return value
+
+    def call(self, args: tuple, kwargs: dict) -> Any:
+        key = self.key(args, kwargs)
+        fresh, rec = self._lookup(key)
+        if fresh:
+            return rec.data
+
+        lock_path = self._lock_path(key)
+        if rec is not None and self.stale is not None:
+            # the value is stale. One caller refreshes it, the others
+            # return the stale value without waiting
+            with file_lock(lock_path, blocking=False) as acquired:
+                if not acquired:
+                    return rec.data
+                return self._compute(key, args, kwargs)
+
+        with file_lock(lock_path):
+            # the value may be computed while we waited for the lock
+            fresh, rec = self._lookup(key)
+            if fresh:
+                return rec.data
+            return self._compute(key, args, kwargs)
+
+    def _acquire_async_lock(self, key_bytes: bytes) -> asyncio.Lock:
+        with self._async_locks_guard:
+            entry = self._async_locks.get(key_bytes)
+            if entry is None:
+                entry = self._async_locks[key_bytes] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _release_async_lock(self, key_bytes: bytes):
+        with self._async_locks_guard:
+            entry = self._async_locks[key_bytes]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._async_locks[key_bytes]
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, func, *args)
+
+    async def _compute_async(self, key: Any, args: tuple,
+                             kwargs: dict) -> Any:
+        value = await self.func(*args, **kwargs)
+        await self._run(functools.partial(self.store.set, key, value,
+                                          max_age=self.keep))
+        return value
+
+    async def call_async(self, args: tuple, kwargs: dict) -> Any:
+        key = self.key(args, kwargs)
+        fresh, rec = await self._run(self._lookup, key)
+        if fresh:
+            return rec.data
+
+        key_bytes = self.store._key_to_bytes(key)
+        lock_path = self._lock_path(key)
+        lock = self._acquire_async_lock(key_bytes)
+        try:
+            if rec is not None and self.stale is not None:
+                if lock.locked():
+                    return rec.data
+                async with lock:
+                    async with _async_file_lock(lock_path,
+                                                blocking=False) as acquired:
+                        if not acquired:
+                            return rec.data
+                        return await self._compute_async(key, args, kwargs)
+
+            async with lock:
+                async with _async_file_lock(lock_path):
+                    fresh, rec = await self._run(self._lookup, key)
+                    if fresh:
+                        return rec.data
+                    return await self._compute_async(key, args, kwargs)
+        finally:
+            self._release_async_lock(key_bytes)
+
+    def invalidate(self, args: tuple, kwargs: dict):
+        try:
+            del self.store[self.key(args, kwargs)]
+        except (KeyError, FileNotFoundError):
+            pass
+
+
+def memoize(store: 'PickleDir', func: Callable,
+            max_age: Optional[timedelta], version: Any,
+            stale: Optional[timedelta]) -> Callable:
+    memoized = _Memoized(store, func, max_age, version, stale)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await memoized.call_async(args, kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return memoized.call(args, kwargs)
+
+    def invalidate(*args, **kwargs):
+        """Removes the cached result of the call with the arguments."""
+        memoized.invalidate(args, kwargs)
+
+    wrapper.invalidate = invalidate
+    return wrapper
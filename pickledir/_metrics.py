@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Optional instrumentation. When the metrics are disabled, the storage keeps
+# None instead of the Metrics object and the only cost is that check.
+
+import functools
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import *
+
+# upper bounds of the latency histogram buckets, in seconds. The last bucket
+# is unbounded
+LATENCY_BOUNDS: Tuple[float, ...] = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# callback(kind, name, value): kind is "counter" (value is the increment)
+# or "timing" (value is the duration in seconds)
+MetricsCallback = Callable[[str, str, float], None]
+
+
+class BucketStats(NamedTuple):
+    records: int  # actual records
+    expired: int  # expired records not removed yet
+    size: int  # file size in bytes
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """The upper bound of the bucket that contains the quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BOUNDS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict(zip(LATENCY_BOUNDS + (float('inf'),),
+                                    self.counts)),
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+
+class Metrics:
+    """Counters and latency histograms of a storage.
+
+    Counters: "get.hit", "get.miss", "files.read", "files.written",
+    "bytes.read", "bytes.written", "lru.hit", "expired" (records found
+    expired when reading the files).
+
+    Timings: "get", "set", "delete", "get_many", "set_many", "delete_many",
+    "update" (including `incr`), "compare_and_set", "scan", "items".
+
+    :param callback: Called as `callback(kind, name, value)` on each update,
+    where kind is "counter" or "timing". Can be used to forward the
+    metrics to StatsD or Prometheus clients.
+    """
+
+    def __init__(self, callback: MetricsCallback = None):
+        self.callback = callback
+        self.counters: Dict[str, int] = dict()
+        self.timings: Dict[str, Histogram] = dict()
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback is not None:
+            self.callback('counter', name, n)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            hist = self.timings.get(name)
+            if hist is None:
+                hist = self.timings[name] = Histogram()
+            hist.observe(seconds)
+        if self.callback is not None:
+            self.callback('timing', name, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'timings': {name: hist.as_dict()
+                                for name, hist in self.timings.items()}}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+def timed(name: str):
+    """Decorates a method of an object with the `_metrics` attribute."""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self._metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            started = perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.observe(name, perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_iter(metrics: Optional[Metrics], name: str,
+               iterator: Iterator) -> Iterator:
+    """Observes the time from the first to the last item."""
+    if metrics is None:
+        return iterator
+
+    def generator():
+        started = perf_counter()
+        try:
+            yield from iterator
+        finally:
+            metrics.observe(name, perf_counter() - started)
+
+    return generator()
@@ -1,44 +1,253 @@
 # SPDX-FileCopyrightText: (c) 2016 Artёm IG <github.com/rtmigo>
 # SPDX-License-Identifier: MIT
 
+import io
 import os
 import pickle
+import uuid
+import weakref
+from concurrent.futures import Executor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from typing import *
 
-from pickledir._hex import hash_4096
+from pickledir._blobs import BlobStore, dumps_out_of_band, inline_out_of_band
+from pickledir._codecs import Codec, get_codec, compress, decompress
+from pickledir._dedup import encode_deduplicated
+from pickledir._durability import Durability
+# format 1 files refer to the Record class as pickledir._pickledir.Record,
+# so the name must remain importable from this module
+from pickledir._format import Record, read_bucket, write_bucket, \
+    read_header, read_blob, decode_value, decode_record, encode_value, \
+    Encoded, entry_buffers
+from pickledir._generations import generation_name, switch_generation, \
+    purge_generations
+from pickledir._hex import hash_4096, hash_hex_many
+from pickledir._keys import key_to_bytes, pickle_key
+from pickledir._journal import write_journal, read_journal, remove_journal, \
+    iter_journals
+from pickledir._lock import file_lock
+from pickledir._log import AppendLog
+from pickledir._lru import LruCache, file_signature
+from pickledir._memoize import memoize
+from pickledir._metrics import Metrics, BucketStats, timed, timed_iter
+from pickledir._scan import parallel_scan, create_executor, key_matches
+from pickledir._snapshot import PickleDirSnapshot, write_snapshot
+from pickledir._stream import StreamWriter, open_stream, is_stream
+from pickledir._sweep import Sweeper, RecordStat
+from pickledir._transaction import Transaction
+from pickledir._layout import Layout, Meta, read_meta, write_meta, \
+    DEFAULT_BUCKETS, META_BASENAME
 
 TKey = TypeVar('TKey')
 TValue = TypeVar('TValue')
 
+# returned when the key has no records in the append-only log
+_NOT_LOGGED = object()
+# returned by the functions passed to `_modify` to skip the write
+_UNCHANGED = object()
 
-class Record(NamedTuple):
-    created: datetime
-    expires: Optional[datetime]
-    data: Any
+_MAX_CACHED_PATHS = 65536
+
+EXPIRY_POLICIES = ('lazy', 'deferred', 'none')
+
+
+class _TempFile(NamedTuple):
+    path: Path
+    stat: os.stat_result
+    written: Dict[bytes, Record]
+    # the blobs referenced by the file being replaced
+    previous_blobs: Set[str]
 
 
 class PickleDir(Generic[TKey, TValue]):
     """Key-value file storage for objects serializable by pickle.
     Objects are identified by arbitrary string keys.
     Optionally, each object can be associated with its expiration date.
+
+    :param buckets: The number of bucket files: 4096 (default), 65536 or
+    1048576. A non-default value is saved to the metadata file inside the
+    directory, so it only needs to be specified when the directory is
+    created. To change the number of buckets of an existing storage,
+    use `reshard`.
+
+    :param lru_buckets: If set, up to this number of recently read files
+    are kept in memory.
+
+    :param lru_bytes: If set, recently read files are kept in memory while
+    their total size does not exceed this number.
+
+    The files kept in memory are checked for changes (by their modification
+    time, size and inode) on each access, so the writes from other processes
+    are not missed.
+
+    :param oob_threshold: If set, the buffers of this size or larger (such
+    as the data of NumPy arrays) are pickled out-of-band and saved to
+    separate blob files. They are read back as memory-mapped `memoryview`
+    objects without copying.
+
+    :param concurrent: If True, the read-modify-write operations on each
+    file are protected by an inter-process lock, so several processes can
+    write to the same directory without losing updates.
+
+    :param append_only: If True, the writes are appended to the log files
+    in the "segments" subdirectory instead of rewriting the bucket files.
+    The log is moved to the bucket files by `compact`. All the objects using
+    the directory must be created with the same value of the argument.
+
+    :param segment_bytes: The size after which a new log file is started.
+
+    :param max_items: If set, `sweep` evicts the oldest records (by the time
+    they were written) to keep the number of items within the limit.
+
+    :param max_bytes: If set, `sweep` evicts the oldest records to keep the
+    approximate size of the values within the limit.
+
+    :param codec: Compression of the pickled values: "pickle" (none,
+    default), "zlib", "lzma" or a `Codec` object with the level and the
+    minimum size of the values to compress. The records written with any
+    codec can be read regardless of this argument.
+
+    :param metrics: If True or a `Metrics` object, the operations are
+    counted and timed. The results are available as `metrics.snapshot()`.
+
+    :param expiry: What the reads do when they find the expired records or
+    the files written with other data versions. With "lazy" (default) the
+    file is rewritten or removed right away. With "deferred" the file is
+    queued for `flush_expired`, and with "none" it is left as is until it
+    is written or swept. With the last two the reads never write.
+
+    :param durability: "none" (default) leaves flushing the written files
+    to the operating system, so after a power loss a recently written file
+    may come back empty or truncated. With "fsync" each write returns after
+    the file and its directory are fsynced. With "group" the written files
+    are fsynced together once per `group_interval` seconds, or when
+    `group_bytes` are written, or on `sync`: the writes are faster, but the
+    writes of the last window may be lost.
+
+    :param generations: If True, the data of each version is kept in its
+    own subdirectory, and changing the version takes no time. The data of
+    the other versions is removed by `purge_generations` instead of the
+    reads. All the objects using the directory must be created with the
+    same value of the argument.
+
+    :param dedup_threshold: If set, the values pickled to this size or
+    larger are saved to blob files named by the hash of their content, so
+    the equal values written under different keys are stored once. Such
+    files are not removed with the records, they are removed by
+    `collect_blobs`. With `oob_threshold`, the out-of-band buffers taking
+    this size or more are shared the same way and remain memory-mapped
+    on reading.
     """
 
-    def __init__(self, dirpath: Union[str, Path], version: int = 1):
+    def __init__(self, dirpath: Union[str, Path], version: int = 1,
+                 buckets: int = None,
+                 lru_buckets: int = None, lru_bytes: int = None,
+                 oob_threshold: int = None, concurrent: bool = False,
+                 append_only: bool = False,
+                 segment_bytes: int = 64 * 1024 * 1024,
+                 max_items: int = None, max_bytes: int = None,
+                 codec: Union[Codec, str] = None,
+                 metrics: Union[bool, Metrics] = False,
+                 expiry: str = 'lazy', durability: str = 'none',
+                 group_interval: float = 0.1,
+                 group_bytes: int = 16 * 1024 * 1024,
+                 generations: bool = False, dedup_threshold: int = None):
 
-        self.dirpath = Path(dirpath)
         self.version = version
+        self._durability = Durability(durability, interval=group_interval,
+                                      max_bytes=group_bytes)
+        if durability == 'group':
+            # the last window is synced when the program exits
+            weakref.finalize(self, self._durability.sync)
+        # the directory passed to the constructor
+        self.root = Path(dirpath)
+        self.generations = generations
+        # the directory with the data of this version
+        self.dirpath = self.root
+        if generations:
+            self.dirpath = switch_generation(
+                self.root, generation_name(version), self._durability)
+        # the metadata file is checked for changes before accessing the
+        # buckets, so the resharding by other objects is not missed
+        self._meta_signature = self._read_meta_signature()
+        self._meta = self._init_meta(buckets)
+        # the bucket file paths by the number of buckets and the hash
+        self._paths: Dict[int, Dict[str, Path]] = dict()
+        self._lru: Optional[LruCache] = None
+        if lru_buckets is not None or lru_bytes is not None:
+            self._lru = LruCache(max_entries=lru_buckets, max_bytes=lru_bytes)
+        self.oob_threshold = oob_threshold
+        self.dedup_threshold = dedup_threshold
+        self._blobs = BlobStore(self.dirpath, self._durability)
+        self.concurrent = concurrent
+        self._log: Optional[AppendLog] = None
+        if append_only:
+            self._log = AppendLog(self.dirpath, segment_bytes,
+                                  self._durability)
+        self._sweeper = Sweeper(max_items=max_items, max_bytes=max_bytes)
+        self.codec = get_codec(codec)
+        self._metrics: Optional[Metrics] = \
+            Metrics() if metrics is True else (metrics or None)
+        if expiry not in EXPIRY_POLICIES:
+            raise ValueError(f"Unknown expiry policy: {expiry!r}")
+        self.expiry = expiry
+        # the files to be cleaned by `flush_expired`
+        self._deferred: Set[Path] = set()
+        if self._log is None:
+            self._recover()
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        return self._metrics
+
+    def _init_meta(self, buckets: Optional[int]) -> Meta:
+        meta = read_meta(self.dirpath)
+        if meta is not None:
+            if buckets is not None and buckets != meta.layout.buckets:
+                raise ValueError(
+                    f"The storage has {meta.layout.buckets} buckets, "
+                    f"not {buckets}. Use reshard() to change the number.")
+            return meta
+
+        meta = Meta(Layout())
+        if buckets is None or buckets == DEFAULT_BUCKETS:
+            return meta
+
+        if any(True for _ in meta.layout.iter_files(self.dirpath)):
+            raise ValueError(
+                f"The storage already has {DEFAULT_BUCKETS} buckets. "
+                f"Use reshard() to change the number.")
+        meta = Meta(Layout(buckets))
+        write_meta(self.dirpath, meta, self._durability)
+        return meta
+
+    def _read_meta_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(str(self.dirpath / META_BASENAME))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _refresh_meta(self) -> Meta:
+        # returns the current layout. Another object (maybe in another
+        # process) may have started or finished the resharding. The file
+        # is replaced on each change, so the stat is enough to notice it
+        signature = self._read_meta_signature()
+        if signature != self._meta_signature:
+            self._meta_signature = signature
+            self._meta = read_meta(self.dirpath) or Meta(Layout())
+        return self._meta
+
+    @property
+    def buckets(self) -> int:
+        return self._refresh_meta().layout.buckets
 
     @staticmethod
     def _key_to_bytes(key: TKey) -> bytes:
-        # Protocol version 5 was added in Python 3.8. It adds support for
-        # out-of-band data and speedup for in-band data.
-
-        # We must be sure that the hashes will be the same even if user
-        # upgrades Python to a newer version. So for the keys protocol
-        # is always 5
-        return pickle.dumps(key, 5)
+        # always pickled with protocol 5. The repeated keys are cached
+        return key_to_bytes(key)
 
     @staticmethod
     def _bytes_to_key(data: bytes) -> TKey:
@@ -49,102 +258,1266 @@ class PickleDir(Generic[TKey, TValue]):
         return hash_4096(key_bytes)
 
     def _key_bytes_to_file(self, key: bytes) -> Path:
-        return self.dirpath / self._key_bytes_to_hash(key)
+        meta = self._refresh_meta()
+        if meta.previous is not None:
+            # resharding is in progress. Before accessing the key we make
+            # sure its old bucket was moved to the new layout
+            self._migrate_bucket(self._hash_to_file(
+                meta.previous, meta.previous.key_bytes_to_hash(key)))
+        return self._hash_to_file(meta.layout,
+                                  meta.layout.key_bytes_to_hash(key))
+
+    def _key_bytes_to_files(self, keys: List[bytes]) -> List[Path]:
+        # the same as `_key_bytes_to_file` for each key, but faster
+        meta = self._refresh_meta()
+        if meta.previous is not None:
+            for h in set(hash_hex_many(keys, meta.previous.digits)):
+                self._migrate_bucket(self._hash_to_file(meta.previous, h))
+        layout = meta.layout
+        hash_to_file = self._hash_to_file
+        return [hash_to_file(layout, h)
+                for h in hash_hex_many(keys, layout.digits)]
+
+    def _hash_to_file(self, layout: Layout, h: str) -> Path:
+        # the paths are cached: building a Path takes longer than hashing
+        # the key
+        paths = self._paths.get(layout.buckets)
+        if paths is None:
+            paths = self._paths[layout.buckets] = dict()
+        path = paths.get(h)
+        if path is None:
+            if len(paths) >= _MAX_CACHED_PATHS:
+                paths.clear()
+            path = paths[h] = layout.hash_to_file(self.dirpath, h)
+        return path
+
+    def _bucket_lock(self, filepath: Path):
+        # in concurrent mode, returns the lock protecting the read-modify-write
+        # of the bucket file. The lock files are kept in the "locks"
+        # subdirectory with the same relative paths as the buckets
+        if not self.concurrent:
+            return nullcontext()
+        name = filepath.name
+        if self._is_temp_filename(filepath):
+            # "~abc.pid.random" is locked together with "abc"
+            name = name[1:].split('.')[0]
+        relative = filepath.parent.relative_to(self.dirpath) / name
+        return self._locked_bucket(self.dirpath / 'locks' / relative)
+
+    @contextmanager
+    def _locked_bucket(self, lock_path: Path):
+        # the writers of single buckets share the commit lock, so a commit
+        # excludes them all with a single lock
+        with self._commit_lock(shared=True), file_lock(lock_path):
+            yield
+
+    def _commit_lock(self, shared: bool = False):
+        # taken exclusively by the writes of multiple files, that must be
+        # seen all at once, and shared by the reads of multiple files
+        if not self.concurrent:
+            return nullcontext()
+        return file_lock(self.dirpath / 'locks' / 'commit', shared=shared)
+
+    def _log_lock(self):
+        if not self.concurrent:
+            return nullcontext()
+        return file_lock(self.dirpath / 'locks' / 'segments')
+
+    def _compact_lock(self):
+        if not self.concurrent:
+            return nullcontext()
+        return file_lock(self.dirpath / 'locks' / 'compact')
+
+    def _append_log(self, frames: List[Tuple[bytes, Record, Any]],
+                    atomic: bool = False):
+        # frames are (key_bytes, record, value). The value _NOT_LOGGED
+        # means deletion. Atomic frames become visible to the readers
+        # all at once
+        with self._log_lock():
+            self._append_log_locked(frames, atomic=atomic)
+
+    def _append_log_locked(self, frames: List[Tuple[bytes, Record, Any]],
+                           atomic: bool = False):
+        nbytes = self._log.append([
+            (key_bytes, rec, None if value is _NOT_LOGGED
+             else self._encode(value))
+            for key_bytes, rec, value in frames], atomic=atomic)
+        if self._metrics is not None:
+            self._metrics.count('bytes.written', nbytes)
+
+    def _read_logged(self, key_bytes: bytes, refresh: bool = True) -> Any:
+        # Returns the record from the log (with `Encoded` data), None if
+        # the record is deleted or expired, or _NOT_LOGGED
+        for _ in range(2):
+            if refresh:
+                self._log.refresh()
+            refresh = True
+            entry = self._log.index.get(key_bytes)
+            if entry is None:
+                return _NOT_LOGGED
+            if entry.deleted:
+                return None
+            if entry.record.expires and self._now() >= entry.record.expires:
+                return None
+            try:
+                rec = self._log.read(entry)
+            except FileNotFoundError:
+                # the segment is compacted by another process, the record
+                # is now in the bucket file
+                continue
+            if self._metrics is not None:
+                self._metrics.count('bytes.read', entry.length)
+            return rec
+        return _NOT_LOGGED
+
+    def compact(self) -> None:
+        """Moves the records from the append-only log to the bucket files.
+        Each affected bucket file is rewritten once. Expired and
+        overwritten records are dropped.
+
+        The writes made during the compaction go to a new log file and
+        are moved by the next call. In concurrent mode the compactions run
+        one at a time."""
+
+        if self._log is None:
+            return
+
+        # two compactions at once could write an older record over a newer
+        # one, or read a segment the other one has already removed
+        with self._compact_lock():
+            self._compact_locked()
+
+    def _compact_locked(self):
+        with self._log_lock():
+            sealed = set(self._log.seal())
+        if not sealed:
+            return
+
+        latest = {key_bytes: entry
+                  for key_bytes, entry in self._log.index.items()
+                  if entry.segment in sealed}
+
+        groups: Dict[Path, List[bytes]] = dict()
+        for key_bytes, filepath in zip(
+                latest, self._key_bytes_to_files(list(latest))):
+            groups.setdefault(filepath, []).append(key_bytes)
+
+        # the keys written again since the sealing are not moved: the new
+        # records override the bucket anyway
+        self._log.refresh()
+        index = self._log.index
+
+        now = self._now()
+        for filepath, keys in groups.items():
+            with self._bucket_lock(filepath):
+                dict_in_file = self._load_file(filepath)
+                for key_bytes in keys:
+                    entry = latest[key_bytes]
+                    if index.get(key_bytes) != entry:
+                        continue
+                    if entry.deleted or (entry.record.expires
+                                         and now >= entry.record.expires):
+                        dict_in_file.pop(key_bytes, None)
+                    else:
+                        dict_in_file[key_bytes] = self._log.read(entry)
+                if dict_in_file or filepath.exists():
+                    self._save_file(filepath, dict_in_file)
+
+        # the out-of-band buffers of the records that were overwritten
+        # in the log and never got into the buckets
+        referenced = set(e.buffers[0] for e in self._log.index.values()
+                         if e.buffers is not None)
+        orphans = set(e.buffers[0]
+                      for _, e in self._log.iter_frames(sorted(sealed))
+                      if e.buffers is not None) - referenced
+
+        self._log.remove_segments(sealed)
+        for name in orphans:
+            self._blobs.remove(name)
+
+    def sweep(self, max_buckets: int = None) -> int:
+        """Removes the expired records and the files written with other
+        data versions. If `max_items` or `max_bytes` are set, also evicts
+        the oldest records when the storage exceeds the limits.
+
+        :param max_buckets: The maximum number of files to process. The next
+        call continues where the previous one stopped, so calling
+        `sweep(max_buckets=10)` from time to time walks the whole storage
+        without long pauses. If None, the whole storage is processed.
+
+        The limits are checked after each complete walk through the files,
+        and the oldest records are evicted during the next walk. Without
+        `max_buckets` the second walk is made by the same call.
+
+        :return: The number of removed records.
+        """
+        sweeper = self._sweeper
+        removed = 0
+        processed = 0
+        passes = 0
+        while max_buckets is None or processed < max_buckets:
+            filepath = sweeper.next_file(
+                lambda: list(self._iter_bucket_files()))
+            if filepath is None:
+                # the storage is empty
+                sweeper.finish_pass()
+                break
+            count, stats = self._sweep_file(filepath, sweeper.evicts)
+            removed += count
+            processed += 1
+            sweeper.account(stats)
+            if sweeper.pass_complete:
+                sweeper.finish_pass()
+                passes += 1
+                if max_buckets is None \
+                        and (sweeper.cutoff is None or passes >= 2):
+                    break
+        return removed
+
+    def _sweep_file(self, filepath: Path,
+                    evicts: Callable[[datetime, int], bool]) \
+            -> Tuple[int, List[RecordStat]]:
+        # removes the expired records and the records evicted by the
+        # sweeper. Returns the number of removed records and the stats
+        # of the remaining ones
+        with self._bucket_lock(filepath):
+            try:
+                data_version, items_dict = self._read_bucket(filepath)
+            except FileNotFoundError:
+                return 0, []
+
+            if data_version != self.version:
+                self._remove_obsolete(filepath)
+                return len(items_dict), []
+
+            now = self._now()
+            kept: Dict[bytes, Record] = dict()
+            stats: List[RecordStat] = []
+            for key_bytes, rec in items_dict.items():
+                if rec.expires and now >= rec.expires:
+                    continue
+                stat = (rec.created, self._record_size(rec))
+                if evicts(*stat):
+                    continue
+                kept[key_bytes] = rec
+                stats.append(stat)
+            if len(kept) != len(items_dict):
+                try:
+                    self._save_file(filepath, kept)
+                except FileNotFoundError:
+                    pass
+
+        return len(items_dict) - len(kept), stats
+
+    @staticmethod
+    def _record_size(rec: Record) -> int:
+        encoded = encode_value(rec.data)
+        size = len(encoded.blob)
+        if encoded.buffers is not None:
+            size += sum(length for _, length in encoded.buffers[1])
+        return size
+
+    def _migrate_bucket(self, old_filepath: Path):
+        # moves all the records from the bucket file of the previous layout
+        # to the files of the current layout. The new files are written
+        # before the old one is removed, so nothing is lost if the process
+        # is interrupted
+
+        if not old_filepath.exists():
+            return
+
+        with self._bucket_lock(old_filepath):
+            self._migrate_bucket_locked(old_filepath)
+
+    def _migrate_bucket_locked(self, old_filepath: Path):
+        if self._is_temp_filename(old_filepath):
+            self._remove_temp(old_filepath)
+            return
+
+        layout = self._meta.layout
+        groups: Dict[Path, Dict[bytes, Record]] = dict()
+        for key_bytes, rec in self._load_file(old_filepath).items():
+            new_filepath = layout.hash_to_file(
+                self.dirpath, layout.key_bytes_to_hash(key_bytes))
+            groups.setdefault(new_filepath, dict())[key_bytes] = rec
+
+        for new_filepath, records in groups.items():
+            with self._bucket_lock(new_filepath):
+                dict_in_file = self._load_file(new_filepath)
+                for key_bytes, rec in records.items():
+                    # the records already in the new layout were written
+                    # after the resharding started, so they are newer
+                    dict_in_file.setdefault(key_bytes, rec)
+                self._save_file(new_filepath, dict_in_file)
 
-    def _load_file(self, filepath: Path, can_write=False) -> \
+        try:
+            # the blobs are now referenced by the new files
+            self._remove_file(old_filepath, release_blobs=False)
+        except FileNotFoundError:
+            pass
+
+    def reshard(self, buckets: int) -> None:
+        """Moves the data to a layout with a different number of buckets.
+
+        The data is moved one bucket at a time. The storage remains usable
+        during the process: the keys from the buckets that have not yet been
+        moved are migrated when they are accessed. If the process is
+        interrupted, the next call to `reshard` (or any access to the keys)
+        continues the work.
+
+        Other `PickleDir` objects for the same directory, including the ones
+        in other processes, notice the new layout on their next access.
+        """
+
+        if self._refresh_meta().previous is not None:
+            self._complete_reshard()
+
+        target = Layout(buckets)
+        if target == self._meta.layout:
+            return
+
+        self._meta = Meta(target, self._meta.layout)
+        write_meta(self.dirpath, self._meta, self._durability)
+        self._complete_reshard()
+
+    def _complete_reshard(self):
+        previous = self._meta.previous
+        assert previous is not None
+
+        for old_filepath in list(previous.iter_files(self.dirpath)):
+            self._migrate_bucket(old_filepath)
+
+        if not previous.is_flat:
+            for name in os.listdir(str(self.dirpath)):
+                d = self.dirpath / name
+                if len(name) == 2 and name.isalnum() and d.is_dir():
+                    try:
+                        d.rmdir()  # removing only if empty
+                    except OSError:
+                        pass
+
+        self._meta = Meta(self._meta.layout)
+        write_meta(self.dirpath, self._meta, self._durability)
+
+    def _load_file(self, filepath: Path, for_read=False) -> \
             Dict[bytes, Record]:
         # loads a list of records a file. If an element is out of date,
-        # it will be missing from the results. If canWrite = True, this will
-        # also update the file removing the obsolete elements
+        # it will be missing from the results. With `for_read=True` the file
+        # is only being read, and the obsolete elements are removed from the
+        # file according to the expiry policy. Otherwise the file is being
+        # modified, so the file of another data version is removed at once
+        #
+        # The values are not unpickled (unless the file has the old format 1):
+        # they are returned as `Encoded` and written back as is
 
-        if not filepath.exists():
+        try:
+            data_version, items_dict = self._read_bucket(filepath)
+        except FileNotFoundError:
             return dict()
 
-        with filepath.open("rb") as f:
-            (format_version, data_version, items_dict) = pickle.load(f)
-
         if data_version != self.version:
-            os.remove(str(filepath))
+            if for_read:
+                self._found_on_read(filepath)
+            else:
+                self._remove_obsolete(filepath)
             return dict()
 
         # removing outdated items
 
-        changed = False
+        expired = 0
         if items_dict:
             now = self._now()
             for key_bytes, (creationTime, expirationTime, message) in tuple(
                     items_dict.items()):
                 if expirationTime and now >= expirationTime:
-                    # todo avoid unnecessary deletions when can_write = False
+                    # only from the dict: the file is written by the caller
+                    # or by the expiry policy
                     del items_dict[key_bytes]
-                    changed = True
+                    expired += 1
+            if expired and self._metrics is not None:
+                self._metrics.count('expired', expired)
+
+        if expired and for_read:
+            self._found_on_read(filepath, items_dict)
+
+        # возвращаю результат
+        return items_dict
 
-        # if something is deleted (and modification of the file is allowed by
-        # the argument), save the modified dictionary back to file
+    def _found_on_read(self, filepath: Path,
+                       items_dict: Dict[bytes, Record] = None):
+        # called when a read finds the expired records or the other data
+        # version in the file. `items_dict` is the actual content of the
+        # file, if it was loaded
+        if self.expiry == 'lazy':
+            self._purge_file(filepath, items_dict)
+        elif self.expiry == 'deferred':
+            self._deferred.add(filepath)
 
-        if changed and can_write:
-            if items_dict:
+    def _purge_file(self, filepath: Path,
+                    items_dict: Dict[bytes, Record] = None):
+        # removes the expired records from the file, or the whole file if
+        # it has another data version
+        if items_dict is not None and not self.concurrent:
+            try:
                 self._save_file(filepath, items_dict)
-            else:
-                # no more data in this file
+            except FileNotFoundError:
+                pass  # emptied and removed by another reader
+            return
+
+        # the file could be changed by another process since we read it,
+        # so we check it again under the lock
+        with self._bucket_lock(filepath):
+            try:
+                data_version, expires, _ = self._read_expires(filepath)
+            except FileNotFoundError:
+                return
+            if data_version != self.version:
+                self._remove_file(filepath)
+                return
+            now = self._now()
+            if any(exp and now >= exp for exp in expires.values()):
+                # not `_load_file`: the expired records were already
+                # counted by the read that found them
+                try:
+                    _, items_dict = self._read_bucket(filepath)
+                except FileNotFoundError:
+                    return
+                self._save_file(filepath, {
+                    key_bytes: rec for key_bytes, rec in items_dict.items()
+                    if not (rec.expires and now >= rec.expires)})
+
+    def purge_generations(self, max_files: int = None,
+                          files_per_second: float = None) -> int:
+        """With `generations=True`, removes the data of the other versions.
+        The removed generations disappear at once, and then their files are
+        deleted.
+
+        :param max_files: The maximum number of files to remove. The next
+        call continues where the previous one stopped.
+
+        :param files_per_second: If set, the files are removed no faster.
+        To purge in background, call the method from a thread:
+
+            threading.Thread(target=cache.purge_generations,
+                             kwargs={'files_per_second': 1000},
+                             daemon=True).start()
+
+        :return: The number of removed files.
+        """
+        if not self.generations:
+            return 0
+        return purge_generations(self.root, [self.dirpath.name],
+                                 max_files=max_files,
+                                 files_per_second=files_per_second)
+
+    def collect_blobs(self, min_age: timedelta = timedelta(hours=1)) -> int:
+        """Removes the blob files that are not referenced by any record.
+        With `dedup_threshold`, this is the only way the files of the
+        deduplicated values are removed. Other blob files get here only
+        if a process crashed or (on Windows) could not remove a file.
+
+        :param min_age: The files modified more recently are kept: they may
+        belong to the records being written right now. It should exceed
+        the time of the longest write or transaction.
+
+        :return: The number of removed files.
+        """
+        if not self._blobs.root.exists():
+            return 0
+        # marking all the files referenced from the log and the buckets.
+        # The log goes first: the records compacted meanwhile will be
+        # found in the buckets. The blobs written after the marking are
+        # younger than `min_age`
+        referenced: Set[str] = set()
+        if self._log is not None:
+            with self._log_lock():
+                self._log.refresh()
+                referenced.update(entry.buffers[0]
+                                  for entry in self._log.index.values()
+                                  if entry.buffers is not None)
+        for filepath in self._iter_bucket_files():
+            referenced.update(self._referenced_blobs(filepath))
+        return self._blobs.remove_unreferenced(referenced,
+                                               min_age.total_seconds())
+
+    def sync(self) -> None:
+        """With `durability="group"`, fsyncs the files written since the
+        last sync without waiting for the window to end."""
+        self._durability.sync()
+
+    def flush_expired(self) -> int:
+        """Cleans the files queued by the reads with `expiry="deferred"`:
+        removes the expired records and the data of other versions.
+        May be called from a background thread.
+
+        :return: The number of processed files.
+        """
+        processed = 0
+        while True:
+            try:
+                filepath = self._deferred.pop()
+            except KeyError:
+                return processed
+            self._purge_file(filepath)
+            processed += 1
+
+    def _read_bucket(self, filepath: Path) \
+            -> Tuple[Any, Dict[bytes, Record]]:
+        # reads all the records from the file, using the in-memory cache
+        # when it is enabled. Raises FileNotFoundError
+
+        if self._lru is None:
+            with filepath.open("rb") as f:
+                result = read_bucket(f)
+                self._count_read(f.tell())
+                return result
+
+        try:
+            signature = file_signature(os.stat(str(filepath)))
+        except FileNotFoundError:
+            self._lru.discard(filepath)
+            raise
+
+        cached = self._lru.get(filepath, signature)
+        if cached is None:
+            with filepath.open("rb") as f:
+                # the signature of the file we actually read
+                st = os.fstat(f.fileno())
+                cached = read_bucket(f)
+            self._count_read(st.st_size)
+            self._lru.put(filepath, file_signature(st), cached, st.st_size)
+        elif self._metrics is not None:
+            self._metrics.count('lru.hit')
+
+        data_version, items_dict = cached
+        # the caller may modify the dict
+        return data_version, dict(items_dict)
+
+    def _remove_obsolete(self, filepath: Path):
+        # removes the file written with another data version
+        if not self.concurrent:
+            self._remove_file(filepath)
+            return
+
+        with self._bucket_lock(filepath):
+            # another process could replace the file with the actual data
+            # since we read it
+            try:
+                with filepath.open("rb") as f:
+                    header = read_header(f)
+                    if header is None:
+                        f.seek(0)
+                        data_version, _ = read_bucket(f)
+                    else:
+                        data_version = header.data_version
+            except FileNotFoundError:
+                return
+            if data_version != self.version:
+                self._remove_file(filepath)
+
+    def _remove_temp(self, filepath: Path):
+        # in concurrent mode the temp files are removed under the lock of
+        # their bucket, so we never remove a file that is being written
+        with self._bucket_lock(filepath):
+            try:
                 os.remove(str(filepath))
+            except FileNotFoundError:
+                pass
 
-        # возвращаю результат
-        return items_dict
+    def _remove_file(self, filepath: Path, release_blobs=True):
+        if release_blobs:
+            referenced = self._referenced_blobs(filepath)
+        if self._lru is not None:
+            self._lru.discard(filepath)
+        os.remove(str(filepath))
+        self._durability.removed(filepath)
+        if release_blobs:
+            for name in referenced:
+                self._blobs.remove(name)
+
+    def _blobs_used(self) -> bool:
+        return self.oob_threshold is not None \
+            or self.dedup_threshold is not None or self._blobs.root.exists()
+
+    def _referenced_blobs(self, filepath: Path) -> Set[str]:
+        # returns the names of the blob files referenced from the file
+        if not self._blobs_used():
+            return set()
+        try:
+            with filepath.open("rb") as f:
+                header = read_header(f)
+        except FileNotFoundError:
+            return set()
+        if header is None:
+            return set()
+        return set(buffers[0] for buffers in map(entry_buffers,
+                                                 header.index.values())
+                   if buffers is not None)
+
+    def _encode(self, value: Any) -> Encoded:
+        if isinstance(value, Encoded):
+            return value
+        if self.oob_threshold is None:
+            blob, buffers = encode_value(value).blob, None
+        else:
+            blob, buffers = dumps_out_of_band(value, self._blobs,
+                                              self.oob_threshold,
+                                              self.dedup_threshold)
+        if buffers is None and self.dedup_threshold is not None \
+                and len(blob) >= self.dedup_threshold:
+            return encode_deduplicated(blob, self._blobs, self.codec)
+        blob, codec_id = compress(self.codec, blob)
+        return Encoded(blob, buffers, codec_id)
 
     def _save_file(self, filepath: Path, items: Dict[bytes, Record]):
 
         if not items:
-            os.remove(filepath)
+            self._remove_file(filepath)
             return
 
-        temp_filepath = filepath.parent / ("~" + filepath.name)
+        self._install_file(filepath, self._write_temp(filepath, items))
+
+    def _write_temp(self, filepath: Path, items: Dict[bytes, Record]) \
+            -> _TempFile:
+        # writes the new content of the bucket file to a temporary file.
+        # It replaces the bucket file in `_install_file`
+
+        if self.concurrent:
+            # the unique name, so even the processes that do not use locks
+            # do not write to the same temp file
+            temp_filepath = filepath.parent / (
+                f"~{filepath.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+        else:
+            temp_filepath = filepath.parent / ("~" + filepath.name)
         assert self._is_temp_filename(temp_filepath)
 
-        format_version = 1
+        previous_blobs = self._referenced_blobs(filepath)
 
         f = None
         try:
             try:
                 f = temp_filepath.open("wb")
             except FileNotFoundError:
-                filepath.parent.mkdir(parents=True)
+                self._durability.make_dirs(filepath.parent)
                 f = temp_filepath.open("wb")
-            pickle.dump((format_version, self.version, items), f,
-                        pickle.HIGHEST_PROTOCOL)
+            written = write_bucket(f, self.version, items, self._encode)
+            f.flush()
+            self._durability.sync_data(f)
+            st = os.fstat(f.fileno())
         finally:
             f.close()
 
-        # with temp_filepath.open("wb") as f:
+        if self._metrics is not None:
+            self._metrics.count('files.written')
+            self._metrics.count('bytes.written', st.st_size)
+
+        return _TempFile(temp_filepath, st, written, previous_blobs)
 
-        temp_filepath.replace(filepath)
+    def _install_file(self, filepath: Path, temp: _TempFile):
+        temp.path.replace(filepath)
+        self._durability.written(filepath, temp.stat.st_size)
+
+        if self._lru is not None:
+            # replacing keeps the inode and the modification time,
+            # so the signature remains valid
+            self._lru.put(filepath, file_signature(temp.stat),
+                          (self.version, temp.written), temp.stat.st_size)
+
+        previous_blobs = temp.previous_blobs
+        if previous_blobs:
+            # removing the blobs of overwritten and deleted records
+            for rec in temp.written.values():
+                if rec.data.buffers is not None:
+                    previous_blobs.discard(rec.data.buffers[0])
+            for name in previous_blobs:
+                self._blobs.remove(name)
+
+    def _count_read(self, nbytes: int):
+        if self._metrics is not None:
+            self._metrics.count('files.read')
+            self._metrics.count('bytes.read', nbytes)
 
     @staticmethod
     def _now():
         return datetime.utcnow().replace(tzinfo=timezone.utc)
 
+    @timed('set')
     def set(self, key: TKey, value: TValue,
             max_age: timedelta = None) -> None:
 
         key_bytes = self._key_to_bytes(key)
-        filepath = self._key_bytes_to_file(key_bytes)
-        dict_in_file = self._load_file(filepath, can_write=False)
 
         creationTime = self._now()
         expirationTime = creationTime + max_age if max_age else None
 
-        dict_in_file[key_bytes] = Record(creationTime, expirationTime, value)
+        if self._log is not None:
+            self._append_log([(key_bytes,
+                               Record(creationTime, expirationTime, None),
+                               value)])
+            return
 
-        self._save_file(filepath, dict_in_file)
+        filepath = self._key_bytes_to_file(key_bytes)
+        with self._bucket_lock(filepath):
+            dict_in_file = self._load_file(filepath)
+            dict_in_file[key_bytes] = Record(creationTime, expirationTime,
+                                             value)
+            self._save_file(filepath, dict_in_file)
 
+    @timed('delete')
     def __delitem__(self, key: TKey):
         key_bytes = self._key_to_bytes(key)
+        if self._log is not None:
+            self._append_log([(key_bytes, Record(self._now(), None, None),
+                               _NOT_LOGGED)])
+            return
+
+        filepath = self._key_bytes_to_file(key_bytes)
+        with self._bucket_lock(filepath):
+            dict_in_file = self._load_file(filepath)
+
+            if key_bytes in dict_in_file:
+                del dict_in_file[key_bytes]
+            self._save_file(filepath, dict_in_file)
+
+    def _modify(self, key: TKey, func: Callable[[Optional[Record]], Tuple],
+                max_age: Optional[timedelta]) -> Any:
+        # Reads the record and writes the new value under a single lock.
+        # `func` takes the decoded record (None if missing or expired) and
+        # returns (new value or _UNCHANGED, result). Returns the result.
+        # Without `max_age` the record keeps its expiration time
+
+        key_bytes = self._key_to_bytes(key)
+
+        def new_record(old: Optional[Record], value: Any) -> Record:
+            created = self._now()
+            if max_age:
+                expires = created + max_age
+            else:
+                expires = old.expires if old is not None else None
+            return Record(created, expires, value)
+
+        if self._log is not None:
+            with self._log_lock():
+                rec = self._read_logged(key_bytes)
+                if rec is _NOT_LOGGED:
+                    rec = self._read_record(
+                        self._key_bytes_to_file(key_bytes), key_bytes)
+                elif rec is not None:
+                    rec = decode_record(rec, self._blobs)
+                value, result = func(rec)
+                if value is not _UNCHANGED:
+                    new = new_record(rec, value)
+                    self._append_log_locked(
+                        [(key_bytes, new._replace(data=None), value)])
+            return result
+
         filepath = self._key_bytes_to_file(key_bytes)
-        dict_in_file = self._load_file(filepath, can_write=False)
+        with self._bucket_lock(filepath):
+            dict_in_file = self._load_file(filepath)
+            rec = dict_in_file.get(key_bytes)
+            if rec is not None:
+                rec = decode_record(rec, self._blobs)
+            value, result = func(rec)
+            if value is not _UNCHANGED:
+                dict_in_file[key_bytes] = new_record(rec, value)
+                self._save_file(filepath, dict_in_file)
+        return result
+
+    @timed('update')
+    def update(self, key: TKey, func: Callable[[TValue], TValue],
+               default: TValue = None, max_age: timedelta = None) -> TValue:
+        """Replaces the value with `func(value)`. The file is read and
+        written once, and in concurrent mode no other writer can change
+        the value in between:
+
+            cache.update('visitors', lambda names: names + ['Alice'],
+                         default=[])
+
+        :param func: Takes the current value, or `default` if the key is
+        missing or expired, and returns the new value.
+
+        :param max_age: The new expiration time. If None, the record keeps
+        its expiration time.
+
+        :return: The new value.
+        """
+
+        def apply(rec: Optional[Record]) -> Tuple[Any, Any]:
+            value = func(default if rec is None else rec.data)
+            return value, value
+
+        return self._modify(key, apply, max_age)
+
+    @timed('compare_and_set')
+    def compare_and_set(self, key: TKey, expected: TValue, new: TValue,
+                        max_age: timedelta = None) -> bool:
+        """Sets the value to `new` only if the current value equals
+        `expected`. The missing (or expired) key has the value None.
+
+        :param max_age: The new expiration time. If None, the record keeps
+        its expiration time.
+
+        :return: Whether the value was set.
+        """
+
+        def apply(rec: Optional[Record]) -> Tuple[Any, bool]:
+            if (None if rec is None else rec.data) == expected:
+                return new, True
+            return _UNCHANGED, False
+
+        return self._modify(key, apply, max_age)
+
+    def incr(self, key: TKey, delta: Union[int, float] = 1,
+             max_age: timedelta = None) -> Union[int, float]:
+        """Adds `delta` to the number stored by the key (0 if the key is
+        missing or expired) and returns the result.
+
+        :param max_age: The new expiration time. If None, the record keeps
+        its expiration time, so a counter created with `max_age` is reset
+        when the time ends.
+        """
+        return self.update(key, lambda value: value + delta, default=0,
+                           max_age=max_age)
+
+    def open_writer(self, key: TKey,
+                    max_age: timedelta = None) -> StreamWriter:
+        """Returns the binary file object that writes the value in chunks,
+        so the value does not have to fit in memory:
+
+            with cache.open_writer('artifact') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+
+        The data goes to a separate file in the "blobs" subdirectory. The
+        value is stored when the writer is closed (and not stored if the
+        `with` block raises). It is read back by `open_reader`, or by `get`
+        as a memory-mapped `memoryview`.
+        """
+        return StreamWriter(
+            self._blobs, self._durability,
+            lambda encoded: self.set(key, encoded, max_age=max_age))
+
+    def open_reader(self, key: TKey) -> BinaryIO:
+        """Returns the binary file object that reads the value written by
+        `open_writer`. It supports seeking and reads only the requested
+        data. Values of other types are returned as `io.BytesIO` if they
+        are bytes-like.
+
+        :raises KeyError: The key is missing or expired.
+        :raises TypeError: The value is neither a stream nor bytes-like.
+        """
+        key_bytes = self._key_to_bytes(key)
+        for _ in range(2):
+            rec = self._read_raw(key_bytes)
+            if rec is None:
+                raise KeyError(key)
+            encoded = encode_value(rec.data)
+            if not is_stream(encoded):
+                value = decode_value(encoded, self._blobs)
+                if isinstance(value, (bytes, bytearray, memoryview)):
+                    return io.BytesIO(value)
+                raise TypeError(f"The value is not a stream: {type(value)}")
+            try:
+                return open_stream(self._blobs, encoded.buffers)
+            except FileNotFoundError:
+                continue  # overwritten since we read the record
+        raise KeyError(key)
+
+    def _read_raw(self, key_bytes: bytes) -> Optional[Record]:
+        # returns the actual record with the value not decoded, or None
+        rec = _NOT_LOGGED
+        if self._log is not None:
+            rec = self._read_logged(key_bytes)
+        if rec is _NOT_LOGGED:
+            rec = self._read_record(self._key_bytes_to_file(key_bytes),
+                                    key_bytes, decode=False)
+        return rec
+
+    def _group_by_file(self, keys: Iterable[TKey]) \
+            -> Dict[Path, List[Tuple[int, bytes]]]:
+        # maps each bucket file to the (position, key_bytes) pairs of the keys
+        # stored in it. Positions let us return results in the original order
+        keys_bytes = [pickle_key(key) for key in keys]
+        groups: Dict[Path, List[Tuple[int, bytes]]] = dict()
+        for idx, (key_bytes, filepath) in enumerate(
+                zip(keys_bytes, self._key_bytes_to_files(keys_bytes))):
+            groups.setdefault(filepath, []).append((idx, key_bytes))
+        return groups
+
+    @timed('set_many')
+    def set_many(self,
+                 items: Union[Mapping[TKey, TValue],
+                              Iterable[Tuple[TKey, TValue]]],
+                 max_age: timedelta = None) -> None:
+        """Writes multiple items at once. Each affected file is loaded and
+        saved only once, no matter how many of the keys are stored in it.
+
+        :param items: A mapping or an iterable of (key, value) pairs.
+        :param max_age: The same as in `set`, applies to all the items.
+        """
+        if isinstance(items, Mapping):
+            items = items.items()
+        pairs = list(items)
+
+        creationTime = self._now()
+        expirationTime = creationTime + max_age if max_age else None
+
+        if self._log is not None:
+            self._append_log([(pickle_key(key),
+                               Record(creationTime, expirationTime, None),
+                               value)
+                              for key, value in pairs])
+            return
+
+        groups = self._group_by_file(key for key, _ in pairs)
+        for filepath, positions in groups.items():
+            with self._bucket_lock(filepath):
+                dict_in_file = self._load_file(filepath)
+                for idx, key_bytes in positions:
+                    dict_in_file[key_bytes] = Record(
+                        creationTime, expirationTime, pairs[idx][1])
+                self._save_file(filepath, dict_in_file)
+
+    @timed('get_many')
+    def get_many(self, keys: Iterable[TKey], max_age: timedelta = None,
+                 default=None) -> List[TValue]:
+        """Reads multiple items at once. Each affected file is loaded only
+        once.
+
+        :return: The list of values in the same order as `keys`. Missing
+        items are replaced by `default`.
+        """
+        keys = list(keys)
+        result = [default] * len(keys)
+        minCreationTime = self._now() - max_age if max_age is not None \
+            else None
+
+        groups = self._group_by_file(keys)
+        # the files are read under the shared commit lock, so all the
+        # writes of a transaction are either seen or not
+        with self._commit_lock(shared=True) if len(groups) > 1 \
+                else nullcontext():
+            for filepath, positions in groups.items():
+                items_dict = self._load_file(filepath, for_read=True)
+                for idx, key_bytes in positions:
+                    item = items_dict.get(key_bytes)
+                    if item is None:
+                        continue
+                    if minCreationTime is not None \
+                            and item.created < minCreationTime:
+                        continue
+                    result[idx] = decode_value(item.data, self._blobs)
+
+        if self._log is not None:
+            # the records in the log are newer than in the buckets
+            self._log.refresh()
+            for idx, key in enumerate(keys):
+                item = self._read_logged(pickle_key(key), refresh=False)
+                if item is _NOT_LOGGED:
+                    continue
+                if item is None or (minCreationTime is not None
+                                    and item.created < minCreationTime):
+                    result[idx] = default
+                else:
+                    result[idx] = decode_value(item.data, self._blobs)
+        return result
+
+    @timed('delete_many')
+    def delete_many(self, keys: Iterable[TKey]) -> None:
+        """Deletes multiple items at once. Each affected file is loaded and
+        saved only once. Missing keys are ignored."""
+        if self._log is not None:
+            now = self._now()
+            self._append_log([(pickle_key(key),
+                               Record(now, None, None), _NOT_LOGGED)
+                              for key in keys])
+            return
+
+        for filepath, positions in self._group_by_file(keys).items():
+            with self._bucket_lock(filepath):
+                dict_in_file = self._load_file(filepath)
+                changed = False
+                for _, key_bytes in positions:
+                    if key_bytes in dict_in_file:
+                        del dict_in_file[key_bytes]
+                        changed = True
+                if changed:
+                    self._save_file(filepath, dict_in_file)
+
+    def transaction(self) -> Transaction:
+        """Returns the transaction that collects the writes in memory:
+
+            with cache.transaction() as tx:
+                tx['a'] = 1
+                del tx['b']
+
+        On exit the writes are applied together, each affected file being
+        written once. If the process crashes after the commit journal is
+        saved, the commit is completed by the next `PickleDir` created on
+        the directory. If the block raises an exception, nothing is
+        written.
+
+        The files are replaced one by one, so a reader may see some of the
+        writes and not the others. Only `get_many` with `concurrent=True`
+        sees either all the writes or none of them. In `append_only` mode
+        the writes become visible in the log at once."""
+        return Transaction(self)
+
+    def memoize(self, max_age: timedelta = None, version: Any = None,
+                stale: timedelta = None) -> Callable[[Callable], Callable]:
+        """Decorator that caches the results of a function by its
+        arguments. The arguments must be picklable. Works with both regular
+        and async functions.
+
+        When several threads, processes or coroutines miss the same key,
+        only one of them calls the function. The others wait and then
+        read its result.
+
+        :param max_age: How long the results are fresh. If None, they
+        never expire.
+        :param version: Part of the keys. Change it when the function
+        starts returning different results.
+        :param stale: If set, for this time after `max_age` the old result
+        is returned to all the callers except one, which calls the function
+        and updates the result.
+
+        The decorated function has the `invalidate(*args, **kwargs)` method
+        that removes the cached result.
+        """
+        if stale is not None and max_age is None:
+            raise ValueError("stale requires max_age")
+        return lambda func: memoize(self, func, max_age=max_age,
+                                    version=version, stale=stale)
+
+    def _commit(self, changes: Dict[bytes, Optional[Record]]):
+        # changes map key bytes to the records or None for deletions
+        if not changes:
+            return
+
+        if self._log is not None:
+            now = self._now()
+            self._append_log(
+                [(key_bytes, rec._replace(data=None), rec.data)
+                 if rec is not None
+                 else (key_bytes, Record(now, None, None), _NOT_LOGGED)
+                 for key_bytes, rec in changes.items()], atomic=True)
+            return
+
+        groups: Dict[Path, List[bytes]] = dict()
+        for key_bytes, filepath in zip(
+                changes, self._key_bytes_to_files(list(changes))):
+            groups.setdefault(filepath, []).append(key_bytes)
+        filepaths = sorted(groups)
+
+        # the exclusive commit lock keeps out the writers of single buckets
+        # and the readers of multiple buckets. A lock for each bucket would
+        # need an open file per bucket
+        with self._commit_lock():
+            temps: Dict[Path, Optional[_TempFile]] = dict()
+            journal = None
+            try:
+                for filepath in filepaths:
+                    dict_in_file = self._load_file(filepath)
+                    for key_bytes in groups[filepath]:
+                        rec = changes[key_bytes]
+                        if rec is None:
+                            dict_in_file.pop(key_bytes, None)
+                        else:
+                            dict_in_file[key_bytes] = rec
+                    temps[filepath] = self._write_temp(
+                        filepath, dict_in_file) if dict_in_file else None
+                if len(temps) > 1:
+                    # replacing a single file is atomic by itself
+                    journal = write_journal(self.dirpath, [
+                        (None if temp is None else self._relative(temp.path),
+                         self._relative(filepath))
+                        for filepath, temp in temps.items()],
+                        self._durability)
+            except BaseException:
+                for temp in temps.values():
+                    if temp is not None:
+                        self._remove_if_exists(temp.path)
+                raise
+
+            for filepath, temp in temps.items():
+                if temp is not None:
+                    self._install_file(filepath, temp)
+                elif filepath.exists():
+                    self._remove_file(filepath)
+            if journal is not None:
+                remove_journal(journal)
+
+    def export_snapshot(self, path: Union[str, Path]) -> int:
+        """Packs all the live records into a single file, that can be read
+        by `PickleDirSnapshot` or imported with `import_snapshot`.
+        Returns the number of the records.
+
+        The values are written as they are stored, without unpickling,
+        except for the ones with out-of-band buffers: these are pickled
+        again to be self-contained."""
+        now = self._now()
+        return write_snapshot(
+            Path(path), self.version,
+            ((key_bytes, rec) for key_bytes, rec in self._iter_raw_records()
+             if not (rec.expires and now >= rec.expires)),
+            self._inline)
+
+    def _inline(self, encoded: Encoded) -> Encoded:
+        # the value with the out-of-band buffers moved into the pickle
+        blob = inline_out_of_band(decompress(encoded.blob, encoded.codec),
+                                  encoded.buffers, self._blobs)
+        blob, codec_id = compress(self.codec, blob)
+        return Encoded(blob, None, codec_id)
 
-        if key_bytes in dict_in_file:
-            del dict_in_file[key_bytes]
-        self._save_file(filepath, dict_in_file)
+    def import_snapshot(self, path: Union[str, Path]) -> int:
+        """Writes all the live records from the snapshot file to the
+        storage, replacing the records with the same keys. The records keep
+        their creation and expiration times. Returns the number of the
+        records.
+
+        Like a transaction, the records are written together."""
+        with PickleDirSnapshot(path) as snapshot:
+            changes: Dict[bytes, Optional[Record]] = dict(
+                snapshot._raw_records())
+        self._commit(changes)
+        return len(changes)
+
+    def _relative(self, path: Path) -> str:
+        return path.relative_to(self.dirpath).as_posix()
+
+    @staticmethod
+    def _remove_if_exists(path: Path):
+        try:
+            os.remove(str(path))
+        except FileNotFoundError:
+            pass
+
+    def _recover(self):
+        # completes the transactions committed by the processes that
+        # crashed before replacing all the files
+        for journal in iter_journals(
+                self.dirpath,
+                # in concurrent mode the unfinished journal may be being
+                # written right now
+                remove_unfinished_older=3600 if self.concurrent else 0):
+            try:
+                entries = read_journal(journal)
+                journal_time = journal.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue  # completed by another process
+            with self._commit_lock():
+                if not journal.exists():
+                    continue
+                for temp, target in entries:
+                    target_path = self.dirpath / target
+                    try:
+                        if target_path.stat().st_mtime_ns > journal_time:
+                            # written after the commit, the newer data wins
+                            continue
+                    except FileNotFoundError:
+                        pass
+                    if temp is None:
+                        self._remove_if_exists(target_path)
+                        self._durability.removed(target_path)
+                    else:
+                        try:
+                            (self.dirpath / temp).replace(target_path)
+                        except FileNotFoundError:
+                            pass  # already replaced
+                        else:
+                            self._durability.written(target_path)
+                    if self._lru is not None:
+                        self._lru.discard(target_path)
+                remove_journal(journal)
+
+    def _read_record(self, filepath: Path, key_bytes: bytes,
+                     with_value: bool = True,
+                     decode: bool = True) -> Optional[Record]:
+        # Reads the single record from the file. With `with_value=False`
+        # the value is neither read nor unpickled (unless the file has
+        # the format 1), only the existence and the dates are checked
+
+        try:
+            if self._lru is not None:
+                data_version, items_dict = self._read_bucket(filepath)
+                rec = items_dict.get(key_bytes)
+            else:
+                data_version, rec, nbytes = self._read_record_lazily(
+                    filepath, key_bytes, with_value)
+                self._count_read(nbytes)
+        except FileNotFoundError:
+            return None
+
+        if data_version != self.version:
+            self._found_on_read(filepath)
+            return None
+
+        if rec is not None and rec.expires and self._now() >= rec.expires:
+            if self._metrics is not None:
+                self._metrics.count('expired')
+            self._found_on_read(filepath)
+            return None
+
+        if rec is None or not with_value or not decode:
+            return rec
+        return decode_record(rec, self._blobs)
+
+    @staticmethod
+    def _read_record_lazily(filepath: Path, key_bytes: bytes,
+                            with_value: bool = True) \
+            -> Tuple[Any, Optional[Record], int]:
+        # for the files in format 2 only the index is unpickled. The value
+        # is returned as `Encoded`. Also returns the number of bytes read
+
+        with filepath.open("rb") as f:
+            header = read_header(f)
+            if header is None:
+                # format 1: the whole file is unpickled anyway
+                f.seek(0)
+                data_version, items_dict = read_bucket(f)
+                return data_version, items_dict.get(key_bytes), f.tell()
+
+            entry = header.index.get(key_bytes)
+            if entry is None:
+                return header.data_version, None, header.data_start
+            created, expires = entry[0], entry[1]
+            if not with_value:
+                return header.data_version, Record(created, expires, None), \
+                    header.data_start
+            data = read_blob(f, header, entry)
+            return header.data_version, Record(created, expires, data), \
+                header.data_start + len(data.blob)
+
+    @staticmethod
+    def _read_expires(filepath: Path) \
+            -> Tuple[Any, Dict[bytes, Optional[datetime]], int]:
+        # returns the data version, the expiration dates by the keys and
+        # the size of the file. Raises FileNotFoundError
+        with filepath.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            header = read_header(f)
+            if header is None:
+                f.seek(0)
+                data_version, items_dict = read_bucket(f)
+                return data_version, {k: rec.expires
+                                      for k, rec in items_dict.items()}, size
+            return header.data_version, {k: entry[1] for k, entry
+                                         in header.index.items()}, size
+
+    def _read_keys(self, filepath: Path) -> List[bytes]:
+        # returns the keys of the actual records in the file without
+        # reading the values
+        try:
+            data_version, expires, _ = self._read_expires(filepath)
+        except FileNotFoundError:
+            return []
+
+        if data_version != self.version:
+            self._found_on_read(filepath)
+            return []
+
+        now = self._now()
+        return [k for k, exp in expires.items() if not (exp and now >= exp)]
 
     def _get_record(self, key: TKey, max_age: timedelta = None) \
             -> Optional[Record]:
@@ -166,14 +1539,19 @@ class PickleDir(Generic[TKey, TValue]):
         """
 
         key_bytes = self._key_to_bytes(key)
-        path = self._key_bytes_to_file(key_bytes)
 
-        try:
-            items_dict = self._load_file(path, can_write=True)
-        except FileNotFoundError:
-            return None
+        item = _NOT_LOGGED
+        if self._log is not None:
+            item = self._read_logged(key_bytes)
+            if item is not None and item is not _NOT_LOGGED:
+                item = decode_record(item, self._blobs)
 
-        item = items_dict.get(key_bytes)
+        if item is _NOT_LOGGED:
+            path = self._key_bytes_to_file(key_bytes)
+            try:
+                item = self._read_record(path, key_bytes)
+            except FileNotFoundError:
+                return None
 
         if max_age is not None and item is not None:
             creationTime = item[0]
@@ -209,10 +1587,13 @@ class PickleDir(Generic[TKey, TValue]):
 
         return False
 
+    @timed('get')
     def get(self, key: TKey, max_age: timedelta = None,
             default=None) -> TValue:
 
         item = self._get_record(key, max_age)
+        if self._metrics is not None:
+            self._metrics.count('get.miss' if item is None else 'get.hit')
         if item is not None:
             return item[2]
         else:
@@ -221,18 +1602,228 @@ class PickleDir(Generic[TKey, TValue]):
             else:
                 return default
 
+    def _layouts(self) -> List[Layout]:
+        # the current layout and then (during resharding) the previous one
+        meta = self._refresh_meta()
+        layouts = [meta.layout]
+        if meta.previous is not None:
+            layouts.append(meta.previous)
+        return layouts
+
+    def _iter_layout_files(self, layout: Layout) -> Iterator[Path]:
+        # yields the bucket files of the layout. Removes the temporary files
+        for fn in list(layout.iter_files(self.dirpath)):
+            if self._is_temp_filename(fn):
+                self._remove_temp(fn)
+                continue
+            yield fn
+
+    def _iter_bucket_files(self) -> Iterator[Path]:
+        for layout in self._layouts():
+            yield from self._iter_layout_files(layout)
+
+    def _iter_key_bytes(self) -> Iterator[bytes]:
+        # yields the keys of all actual records. The values are not read
+        seen: Optional[Set[bytes]] = \
+            set() if self._refresh_meta().previous is not None else None
+
+        logged: Dict[bytes, Any] = dict()
+        if self._log is not None:
+            self._log.refresh()
+            logged = dict(self._log.index)
+
+        for fn in self._iter_bucket_files():
+            for key_bytes in self._read_keys(fn):
+                if key_bytes in logged:
+                    continue
+                if seen is not None:
+                    if key_bytes in seen:
+                        continue
+                    seen.add(key_bytes)
+                yield key_bytes
+
+        now = self._now()
+        for key_bytes, entry in logged.items():
+            if not entry.deleted and not (entry.record.expires
+                                          and now >= entry.record.expires):
+                yield key_bytes
+
+    def _iter_raw_records(self) -> Iterator[Tuple[bytes, Record]]:
+        # yields the key bytes and the records with the values not decoded
+        seen: Optional[Set[bytes]] = \
+            set() if self._refresh_meta().previous is not None else None
+
+        logged: Dict[bytes, Any] = dict()
+        if self._log is not None:
+            self._log.refresh()
+            logged = dict(self._log.index)
+
+        for fn in self._iter_bucket_files():
+            for key_bytes, rec in self._load_file(fn, for_read=True).items():
+                if key_bytes in logged:
+                    continue
+                if seen is not None:
+                    # during resharding the same record can be found in
+                    # both layouts. The current layout goes first
+                    if key_bytes in seen:
+                        continue
+                    seen.add(key_bytes)
+                yield key_bytes, rec
+
+        for key_bytes in logged:
+            rec = self._read_logged(key_bytes, refresh=False)
+            if rec is not None and rec is not _NOT_LOGGED:
+                yield key_bytes, rec
+
     def _iter_records(self) -> Iterator[Tuple[TKey, Tuple]]:
-        for fn in self.dirpath.glob("*"):
-            if not self._is_data_basename(fn.name):
+        for key_bytes, rec in self._iter_raw_records():
+            yield self._bytes_to_key(key_bytes), \
+                decode_record(rec, self._blobs)
+
+    def scan(self, workers: int = None, processes: bool = False,
+             executor: Executor = None, max_pending: int = None,
+             prefix: Any = None,
+             predicate: Callable[[TKey, TValue], bool] = None) \
+            -> Iterator[Tuple[TKey, TValue]]:
+        """Iterates the items like `items`, but reads and unpickles the
+        files in parallel. The items are yielded in arbitrary order.
+
+        :param workers: The number of threads or processes.
+        :param processes: Use processes instead of threads. The keys,
+        the values and the `predicate` must be picklable then. The values
+        with out-of-band buffers and the streamed values are copied from
+        the blob files instead of being memory-mapped, so the streamed
+        values come as `bytes` rather than `memoryview`.
+        :param executor: An existing executor to use instead of creating
+        a new one.
+        :param max_pending: The maximum number of files being read or
+        waiting to be consumed. Limits the memory used when the consumer
+        is slower than the workers. By default, twice the number of workers.
+        :param prefix: If set, only the items with the `str` or `bytes`
+        keys starting with `prefix` are returned.
+        :param predicate: If set, only the items for which
+        `predicate(key, value)` is True are returned. Runs in the workers.
+        """
+        return timed_iter(self._metrics, 'scan', self._scan(
+            workers=workers, processes=processes, executor=executor,
+            max_pending=max_pending, prefix=prefix, predicate=predicate))
+
+    def _scan(self, workers: Optional[int], processes: bool,
+              executor: Optional[Executor], max_pending: Optional[int],
+              prefix: Any, predicate: Optional[Callable]) \
+            -> Iterator[Tuple[TKey, TValue]]:
+        own_executor = executor is None
+        if own_executor:
+            executor = create_executor(workers, processes)
+        if max_pending is None:
+            max_pending = 2 * getattr(executor, '_max_workers', workers or 4)
+
+        logged: Dict[bytes, Any] = dict()
+        if self._log is not None:
+            self._log.refresh()
+            logged = dict(self._log.index)
+        seen: Optional[Set[bytes]] = \
+            set() if self._refresh_meta().previous is not None else None
+
+        try:
+            # the files are read in any order, but the layouts are read
+            # one after another. So during resharding the newer records
+            # are found before the older ones
+            for layout in self._layouts():
+                for key_bytes, key, value in parallel_scan(
+                        self._iter_layout_files(layout), self.version,
+                        self.dirpath, executor, max_pending,
+                        prefix=prefix, predicate=predicate):
+                    if key_bytes in logged:
+                        continue
+                    if seen is not None:
+                        if key_bytes in seen:
+                            continue
+                        seen.add(key_bytes)
+                    yield key, value
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False)
+
+        for key_bytes in logged:
+            rec = self._read_logged(key_bytes, refresh=False)
+            if rec is None or rec is _NOT_LOGGED:
                 continue
-            if self._is_temp_filename(fn):
-                os.remove(str(fn))  # todo test
-            for key_bytes, rec in self._load_file(fn).items():
-                yield self._bytes_to_key(key_bytes), rec
+            key = self._bytes_to_key(key_bytes)
+            if not key_matches(key, prefix):
+                continue
+            value = decode_value(rec.data, self._blobs)
+            if predicate is None or predicate(key, value):
+                yield key, value
 
     def __contains__(self, key: TKey) -> bool:
-        return self._get_record(key) is not None  # todo optimize
+        # only the keys and the dates are read, not the values
+        key_bytes = self._key_to_bytes(key)
+
+        if self._log is not None:
+            self._log.refresh()
+            entry = self._log.index.get(key_bytes)
+            if entry is not None:
+                return not entry.deleted and not (
+                        entry.record.expires
+                        and self._now() >= entry.record.expires)
+
+        path = self._key_bytes_to_file(key_bytes)
+        return self._read_record(path, key_bytes, with_value=False) \
+            is not None
+
+    def keys(self) -> Iterator[TKey]:
+        """Iterates the keys. The values are not read from the files."""
+        for key_bytes in self._iter_key_bytes():
+            yield self._bytes_to_key(key_bytes)
+
+    def __iter__(self) -> Iterator[TKey]:
+        return self.keys()
+
+    def __len__(self) -> int:
+        """Counts the items. This reads the key indexes of all the files,
+        but not the values."""
+        return sum(1 for _ in self._iter_key_bytes())
+
+    def stats(self) -> Dict[str, Any]:
+        """Reports the occupancy of the bucket files. Only the indexes of
+        the files are read, not the values.
+
+        :return: A dict with the totals ("files", "records", "expired",
+        "bytes", "max_records", "mean_records"), the `BucketStats` of each
+        file by its relative path ("buckets"), the size of the append-only
+        log ("log_bytes") and the snapshot of the metrics ("metrics"), if
+        they are enabled.
+        """
+        buckets: Dict[str, BucketStats] = dict()
+        now = self._now()
+        for fn in self._iter_bucket_files():
+            try:
+                data_version, expires, size = self._read_expires(fn)
+            except FileNotFoundError:
+                continue
+            if data_version != self.version:
+                # the records will be removed on the next access
+                expires = dict()
+            expired = sum(1 for exp in expires.values()
+                          if exp and now >= exp)
+            buckets[fn.relative_to(self.dirpath).as_posix()] = BucketStats(
+                len(expires) - expired, expired, size)
+
+        records = [b.records for b in buckets.values()]
+        return {
+            'files': len(buckets),
+            'records': sum(records),
+            'expired': sum(b.expired for b in buckets.values()),
+            'bytes': sum(b.size for b in buckets.values()),
+            'max_records': max(records, default=0),
+            'mean_records': sum(records) / len(records) if records else 0.0,
+            'buckets': buckets,
+            'log_bytes': 0 if self._log is None else self._log.size(),
+            'metrics': None if self._metrics is None
+            else self._metrics.snapshot(),
+        }
 
     def items(self) -> Iterator[Tuple[TKey, TValue]]:
-        for key, rec in self._iter_records():
-            yield key, rec[2]
+        return timed_iter(self._metrics, 'items',
+                          ((key, rec[2]) for key, rec in self._iter_records()))
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import pickle
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, \
+    ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import *
+
+from pickledir._blobs import BlobStore
+from pickledir._format import read_bucket, decode_value
+
+# (key_bytes, key, value)
+ScanResult = Tuple[bytes, Any, Any]
+
+
+def key_matches(key: Any, prefix: Any) -> bool:
+    return prefix is None or (isinstance(key, (str, bytes))
+                              and isinstance(prefix, type(key))
+                              and key.startswith(prefix))
+
+
+def scan_file(filepath: Path, version: Any, dirpath: Path,
+              prefix: Any = None,
+              predicate: Callable[[Any, Any], bool] = None,
+              copy_buffers: bool = False) -> List[ScanResult]:
+    """Reads the actual records from the bucket file. This runs in the
+    worker threads or processes, so it only reads and never modifies
+    the files.
+
+    The processes return the values pickled, so they read the out-of-band
+    buffers with `copy_buffers`: the memory-mapped `memoryview` objects
+    cannot be pickled."""
+    try:
+        with filepath.open('rb') as f:
+            data_version, items_dict = read_bucket(f)
+    except FileNotFoundError:
+        return []
+    if data_version != version:
+        return []
+
+    blobs = BlobStore(dirpath)
+    now = datetime.utcnow().replace(tzinfo=timezone.utc)
+    result = []
+    for key_bytes, rec in items_dict.items():
+        if rec.expires and now >= rec.expires:
+            continue
+        key = pickle.loads(key_bytes)
+        if not key_matches(key, prefix):
+            continue
+        value = decode_value(rec.data, blobs, copy_buffers)
+        if predicate is not None and not predicate(key, value):
+            continue
+        result.append((key_bytes, key, value))
+    return result
+
+
+def parallel_scan(files: Iterable[Path], version: Any, dirpath: Path,
+                  executor: Executor, max_pending: int,
+                  prefix: Any = None,
+                  predicate: Callable[[Any, Any], bool] = None) \
+        -> Iterator[ScanResult]:
+    """Reads the files on the executor. Results are yielded as soon as any
+    file is read. No more than `max_pending` files are being read or wait
+    to be consumed at the same time."""
+
+    files = iter(files)
+    copy_buffers = isinstance(executor, ProcessPoolExecutor)
+    pending: Set[Future] = set()
+    try:
+        while True:
+            while len(pending) < max_pending:
+                filepath = next(files, None)
+                if filepath is None:
+                    break
+                pending.add(executor.submit(scan_file, filepath, version,
+                                            dirpath, prefix, predicate,
+                                            copy_buffers))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def create_executor(workers: Optional[int], processes: bool) -> Executor:
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    if processes:
+        return ProcessPoolExecutor(workers)
+    return ThreadPoolExecutor(workers)
@@ -0,0 +1,324 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Storage spread over several directories.
+#
+# The keys are routed by the same 4096 bucket hashes that name the bucket
+# files, so all the keys of a bucket live in the same directory. Each
+# bucket is assigned to a directory by weighted rendezvous hashing (a form
+# of consistent hashing): every directory scores the bucket, and the highest
+# score wins. Adding or removing a directory changes the winner only for the
+# buckets it wins or loses, so `rebalance` moves only these.
+
+import hashlib
+import math
+import shutil
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+from pathlib import Path
+from typing import *
+
+from pickledir._format import Record, encode_value
+from pickledir._hex import hash_4096, hash_hex_many
+from pickledir._keys import pickle_key
+from pickledir._pickledir import PickleDir, TKey, TValue
+
+_BUCKETS = 4096
+
+# the number of records moved by `rebalance` at once
+_MOVE_BATCH = 256
+
+# (directory, weight)
+ShardSpec = Union[str, Path, Tuple[Union[str, Path], float]]
+
+
+def _score(shard_id: str, bucket: int, weight: float) -> float:
+    digest = hashlib.blake2b(f'{shard_id}:{bucket}'.encode(),
+                             digest_size=8).digest()
+    # uniform in (0, 1)
+    u = (int.from_bytes(digest, 'little') + 1) / (2 ** 64 + 2)
+    return -weight / math.log(u)
+
+
+def assign_buckets(shards: Sequence[Tuple[str, float]]) -> List[int]:
+    """Returns the index of the shard for each of the 4096 buckets."""
+    return [max(range(len(shards)),
+                key=lambda i: _score(shards[i][0], bucket, shards[i][1]))
+            for bucket in range(_BUCKETS)]
+
+
+def _interleave(iterators: List[Iterator]) -> Iterator:
+    # takes the items from the iterators in turn, so all of them progress
+    iterators = list(iterators)
+    while iterators:
+        for it in tuple(iterators):
+            try:
+                yield next(it)
+            except StopIteration:
+                iterators.remove(it)
+
+
+class ShardedPickleDir(Generic[TKey, TValue]):
+    """Storage that spreads the keys over several directories, such as
+    directories on different disks.
+
+    :param dirpaths: The directories. Each item is a path, or a tuple
+    (path, weight). A directory with the weight 2 gets twice as many keys
+    as the one with the weight 1. The directories are identified by their
+    paths: the same paths and weights route the keys the same way.
+
+    :param executor: Runs the operations on the directories in parallel.
+    By default, a thread pool with a thread per directory.
+
+    Other keyword arguments are passed to the `PickleDir` of each directory.
+    """
+
+    def __init__(self, dirpaths: Sequence[ShardSpec],
+                 executor: Executor = None, **kwargs):
+        specs: List[Tuple[Path, float]] = []
+        for spec in dirpaths:
+            path, weight = spec if isinstance(spec, tuple) else (spec, 1.0)
+            if weight <= 0:
+                raise ValueError(f"The weight must be positive: {spec}")
+            specs.append((Path(path), float(weight)))
+        if not specs:
+            raise ValueError("No directories")
+        if len(set(path for path, _ in specs)) != len(specs):
+            raise ValueError("Duplicate directories")
+
+        self._kwargs = kwargs
+        self.shards: List[PickleDir[TKey, TValue]] = [
+            PickleDir(path, **kwargs) for path, _ in specs]
+        self.weights = [weight for _, weight in specs]
+        self._routes = assign_buckets(
+            [(path.as_posix(), weight) for path, weight in specs])
+        self._executor = executor
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(len(self.shards))
+        return self._executor
+
+    def _shard_index(self, key_bytes: bytes) -> int:
+        return self._routes[int(hash_4096(key_bytes), 16)]
+
+    def shard_for(self, key: TKey) -> PickleDir[TKey, TValue]:
+        """Returns the directory storage that keeps the key."""
+        return self.shards[self._shard_index(PickleDir._key_to_bytes(key))]
+
+    def _group(self, keys: Iterable[TKey]) \
+            -> Dict[int, List[Tuple[int, TKey]]]:
+        # maps the shard index to the (position, key) pairs
+        keys = list(keys)
+        groups: Dict[int, List[Tuple[int, TKey]]] = dict()
+        routes = self._routes
+        for idx, (key, h) in enumerate(zip(keys, hash_hex_many(
+                map(pickle_key, keys), 3))):
+            groups.setdefault(routes[int(h, 16)], []).append((idx, key))
+        return groups
+
+    def _each(self, func: Callable[[PickleDir], Any]) -> List[Any]:
+        # runs the function for all the shards in parallel
+        futures = [self.executor.submit(func, shard) for shard in self.shards]
+        return [f.result() for f in futures]
+
+    # single keys
+
+    def get(self, key: TKey, max_age: timedelta = None,
+            default: Any = None) -> Optional[TValue]:
+        return self.shard_for(key).get(key, max_age=max_age, default=default)
+
+    def set(self, key: TKey, value: TValue,
+            max_age: timedelta = None) -> None:
+        self.shard_for(key).set(key, value, max_age=max_age)
+
+    def __getitem__(self, key: TKey) -> TValue:
+        return self.get(key, default=KeyError)
+
+    def __setitem__(self, key: TKey, value: TValue):
+        self.set(key, value)
+
+    def __delitem__(self, key: TKey):
+        del self.shard_for(key)[key]
+
+    def __contains__(self, key: TKey) -> bool:
+        return key in self.shard_for(key)
+
+    def update(self, key: TKey, func: Callable[[TValue], TValue],
+               default: TValue = None, max_age: timedelta = None) -> TValue:
+        return self.shard_for(key).update(key, func, default=default,
+                                          max_age=max_age)
+
+    def compare_and_set(self, key: TKey, expected: TValue, new: TValue,
+                        max_age: timedelta = None) -> bool:
+        return self.shard_for(key).compare_and_set(key, expected, new,
+                                                   max_age=max_age)
+
+    def incr(self, key: TKey, delta: Union[int, float] = 1,
+             max_age: timedelta = None) -> Union[int, float]:
+        return self.shard_for(key).incr(key, delta, max_age=max_age)
+
+    # bulk operations, running on the directories in parallel
+
+    def get_many(self, keys: Iterable[TKey], max_age: timedelta = None,
+                 default: Any = None) -> List[Optional[TValue]]:
+        groups = self._group(keys)
+        result: List[Any] = [default] * sum(map(len, groups.values()))
+        futures = [(positions, self.executor.submit(
+            self.shards[i].get_many, [key for _, key in positions],
+            max_age=max_age, default=default))
+            for i, positions in groups.items()]
+        for positions, future in futures:
+            for (idx, _), value in zip(positions, future.result()):
+                result[idx] = value
+        return result
+
+    def set_many(self, items: Union[Mapping[TKey, TValue],
+                                    Iterable[Tuple[TKey, TValue]]],
+                 max_age: timedelta = None) -> None:
+        items = list(items.items() if isinstance(items, Mapping) else items)
+        groups = self._group(key for key, _ in items)
+        futures = [self.executor.submit(
+            self.shards[i].set_many,
+            [items[idx] for idx, _ in positions], max_age=max_age)
+            for i, positions in groups.items()]
+        for future in futures:
+            future.result()
+
+    def delete_many(self, keys: Iterable[TKey]) -> None:
+        futures = [self.executor.submit(self.shards[i].delete_many,
+                                        [key for _, key in positions])
+                   for i, positions in self._group(keys).items()]
+        for future in futures:
+            future.result()
+
+    # all the items
+
+    def keys(self) -> Iterator[TKey]:
+        for shard in self.shards:
+            yield from shard.keys()
+
+    def __iter__(self) -> Iterator[TKey]:
+        return self.keys()
+
+    def items(self) -> Iterator[Tuple[TKey, TValue]]:
+        for shard in self.shards:
+            yield from shard.items()
+
+    def __len__(self) -> int:
+        return sum(self._each(len))
+
+    def scan(self, workers: int = None, max_pending: int = None,
+             prefix: Any = None,
+             predicate: Callable[[TKey, TValue], bool] = None) \
+            -> Iterator[Tuple[TKey, TValue]]:
+        """Like `PickleDir.scan`, but reads all the directories at once.
+        The items are yielded in arbitrary order.
+
+        :param workers: The number of threads per directory.
+        """
+        if workers is None:
+            workers = 4
+        executor = ThreadPoolExecutor(workers * len(self.shards))
+        scans = [shard.scan(executor=executor,
+                            max_pending=max_pending or workers * 2,
+                            prefix=prefix, predicate=predicate)
+                 for shard in self.shards]
+        try:
+            yield from _interleave(scans)
+        finally:
+            for it in scans:
+                # cancels the pending reads
+                it.close()
+            executor.shutdown(wait=False)
+
+    # maintenance
+
+    def sweep(self, max_buckets: int = None) -> int:
+        return sum(self._each(lambda shard: shard.sweep(max_buckets)))
+
+    def compact(self) -> None:
+        self._each(lambda shard: shard.compact())
+
+    def flush_expired(self) -> int:
+        return sum(self._each(lambda shard: shard.flush_expired()))
+
+    def collect_blobs(self, min_age: timedelta = timedelta(hours=1)) -> int:
+        return sum(self._each(lambda shard: shard.collect_blobs(min_age)))
+
+    def rebalance(self, removed: Iterable[Union[str, Path]] = ()) -> int:
+        """Moves the records to the directories they belong to. Call it
+        after changing the directories or their weights. Only the records
+        of the buckets that changed the directory are moved.
+
+        :param removed: The directories that are no longer used. All their
+        records are moved to the current directories.
+
+        Until the rebalance is complete, the records not moved yet are not
+        found. The records written while they are being moved may be
+        replaced by the older values, so it is better to pause the writes.
+
+        :return: The number of moved records.
+        """
+        sources: List[Tuple[Optional[int], PickleDir]] = \
+            list(enumerate(self.shards))
+        sources += [(None, PickleDir(path, **self._kwargs))
+                    for path in removed]
+        # the threads moving the records from different directories
+        # may write to the same one. Each directory is accessed by one
+        # thread at a time
+        locks = [threading.Lock() for _ in self.shards]
+        futures = [self.executor.submit(self._move_from, index, source, locks)
+                   for index, source in sources]
+        return sum(f.result() for f in futures)
+
+    def _move_from(self, index: Optional[int], source: PickleDir,
+                   locks: List[threading.Lock]) -> int:
+        # moves the records that do not belong to the shard `index`
+        # (all of them, if the index is None)
+        source_lock = locks[index] if index is not None else nullcontext()
+        with source_lock:
+            misplaced = [key_bytes for key_bytes in source._iter_key_bytes()
+                         if self._shard_index(key_bytes) != index]
+        moved = 0
+        for start in range(0, len(misplaced), _MOVE_BATCH):
+            batch = misplaced[start:start + _MOVE_BATCH]
+            targets: Dict[int, Dict[bytes, Record]] = dict()
+            with source_lock:
+                for key_bytes in batch:
+                    rec = source._read_raw(key_bytes)
+                    if rec is not None:  # not expired or deleted meanwhile
+                        targets.setdefault(self._shard_index(key_bytes),
+                                           dict())[key_bytes] = rec
+            for target, records in targets.items():
+                shard = self.shards[target]
+                with locks[target]:
+                    changes: Dict[bytes, Optional[Record]] = dict()
+                    for key_bytes, rec in records.items():
+                        # the records written to the target since the
+                        # routing changed are newer, they are kept
+                        existing = shard._read_raw(key_bytes)
+                        if existing is None or existing.created < rec.created:
+                            changes[key_bytes] = \
+                                self._copy_record(source, shard, rec)
+                    shard._commit(changes)
+                moved += len(changes)
+            with source_lock:
+                source._commit({key_bytes: None for key_bytes in batch})
+        return moved
+
+    @staticmethod
+    def _copy_record(source: PickleDir, target: PickleDir,
+                     rec: Record) -> Record:
+        # the values stay pickled. The blob files of the out-of-band
+        # buffers are copied to the target under the same names
+        encoded = encode_value(rec.data)
+        if encoded.buffers is not None:
+            name = encoded.buffers[0]
+            dst = target._blobs.path(name)
+            target._durability.make_dirs(dst.parent)
+            shutil.copyfile(str(source._blobs.path(name)), str(dst))
+        return rec._replace(data=encoded)
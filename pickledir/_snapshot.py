@@ -0,0 +1,233 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Read-only snapshot of a storage packed into a single file.
+#
+#   header | meta | records | hashes | entries
+#
+# The header is struct `_HEADER`: magic, number of records, and the offsets
+# of the meta, the hashes and the entries. The meta is a pickled dict with
+# the data version. Each record is the pickled key followed by the value
+# blob, exactly as in the bucket files (maybe compressed).
+#
+# The hashes are 64-bit hashes of the pickled keys, sorted, little-endian.
+# The entry at the same position describes the record (struct `_ENTRY`).
+# A key is found by a binary search on the hashes, without reading
+# anything else.
+
+import bisect
+import hashlib
+import mmap
+import pickle
+import struct
+import sys
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import *
+
+from pickledir._format import Record, Encoded, decode_value, encode_value
+from pickledir._keys import key_to_bytes
+
+MAGIC = b'PKDSNAP1'
+
+# magic, count, meta offset, meta length, hashes offset, entries offset
+_HEADER = struct.Struct('<8sQQQQQ')
+# key offset, key length, value offset, value length, codec,
+# created and expires (microseconds since the epoch, expires -1 if none)
+_ENTRY = struct.Struct('<QIQQBqq')
+_HASH = struct.Struct('<Q')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _key_hash(key_bytes: bytes) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
+
+def _to_micro(dt: Optional[datetime]) -> int:
+    return -1 if dt is None else (dt - _EPOCH) // _MICROSECOND
+
+
+def _from_micro(n: int) -> Optional[datetime]:
+    return None if n < 0 else _EPOCH + n * _MICROSECOND
+
+
+def write_snapshot(path: Path, data_version: Any,
+                   records: Iterable[Tuple[bytes, Record]],
+                   inline: Callable[[Encoded], Encoded]) -> int:
+    """Writes the records (with the values as `Encoded` or not encoded yet)
+    to the file. `inline` converts the values pickled with out-of-band
+    buffers to the ordinary ones. Returns the number of the records."""
+
+    temp_path = path.with_name(path.name + '.tmp')
+    entries: List[Tuple[int, bytes]] = []
+    with temp_path.open('wb') as f:
+        meta = pickle.dumps({'version': data_version},
+                            pickle.HIGHEST_PROTOCOL)
+        f.write(b'\0' * _HEADER.size)
+        f.write(meta)
+        pos = _HEADER.size + len(meta)
+        for key_bytes, rec in records:
+            encoded = encode_value(rec.data)
+            if encoded.buffers is not None:
+                encoded = inline(encoded)
+            f.write(key_bytes)
+            f.write(encoded.blob)
+            entries.append((_key_hash(key_bytes), _ENTRY.pack(
+                pos, len(key_bytes), pos + len(key_bytes),
+                len(encoded.blob), encoded.codec,
+                _to_micro(rec.created), _to_micro(rec.expires))))
+            pos += len(key_bytes) + len(encoded.blob)
+
+        entries.sort(key=lambda e: e[0])
+        hashes_offset = pos
+        f.write(b''.join(_HASH.pack(h) for h, _ in entries))
+        entries_offset = hashes_offset + _HASH.size * len(entries)
+        f.write(b''.join(entry for _, entry in entries))
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(entries), _HEADER.size, len(meta),
+                             hashes_offset, entries_offset))
+    temp_path.replace(path)
+    return len(entries)
+
+
+class _Hashes(Sequence[int]):
+    # the sorted hashes read from the file on big-endian machines
+    def __init__(self, buffer, offset: int, count: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i: int) -> int:
+        return _HASH.unpack_from(self._buffer, self._offset + i * _HASH.size)[0]
+
+
+class PickleDirSnapshot:
+    """Reads the snapshot written by `PickleDir.export_snapshot`.
+
+    The file is mapped to memory and nothing is read in advance, so opening
+    even a large snapshot takes no time. Expired records are treated as
+    missing.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, meta_offset, meta_len, hashes_offset, \
+            self._entries_offset = _HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a snapshot file: {self.path}")
+        meta = pickle.loads(self._mm[meta_offset:meta_offset + meta_len])
+        self.version = meta['version']
+
+        self._view = None
+        if sys.byteorder == 'little' and self._count:
+            # zero-copy array of the hashes
+            self._view = memoryview(self._mm)
+            self._hashes: Sequence[int] = self._view[
+                hashes_offset:hashes_offset + self._count * _HASH.size
+            ].cast('Q')
+        else:
+            self._hashes = _Hashes(self._mm, hashes_offset, self._count)
+
+    def close(self):
+        if self._view is not None:
+            self._hashes.release()
+            self._view.release()
+            self._view = None
+        self._mm.close()
+
+    def __enter__(self) -> 'PickleDirSnapshot':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _entry(self, i: int) -> Tuple[int, int, int, int, int, int, int]:
+        return _ENTRY.unpack_from(self._mm,
+                                  self._entries_offset + i * _ENTRY.size)
+
+    def _find(self, key_bytes: bytes) -> Optional[Tuple]:
+        h = _key_hash(key_bytes)
+        i = bisect.bisect_left(self._hashes, h)
+        mm = self._mm
+        while i < self._count and self._hashes[i] == h:
+            entry = self._entry(i)
+            key_offset, key_len = entry[0], entry[1]
+            if mm[key_offset:key_offset + key_len] == key_bytes:
+                return entry
+            i += 1
+        return None
+
+    @staticmethod
+    def _is_alive(entry: Tuple, now: datetime) -> bool:
+        return entry[6] < 0 or _to_micro(now) < entry[6]
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.utcnow().replace(tzinfo=timezone.utc)
+
+    def _value(self, entry: Tuple) -> Any:
+        value_offset, value_len, codec = entry[2], entry[3], entry[4]
+        return decode_value(Encoded(
+            self._mm[value_offset:value_offset + value_len], None, codec))
+
+    def get(self, key: Any, max_age: timedelta = None, default=None) -> Any:
+        entry = self._find(key_to_bytes(key))
+        now = self._now()
+        if entry is not None and self._is_alive(entry, now) and (
+                max_age is None
+                or _from_micro(entry[5]) >= now - max_age):
+            return self._value(entry)
+        if default == KeyError:
+            raise KeyError(key)
+        return default
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.get(key, default=KeyError)
+
+    def __contains__(self, key: Any) -> bool:
+        entry = self._find(key_to_bytes(key))
+        return entry is not None and self._is_alive(entry, self._now())
+
+    def _iter_entries(self) -> Iterator[Tuple]:
+        now = self._now()
+        for i in range(self._count):
+            entry = self._entry(i)
+            if self._is_alive(entry, now):
+                yield entry
+
+    def _key(self, entry: Tuple) -> Any:
+        return pickle.loads(self._mm[entry[0]:entry[0] + entry[1]])
+
+    def keys(self) -> Iterator[Any]:
+        """Iterates the keys in the order of their hashes."""
+        for entry in self._iter_entries():
+            yield self._key(entry)
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.keys()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._iter_entries())
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        for entry in self._iter_entries():
+            yield self._key(entry), self._value(entry)
+
+    def _raw_records(self) -> Iterator[Tuple[bytes, Record]]:
+        # the key bytes and the records with `Encoded` values
+        for entry in self._iter_entries():
+            value_offset, value_len = entry[2], entry[3]
+            yield self._mm[entry[0]:entry[0] + entry[1]], Record(
+                _from_micro(entry[5]), _from_micro(entry[6]),
+                Encoded(self._mm[value_offset:value_offset + value_len],
+                        None, entry[4]))
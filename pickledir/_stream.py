@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Values written and read as streams.
+#
+# The data is written in chunks straight to a blob file. The record in the
+# bucket is the same as for a single out-of-band buffer: the pickle of
+# a `PickleBuffer` referring to the whole blob file. So `get` returns the
+# value as a memory-mapped `memoryview`, and the blob file is removed with
+# the record, like any other blob.
+
+import io
+import pickle
+from typing import *
+
+from pickledir._blobs import BlobStore, BuffersRef
+from pickledir._durability import Durability
+from pickledir._format import Encoded
+
+# the pickle of a single read-only out-of-band buffer. It does not depend
+# on the buffer content
+STREAM_PICKLE = pickle.dumps(pickle.PickleBuffer(b''), 5,
+                             buffer_callback=lambda _: False)
+
+
+def is_stream(encoded: Encoded) -> bool:
+    return encoded.buffers is not None and encoded.blob == STREAM_PICKLE \
+        and encoded.codec == 0 and len(encoded.buffers[1]) == 1
+
+
+class StreamWriter(io.RawIOBase):
+    """Writes a value to a blob file. The value is stored by the key when
+    the writer is closed. Used as a context manager, stores nothing if the
+    block raised an exception."""
+
+    def __init__(self, blobs: BlobStore, durability: Durability,
+                 commit: Callable[[Encoded], None]):
+        super().__init__()
+        self._blobs = blobs
+        self._durability = durability
+        self._commit = commit
+        self._name = blobs.new_name()
+        self._file = blobs.create(self._name)
+        self._size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        n = self._file.write(data)
+        self._size += n
+        return n
+
+    def tell(self) -> int:
+        return self._size
+
+    def abort(self):
+        """Closes the writer without storing the value."""
+        if self.closed:
+            return
+        self._file.close()
+        self._blobs.remove(self._name)
+        super().close()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._durability.sync_data(self._file)
+            self._file.close()
+            self._durability.written(self._blobs.path(self._name),
+                                     self._size)
+            ref: BuffersRef = (self._name, [(0, self._size)])
+            self._commit(Encoded(STREAM_PICKLE, ref))
+        except BaseException:
+            self.abort()
+            raise
+        super().close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __del__(self):
+        # the writer that was not closed stores nothing
+        if hasattr(self, '_file'):
+            self.abort()
+
+
+def open_stream(blobs: BlobStore, ref: BuffersRef) -> BinaryIO:
+    """Opens the blob file of the streamed value. Raises FileNotFoundError
+    if it was removed."""
+    return blobs.path(ref[0]).open('rb')
@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+# Incremental removal of expired records and eviction of the oldest ones.
+#
+# The sweeper walks the bucket files in passes, a limited number of files
+# per call. During a pass it counts the records and their sizes, and keeps
+# a uniform sample of their creation times. When a pass is finished and
+# the storage exceeds the limits, the sample gives the creation time
+# cutoff: during the next pass the records created before the cutoff are
+# evicted.
+#
+# Many records may have the same creation time (the ones written by
+# `set_many` or a transaction share it), so the records created exactly
+# at the cutoff are evicted only until the excess estimated by the sample
+# is gone.
+
+import math
+import random
+from datetime import datetime
+from pathlib import Path
+from typing import *
+
+_SAMPLE_SIZE = 4096
+
+# (created, size in bytes)
+RecordStat = Tuple[datetime, int]
+
+
+class Sweeper:
+
+    def __init__(self, max_items: int = None, max_bytes: int = None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.cutoff: Optional[datetime] = None
+        # how many records and bytes created at the cutoff to evict
+        self._tie_items = 0
+        self._tie_bytes = 0
+        self._pending: List[Path] = []
+        self._start_pass([])
+
+    def _start_pass(self, files: List[Path]):
+        self._pending = list(reversed(files))
+        self.items = 0
+        self.bytes = 0
+        self._seen = 0
+        self._sample: List[RecordStat] = []
+
+    @property
+    def pass_complete(self) -> bool:
+        return not self._pending
+
+    def next_file(self, list_files: Callable[[], List[Path]]) \
+            -> Optional[Path]:
+        if not self._pending:
+            self._start_pass(list_files())
+        return self._pending.pop() if self._pending else None
+
+    def account(self, stats: List[RecordStat]):
+        for stat in stats:
+            self.items += 1
+            self.bytes += stat[1]
+            # reservoir sampling
+            self._seen += 1
+            if len(self._sample) < _SAMPLE_SIZE:
+                self._sample.append(stat)
+            else:
+                i = random.randrange(self._seen)
+                if i < _SAMPLE_SIZE:
+                    self._sample[i] = stat
+
+    def evicts(self, created: datetime, size: int) -> bool:
+        """Whether the record is evicted in the current pass."""
+        cutoff = self.cutoff
+        if cutoff is None or created > cutoff:
+            return False
+        if created < cutoff:
+            return True
+        if self._tie_items <= 0 and self._tie_bytes <= 0:
+            return False
+        self._tie_items -= 1
+        self._tie_bytes -= size
+        return True
+
+    def over_limits(self) -> bool:
+        return (self.max_items is not None and self.items > self.max_items) \
+               or (self.max_bytes is not None
+                   and self.bytes > self.max_bytes)
+
+    def finish_pass(self):
+        """Computes the cutoff for the next pass from the statistics of
+        the finished one."""
+        self.cutoff = None
+        if not self._sample:
+            return
+
+        sample = sorted(self._sample)
+        cutoffs = []
+
+        if self.max_items is not None and self.items > self.max_items:
+            fraction = (self.items - self.max_items) / self.items
+            k = max(0, math.ceil(fraction * len(sample)) - 1)
+            cutoffs.append(sample[k][0])
+
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            # the sample is uniform by the records, so we weight them
+            # by size walking from the oldest ones
+            fraction = (self.bytes - self.max_bytes) / self.bytes
+            target = fraction * sum(size for _, size in sample)
+            acc = 0
+            cutoff = sample[-1][0]
+            for created, size in sample:
+                acc += size
+                if acc >= target:
+                    cutoff = created
+                    break
+            cutoffs.append(cutoff)
+
+        if not cutoffs:
+            return
+        self.cutoff = cutoff = max(cutoffs)
+
+        # the records created before the cutoff are evicted anyway. The
+        # rest of the excess is taken from the records created at it
+        n = len(sample)
+        older = [size for created, size in sample if created < cutoff]
+        self._tie_items = self._tie_bytes = 0
+        if self.max_items is not None and self.items > self.max_items:
+            self._tie_items = (self.items - self.max_items) \
+                - math.floor(self.items * len(older) / n)
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            sample_bytes = sum(size for _, size in sample)
+            older_bytes = self.bytes * sum(older) / sample_bytes \
+                if sample_bytes else 0
+            self._tie_bytes = (self.bytes - self.max_bytes) - older_bytes
@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+from datetime import timedelta
+from typing import *
+
+from pickledir._format import Record
+from pickledir._keys import pickle_key
+
+if TYPE_CHECKING:
+    from pickledir._pickledir import PickleDir
+
+
+class Transaction:
+    """Collects the writes in memory and applies them together on `commit`.
+
+    Used as a context manager, commits on exit, or discards the writes
+    if the block raised an exception.
+    """
+
+    def __init__(self, store: 'PickleDir'):
+        self._store = store
+        # key bytes -> record, or None for deletion
+        self._changes: Dict[bytes, Optional[Record]] = dict()
+
+    def set(self, key: Any, value: Any, max_age: timedelta = None) -> None:
+        created = self._store._now()
+        self._changes[pickle_key(key)] = Record(
+            created, created + max_age if max_age else None, value)
+
+    def __setitem__(self, key: Any, value: Any):
+        self.set(key, value)
+
+    def delete(self, key: Any) -> None:
+        self._changes[pickle_key(key)] = None
+
+    def __delitem__(self, key: Any):
+        self.delete(key)
+
+    def get(self, key: Any, default=None) -> Any:
+        """Returns the value written in this transaction, or the value
+        from the storage."""
+        key_bytes = pickle_key(key)
+        if key_bytes not in self._changes:
+            return self._store.get(key, default=default)
+        rec = self._changes[key_bytes]
+        if rec is None:
+            if default == KeyError:
+                raise KeyError
+            return default
+        return rec.data
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.get(key, default=KeyError)
+
+    def __len__(self) -> int:
+        """The number of the keys written or deleted."""
+        return len(self._changes)
+
+    def commit(self) -> None:
+        changes, self._changes = self._changes, dict()
+        self._store._commit(changes)
+
+    def rollback(self) -> None:
+        self._changes.clear()
+
+    def __enter__(self) -> 'Transaction':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
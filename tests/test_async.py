@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import AsyncPickleDir, PickleDir
+from tests.test_cache import find_same_hash_keys
+
+
+class TestAsyncPickleDir(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.td = TemporaryDirectory()
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    async def test_get_set_delete(self):
+        cache = AsyncPickleDir(self.td.name)
+        self.assertIsNone(await cache.get('a'))
+        with self.assertRaises(KeyError):
+            await cache.get('a', default=KeyError)
+        self.assertFalse(await cache.contains('a'))
+
+        await cache.set('a', 1)
+        self.assertEqual(await cache.get('a'), 1)
+        self.assertTrue(await cache.contains('a'))
+        self.assertEqual(PickleDir(self.td.name)['a'], 1)
+
+        await cache.delete('a')
+        self.assertFalse(await cache.contains('a'))
+
+    async def test_max_age(self):
+        cache = AsyncPickleDir(self.td.name)
+        await cache.set('a', 1, max_age=timedelta(seconds=-1))
+        self.assertIsNone(await cache.get('a'))
+        await cache.set('b', 2)
+        self.assertIsNone(
+            await cache.get('b', max_age=timedelta(seconds=-1)))
+
+    async def test_bulk(self):
+        cache = AsyncPickleDir(self.td.name,
+                               executor=ThreadPoolExecutor(2))
+        await cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(await cache.get_many(['c', 'x', 'a']),
+                         [3, None, 1])
+        await cache.delete_many(['a', 'c'])
+        self.assertEqual(await cache.get_many(['a', 'b', 'c']),
+                         [None, 2, None])
+
+    async def test_items(self):
+        cache = AsyncPickleDir(self.td.name)
+        expected = {f'key{i}': i for i in range(200)}
+        await cache.set_many(expected)
+        result = dict()
+        async for key, value in cache.items():
+            result[key] = value
+        self.assertEqual(result, expected)
+
+    async def test_concurrent_reads_share_load(self):
+        gen = iter(find_same_hash_keys())
+        keys = [next(gen) for _ in range(4)]
+
+        sync = PickleDir(self.td.name)
+        sync.set_many({k: i for i, k in enumerate(keys)})
+
+        loads = []
+        original = sync._load_file
+
+        def slow_load(filepath, for_read=False):
+            loads.append(filepath)
+            time.sleep(0.1)
+            return original(filepath, for_read=for_read)
+
+        sync._load_file = slow_load
+        cache = AsyncPickleDir(sync)
+
+        values = await asyncio.gather(*(cache.get(k) for k in keys))
+        self.assertEqual(values, [0, 1, 2, 3])
+        self.assertEqual(len(loads), 1)
+
+        # after the write the new data is loaded again
+        await cache.set(keys[0], 'new')
+        self.assertEqual(await cache.get(keys[0]), 'new')
+        self.assertEqual(len(loads), 3)  # one more by set, one by get
+
+    async def test_layout_checked_off_loop(self):
+        sync = PickleDir(self.td.name)
+        loop_thread = threading.get_ident()
+        threads = []
+        original = sync._refresh_meta
+
+        def refresh_meta():
+            threads.append(threading.get_ident())
+            return original()
+
+        sync._refresh_meta = refresh_meta
+        cache = AsyncPickleDir(sync)
+        await cache.set('a', 1)
+        self.assertEqual(await cache.get('a'), 1)
+        self.assertTrue(await cache.contains('a'))
+        await cache.set_many({'b': 2, 'c': 3})
+        self.assertEqual(await cache.get_many(['a', 'c']), [1, 3])
+        await cache.delete_many(['b'])
+        await cache.delete('a')
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import pickle
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+from tests.test_cache import find_same_hash_keys
+
+
+def blob_files(cache: PickleDir):
+    return list(cache._blobs.iter_names())
+
+
+class TestOutOfBand(unittest.TestCase):
+
+    def test_zero_copy_read(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=1024)
+            data = bytes(range(256)) * 100
+            cache['a'] = pickle.PickleBuffer(data)
+            self.assertEqual(len(blob_files(cache)), 1)
+
+            value = cache['a']
+            self.assertIsInstance(value, memoryview)
+            self.assertTrue(value.readonly)
+            self.assertEqual(bytes(value), data)
+
+    def test_small_buffers_in_band(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=1024)
+            cache['a'] = pickle.PickleBuffer(b'small')
+            self.assertEqual(blob_files(cache), [])
+            self.assertEqual(bytes(cache['a']), b'small')
+
+    def test_mixed_values(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=16)
+            cache['a'] = {'small': pickle.PickleBuffer(b'x'),
+                          'large': pickle.PickleBuffer(b'y' * 100),
+                          'other': [1, 2, 3]}
+            expected = {'small': b'x', 'large': b'y' * 100,
+                        'other': [1, 2, 3]}
+
+            def as_bytes(d):
+                return {k: v if isinstance(v, list) else bytes(v)
+                        for k, v in d.items()}
+
+            self.assertEqual(len(blob_files(cache)), 1)
+            self.assertEqual(as_bytes(cache['a']), expected)
+            self.assertEqual(as_bytes(dict(cache.items())['a']), expected)
+            self.assertEqual(as_bytes(cache.get_many(['a'])[0]), expected)
+
+            # the store without the threshold still reads the buffers
+            self.assertEqual(as_bytes(PickleDir(td)['a']), expected)
+
+    def test_blobs_removed(self):
+        k1 = 'key_one'
+        same = iter(find_same_hash_keys(k1))
+        next(same)
+        k2 = next(same)
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=16)
+            cache[k1] = pickle.PickleBuffer(b'1' * 100)
+            cache[k2] = pickle.PickleBuffer(b'2' * 100)
+            self.assertEqual(len(blob_files(cache)), 2)
+
+            # overwriting
+            cache[k1] = pickle.PickleBuffer(b'3' * 100)
+            self.assertEqual(len(blob_files(cache)), 2)
+            self.assertEqual(bytes(cache[k1]), b'3' * 100)
+            self.assertEqual(bytes(cache[k2]), b'2' * 100)
+
+            del cache[k2]
+            self.assertEqual(len(blob_files(cache)), 1)
+
+            # the last record removed with the file
+            cache.set(k1, 0, max_age=timedelta(seconds=-1))
+            self.assertNotIn(k1, cache)
+            self.assertEqual(blob_files(cache), [])
+
+    def test_reshard_keeps_blobs(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=16)
+            cache['a'] = pickle.PickleBuffer(b'a' * 100)
+            cache.reshard(65536)
+            self.assertEqual(bytes(cache['a']), b'a' * 100)
+            self.assertEqual(len(blob_files(cache)), 1)
@@ -217,6 +217,78 @@ class TestCache(unittest.TestCase):
             cache: PickleDir[str, int] = PickleDir(td)
             cache['a'] = 1
 
+    def test_keys_and_len(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(list(cache.keys()), [])
+            cache['a'] = 1
+            cache[5] = 2
+            cache.set('expired', 3, max_age=timedelta(seconds=-1))
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(sorted(cache.keys(), key=str), [5, 'a'])
+            self.assertEqual(sorted(cache, key=str), [5, 'a'])
+            del cache['a']
+            self.assertEqual(list(cache), [5])
+
+    def test_keys_other_version(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td, version=1)['a'] = 1
+            cache = PickleDir(td, version=2)
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(files_count(cache), 0)
+
+    def test_set_get_many(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({'a': 1, 'b': 2})
+            cache.set_many([('c', 3), ({1, 2}, 'set')])
+            self.assertEqual(cache.get_many(['b', 'x', {1, 2}, 'a'],
+                                            default=-1),
+                             [2, -1, 'set', 1])
+            self.assertEqual(cache['c'], 3)
+
+    def test_many_loads_each_file_once(self):
+        k1 = 'key_one'
+        same = iter(find_same_hash_keys(k1))
+        next(same)
+        k2 = next(same)
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            loaded = []
+            original = cache._load_file
+
+            def counting_load(filepath, for_read=False):
+                loaded.append(filepath)
+                return original(filepath, for_read=for_read)
+
+            cache._load_file = counting_load
+
+            cache.set_many({k1: 1, k2: 2, 'other-hash': 3})
+            self.assertEqual(len(loaded), 2)
+            self.assertEqual(files_count(cache), 2)
+
+            loaded.clear()
+            self.assertEqual(cache.get_many([k1, k2]), [1, 2])
+            self.assertEqual(len(loaded), 1)
+
+            loaded.clear()
+            cache.delete_many([k1, k2, 'missing'])
+            self.assertEqual(len(set(loaded)), len(loaded))
+            self.assertEqual(cache.get_many([k1, k2, 'other-hash']),
+                             [None, None, 3])
+            self.assertEqual(files_count(cache), 1)
+
+    def test_get_many_max_age(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({'a': 1, 'b': 2}, max_age=timedelta(seconds=0.25))
+            self.assertEqual(cache.get_many(['a', 'b']), [1, 2])
+            self.assertEqual(
+                cache.get_many(['a'], max_age=timedelta(seconds=-1)), [None])
+            time.sleep(0.5)
+            self.assertEqual(cache.get_many(['a', 'b']), [None, None])
+
     def test_hashes_do_not_change(self):
         self.assertEqual(key_to_hash('first'), '7a4')
         self.assertEqual(key_to_hash('second'), '68f')
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir, ZlibCodec, LzmaCodec
+from pickledir._format import read_header
+
+
+def dir_size(td: str) -> int:
+    return sum(p.stat().st_size for p in Path(td).rglob('*') if p.is_file())
+
+
+class TestCodecs(unittest.TestCase):
+
+    def test_compressed_smaller(self):
+        value = [{'name': 'item', 'tags': ['a', 'b', 'c']}] * 1000
+        sizes = dict()
+        for codec in (None, 'zlib', 'lzma'):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, codec=codec)
+                cache['a'] = value
+                self.assertEqual(PickleDir(td)['a'], value)
+                sizes[codec] = dir_size(td)
+        self.assertLess(sizes['zlib'], sizes[None])
+        self.assertLess(sizes['lzma'], sizes[None])
+
+    def test_min_size(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, codec=ZlibCodec(level=9, min_size=1000))
+            cache['small'] = 'x' * 100
+            cache['large'] = 'x' * 10000
+            codecs = dict()
+            for fn in cache._iter_bucket_files():
+                with fn.open('rb') as f:
+                    for key_bytes, entry in read_header(f).index.items():
+                        codecs[cache._bytes_to_key(key_bytes)] = \
+                            entry[5] if len(entry) > 5 else 0
+            self.assertEqual(codecs, {'small': 0, 'large': ZlibCodec.id})
+
+    def test_mixed(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td)['plain'] = 'p' * 1000
+            PickleDir(td, codec='zlib')['zlib'] = 'z' * 1000
+            cache = PickleDir(td, codec=LzmaCodec(level=1))
+            cache['lzma'] = 'l' * 1000
+            self.assertEqual(
+                sorted(cache.items()),
+                [('lzma', 'l' * 1000), ('plain', 'p' * 1000),
+                 ('zlib', 'z' * 1000)])
+
+    def test_append_only(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True, codec='zlib')
+            cache['a'] = 'a' * 1000
+            self.assertEqual(PickleDir(td, append_only=True)['a'], 'a' * 1000)
+            cache.compact()
+            self.assertEqual(PickleDir(td)['a'], 'a' * 1000)
+
+    def test_unknown(self):
+        with TemporaryDirectory() as td:
+            with self.assertRaises(ValueError):
+                PickleDir(td, codec='unknown')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import pickle
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+from pickledir._blobs import BlobStore
+
+
+class Counted:
+    pickled = 0
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce__(self):
+        Counted.pickled += 1
+        return Counted, (self.data,)
+
+
+def blob_files(cache: PickleDir):
+    return sorted(BlobStore(cache.dirpath).iter_names())
+
+
+def make_old(cache: PickleDir):
+    # as if the blob files were written long ago
+    store = BlobStore(cache.dirpath)
+    for name in store.iter_names():
+        os.utime(str(store.path(name)), (0, 0))
+
+
+class TestDedup(unittest.TestCase):
+
+    def test_equal_values_stored_once(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, dedup_threshold=1000,
+                                  append_only=append_only)
+                data = os.urandom(10_000)
+                for i in range(10):
+                    cache[i] = data
+                cache['other'] = os.urandom(10_000)
+                cache['small'] = b'small'
+                self.assertEqual(len(blob_files(cache)), 2)
+                self.assertEqual(cache[5], data)
+                self.assertEqual(cache.get_many([0, 9]), [data, data])
+                self.assertEqual(cache['small'], b'small')
+                cache.compact()
+                self.assertEqual(cache[3], data)
+
+                # reading without the argument
+                self.assertEqual(PickleDir(td, append_only=append_only)[1],
+                                 data)
+
+    def test_pickled_once(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, dedup_threshold=1000)
+            for data in ('small', 'x' * 10_000):
+                Counted.pickled = 0
+                cache['a'] = Counted(data)
+                self.assertEqual(Counted.pickled, 1)
+                self.assertEqual(cache['a'].data, data)
+
+    def test_out_of_band_buffers(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, dedup_threshold=1000, oob_threshold=100)
+            data = os.urandom(10_000)
+            for i in range(5):
+                cache[i] = pickle.PickleBuffer(data)
+            cache['small'] = pickle.PickleBuffer(os.urandom(500))
+            # the shared file and the file of the small buffer
+            self.assertEqual(len(blob_files(cache)), 2)
+            value = cache[3]
+            # still memory-mapped
+            self.assertIsInstance(value, memoryview)
+            self.assertEqual(bytes(value), data)
+
+            del cache[0]
+            del cache['small']
+            make_old(cache)
+            self.assertEqual(cache.collect_blobs(), 0)
+            self.assertEqual(bytes(cache[4]), data)
+
+    def test_bucket_files_stay_small(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, dedup_threshold=1000)
+            for i in range(10):
+                cache[i] = b'x' * 100_000
+            bucket_bytes = sum(f.stat().st_size
+                               for f in cache._iter_bucket_files())
+            self.assertLess(bucket_bytes, 10_000)
+
+    def test_compressed(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, dedup_threshold=1000, codec='zlib')
+            cache['a'] = cache['b'] = 'text' * 10_000
+            store = BlobStore(cache.dirpath)
+            [name] = store.iter_names()
+            self.assertLess(store.path(name).stat().st_size, 10_000)
+            self.assertEqual(cache['b'], 'text' * 10_000)
+
+    def test_removal_keeps_shared(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, dedup_threshold=1000)
+            cache['a'] = cache['b'] = b'x' * 10_000
+            del cache['a']
+            self.assertEqual(cache['b'], b'x' * 10_000)
+            cache['b'] = 'replaced'
+            # the file is not referenced, but removed only by collecting
+            self.assertEqual(len(blob_files(cache)), 1)
+
+    def test_collect_blobs(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, dedup_threshold=1000,
+                                  append_only=append_only)
+                cache['a'] = cache['b'] = b'a' * 10_000
+                cache['c'] = b'c' * 10_000
+                cache['c'] = 'replaced'
+                self.assertEqual(len(blob_files(cache)), 2)
+
+                # the recent files are kept
+                self.assertEqual(cache.collect_blobs(), 0)
+                make_old(cache)
+                self.assertEqual(cache.collect_blobs(), 1)
+                self.assertEqual(len(blob_files(cache)), 1)
+                self.assertEqual(cache['a'], b'a' * 10_000)
+
+                del cache['a']
+                del cache['b']
+                self.assertEqual(cache.collect_blobs(min_age=timedelta(0)),
+                                 1)
+                self.assertEqual(blob_files(cache), [])
+
+    def test_rewriting_refreshes_old_file(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, dedup_threshold=1000)
+            cache['a'] = b'a' * 10_000
+            del cache['a']
+            make_old(cache)
+            # the same content is written again and must survive
+            cache['b'] = b'a' * 10_000
+            self.assertEqual(cache.collect_blobs(), 0)
+            self.assertEqual(cache['b'], b'a' * 10_000)
+
+    def test_collect_crash_leftovers(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=16)
+            store = BlobStore(Path(td))
+            with store.create(store.new_name()) as f:
+                f.write(b'orphan')
+            with cache.open_writer('a') as f:
+                f.write(b'referenced')
+            make_old(cache)
+            self.assertEqual(cache.collect_blobs(), 1)
+            with cache.open_reader('a') as f:
+                self.assertEqual(f.read(), b'referenced')
+
+    def test_snapshot(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(Path(td) / 'a', dedup_threshold=1000)
+            cache['a'] = cache['b'] = b'x' * 10_000
+            cache.export_snapshot(Path(td) / 'snap')
+            other = PickleDir(Path(td) / 'b')
+            other.import_snapshot(Path(td) / 'snap')
+            self.assertEqual(other['a'], b'x' * 10_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import pickle
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pickledir import PickleDir
+from pickledir import _durability
+from pickledir._durability import Durability
+
+
+class TestDurability(unittest.TestCase):
+
+    def test_unknown(self):
+        with TemporaryDirectory() as td:
+            with self.assertRaises(ValueError):
+                PickleDir(td, durability='always')
+
+    def test_none(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            with mock.patch('os.fsync') as fsync:
+                cache['a'] = 1
+                del cache['a']
+                cache.sync()
+            fsync.assert_not_called()
+
+    def test_fsync(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, durability='fsync')
+            with mock.patch.object(_durability, 'fsync_dir') as fsync_dir, \
+                    mock.patch('os.fsync') as fsync:
+                cache['a'] = 1
+                # the temp file before the replace
+                fsync.assert_called_once()
+                fsync_dir.assert_called_once_with(Path(td))
+                del cache['a']
+                self.assertEqual(fsync_dir.call_count, 2)
+            self.assertEqual(cache._durability.fsyncs, 3)
+
+    def test_fsync_new_directories(self):
+        with TemporaryDirectory() as td:
+            root = Path(td) / 'new'
+            cache = PickleDir(root, durability='fsync', buckets=65536,
+                              oob_threshold=16)
+            with mock.patch.object(_durability, 'fsync_dir') as fsync_dir:
+                cache['a'] = pickle.PickleBuffer(bytearray(100))
+            synced = set(call.args[0] for call in fsync_dir.call_args_list)
+            bucket = cache._key_bytes_to_file(cache._key_to_bytes('a'))
+            blob = next(cache._blobs.root.iterdir())
+            # each new directory is durable in its parent
+            for d in (bucket.parent, cache._blobs.root, blob):
+                self.assertIn(d.parent, synced)
+            # the storage directory was created with the metadata file
+            self.assertTrue(root.exists())
+
+        with TemporaryDirectory() as td:
+            durability = Durability('fsync')
+            with mock.patch.object(_durability, 'fsync_dir') as fsync_dir:
+                durability.make_dirs(Path(td) / 'a' / 'b')
+                durability.make_dirs(Path(td) / 'a' / 'b')
+            self.assertEqual([call.args[0]
+                              for call in fsync_dir.call_args_list],
+                             [Path(td), Path(td) / 'a'])
+
+    def test_fsync_modes_work(self):
+        # the fsyncs are real here
+        for mode in ('fsync', 'group'):
+            for append_only in (False, True):
+                with TemporaryDirectory() as td:
+                    cache = PickleDir(td, durability=mode,
+                                      append_only=append_only,
+                                      oob_threshold=16)
+                    cache['a'] = bytearray(100)
+                    with cache.transaction() as tx:
+                        for i in range(10):
+                            tx[i] = i
+                    cache.sync()
+                    self.assertGreater(cache._durability.fsyncs, 0)
+                    self.assertEqual(PickleDir(td, append_only=append_only)
+                                     .get_many(range(10)), list(range(10)))
+
+    def test_group_by_time(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, durability='group', group_interval=0.05)
+            with mock.patch.object(_durability, 'fsync_file') as fsync_file:
+                for i in range(5):
+                    cache[i] = i
+                fsync_file.assert_not_called()
+                for _ in range(100):
+                    if fsync_file.call_count:
+                        break
+                    time.sleep(0.01)
+                # all the files at once
+                self.assertEqual(fsync_file.call_count, 5)
+
+    def test_group_by_bytes(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, durability='group', group_interval=60,
+                              group_bytes=10000)
+            with mock.patch.object(_durability, 'fsync_file') as fsync_file:
+                cache['small'] = 1
+                fsync_file.assert_not_called()
+                cache['large'] = os.urandom(10000)
+                self.assertEqual(fsync_file.call_count, 2)
+            cache.sync()
+
+    def test_group_removed_file_skipped(self):
+        with TemporaryDirectory() as td:
+            durability = Durability('group', interval=60)
+            path = Path(td) / 'file'
+            path.write_bytes(b'data')
+            durability.written(path)
+            path.unlink()
+            durability.removed(path)
+            durability.sync()
+            # only the directory
+            self.assertEqual(durability.fsyncs, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pickledir import PickleDir
+
+
+def fill(cache: PickleDir):
+    cache.set('alive', 1)
+    cache.set('expired', 2, max_age=timedelta(seconds=-1))
+
+
+def records_in_files(cache: PickleDir) -> int:
+    return sum(len(cache._read_expires(fn)[1])
+               for fn in cache._iter_bucket_files())
+
+
+class TestExpiryPolicy(unittest.TestCase):
+
+    def test_unknown(self):
+        with TemporaryDirectory() as td:
+            with self.assertRaises(ValueError):
+                PickleDir(td, expiry='sometimes')
+
+    def test_lazy_purges_on_read(self):
+        for concurrent in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, concurrent=concurrent)
+                fill(cache)
+                self.assertEqual(records_in_files(cache), 2)
+                self.assertIsNone(cache.get('expired'))
+                self.assertEqual(records_in_files(cache), 1)
+
+    def test_purged_by_another_reader(self):
+        for concurrent in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, concurrent=concurrent)
+                cache.set_many({'a': 1, 'b': 2},
+                               max_age=timedelta(seconds=-1))
+                other = PickleDir(td, concurrent=concurrent)
+                original = cache._purge_file
+
+                def purge_after_other(filepath, items_dict=None):
+                    # the other reader removes the emptied file first
+                    other._purge_file(filepath)
+                    original(filepath, items_dict)
+
+                cache._purge_file = purge_after_other
+                self.assertEqual(cache.get_many(['a', 'b']), [None, None])
+                self.assertIsNone(cache.get('a'))
+                self.assertEqual(list(cache._iter_bucket_files()), [])
+
+    def test_reads_do_not_write(self):
+        for expiry in ('deferred', 'none'):
+            for concurrent in (False, True):
+                with TemporaryDirectory() as td:
+                    fill(PickleDir(td))
+                    PickleDir(td, version=2).set('other', 3)
+                    cache = PickleDir(td, expiry=expiry,
+                                      concurrent=concurrent)
+                    with mock.patch.object(
+                            PickleDir, '_save_file',
+                            side_effect=AssertionError), \
+                            mock.patch.object(
+                                PickleDir, '_remove_file',
+                                side_effect=AssertionError):
+                        self.assertIsNone(cache.get('expired'))
+                        self.assertEqual(cache.get_many(
+                            ['alive', 'expired']), [1, None])
+                        self.assertEqual(list(cache.keys()), ['alive'])
+                        self.assertIsNone(cache.get('other'))
+                        self.assertEqual(dict(cache.items()), {'alive': 1})
+                        cache.export_snapshot(Path(td) / 'snap')
+                    self.assertEqual(records_in_files(cache), 3)
+
+    def test_expired_counted(self):
+        for expiry in ('lazy', 'deferred', 'none'):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, expiry=expiry, metrics=True)
+                fill(cache)
+                for _ in range(3):
+                    self.assertIsNone(cache.get('expired'))
+                counters = cache.metrics.snapshot()['counters']
+                # the lazy policy purges the record on the first read
+                self.assertEqual(counters['expired'],
+                                 1 if expiry == 'lazy' else 3)
+
+    def test_deferred_flush(self):
+        with TemporaryDirectory() as td:
+            fill(PickleDir(td))
+            cache = PickleDir(td, expiry='deferred')
+            self.assertIsNone(cache.get('expired'))
+            self.assertIsNone(cache.get('expired'))
+            self.assertEqual(cache.flush_expired(), 1)
+            self.assertEqual(records_in_files(cache), 1)
+            self.assertEqual(cache['alive'], 1)
+            self.assertEqual(cache.flush_expired(), 0)
+
+    def test_deferred_flush_other_version(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td, version=1).set('a', 1)
+            cache = PickleDir(td, version=2, expiry='deferred')
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(len(list(cache._iter_bucket_files())), 1)
+            self.assertEqual(cache.flush_expired(), 1)
+            self.assertEqual(list(cache._iter_bucket_files()), [])
+
+    def test_none_purged_by_sweep(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, expiry='none')
+            fill(cache)
+            self.assertIsNone(cache.get('expired'))
+            self.assertEqual(cache.flush_expired(), 0)
+            self.assertEqual(records_in_files(cache), 2)
+            self.assertEqual(cache.sweep(), 1)
+            self.assertEqual(records_in_files(cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
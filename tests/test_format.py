@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import pickle
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+from pickledir._format import FORMAT_MAGIC, Record
+from tests.test_cache import find_same_hash_keys
+
+unpickled = []
+
+
+def _restore(name):
+    unpickled.append(name)
+    return Tracked(name)
+
+
+class Tracked:
+    # records each unpickling into the `unpickled` list
+
+    def __init__(self, name):
+        self.name = name
+
+    def __reduce__(self):
+        return _restore, (self.name,)
+
+
+class TestFormat(unittest.TestCase):
+
+    def setUp(self):
+        same = iter(find_same_hash_keys('key_one'))
+        self.k1 = next(same)
+        self.k2 = next(same)
+        self.k3 = next(same)
+        unpickled.clear()
+
+    def test_new_files_have_format_2(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 1
+            path = cache._key_bytes_to_file(cache._key_to_bytes('a'))
+            self.assertEqual(path.read_bytes()[:4], FORMAT_MAGIC)
+
+    def test_get_unpickles_only_requested(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache[self.k1] = Tracked('one')
+            cache[self.k2] = Tracked('two')
+            cache[self.k3] = Tracked('three')
+            self.assertEqual(unpickled, [])
+
+            self.assertEqual(cache[self.k2].name, 'two')
+            self.assertEqual(unpickled, ['two'])
+
+            self.assertEqual([v.name for v in cache.get_many([self.k1])],
+                             ['one'])
+            self.assertEqual(unpickled, ['two', 'one'])
+
+    def test_set_and_delete_do_not_unpickle(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache[self.k1] = Tracked('one')
+            cache[self.k2] = Tracked('two')
+            del cache[self.k1]
+            cache[self.k3] = Tracked('three')
+            self.assertEqual(unpickled, [])
+            self.assertEqual(sorted(v.name for _, v in cache.items()),
+                             ['three', 'two'])
+
+    def test_expired_removed_without_unpickling(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set(self.k1, Tracked('one'), max_age=timedelta(seconds=-1))
+            cache[self.k2] = Tracked('two')
+            self.assertNotIn(self.k1, cache)
+            self.assertEqual(unpickled, [])
+            self.assertEqual(cache[self.k2].name, 'two')
+
+    def test_keys_without_unpickling(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache[self.k1] = Tracked('one')
+            cache[self.k2] = Tracked('two')
+            cache.set(self.k3, Tracked('three'),
+                      max_age=timedelta(seconds=-1))
+            cache['other'] = Tracked('other')
+
+            self.assertIn(self.k1, cache)
+            self.assertNotIn(self.k3, cache)
+            self.assertEqual(sorted(cache.keys()),
+                             sorted([self.k1, self.k2, 'other']))
+            self.assertEqual(len(cache), 3)
+            self.assertEqual(unpickled, [])
+
+    def test_format_1_readable(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache[self.k1] = 1  # creating the file at the right path
+            now = cache._now()
+            path = cache._key_bytes_to_file(cache._key_to_bytes(self.k1))
+            items = {
+                cache._key_to_bytes(self.k1): Record(now, None, 'one'),
+                cache._key_to_bytes(self.k2): Record(now, None, 'two')}
+            path.write_bytes(pickle.dumps((1, cache.version, items)))
+
+            self.assertEqual(cache[self.k1], 'one')
+            self.assertEqual(dict(cache.items()),
+                             {self.k1: 'one', self.k2: 'two'})
+
+            # the file is converted on write
+            cache[self.k3] = 'three'
+            self.assertEqual(path.read_bytes()[:4], FORMAT_MAGIC)
+            self.assertEqual(cache.get_many([self.k1, self.k2, self.k3]),
+                             ['one', 'two', 'three'])
+
+    def test_format_1_other_version_removed(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 1
+            path = cache._key_bytes_to_file(cache._key_to_bytes('a'))
+            items = {cache._key_to_bytes('a'): Record(cache._now(), None, 1)}
+            path.write_bytes(pickle.dumps((1, 99, items)))
+            self.assertNotIn('a', cache)
+            self.assertFalse(path.exists())
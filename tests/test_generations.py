@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pickledir import PickleDir
+from pickledir._generations import generation_name, read_current
+
+
+def count_files(path: Path) -> int:
+    return sum(len(files) for _, _, files in os.walk(str(path)))
+
+
+class TestGenerations(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual(generation_name(1), 'v1')
+        self.assertEqual(generation_name('abc'), generation_name('abc'))
+        self.assertNotEqual(generation_name('abc'), generation_name('abd'))
+        self.assertNotEqual(generation_name(True), generation_name(1))
+
+    def test_switch(self):
+        with TemporaryDirectory() as td:
+            v1 = PickleDir(td, version=1, generations=True)
+            v1.set_many({i: i for i in range(100)})
+            self.assertEqual(v1.dirpath, Path(td) / 'v1')
+            self.assertEqual(read_current(Path(td)), 'v1')
+
+            with mock.patch.object(PickleDir, '_remove_obsolete',
+                                   side_effect=AssertionError):
+                v2 = PickleDir(td, version=2, generations=True)
+                self.assertEqual(read_current(Path(td)), 'v2')
+                self.assertIsNone(v2.get(5))
+                self.assertEqual(len(v2), 0)
+                v2[5] = 'new'
+
+            # not purged yet: the old version still sees all of its data
+            self.assertEqual(len(PickleDir(td, version=1,
+                                           generations=True)), 100)
+            PickleDir(td, version=2, generations=True)
+            self.assertEqual(v2.purge_generations(), 100)
+            self.assertEqual(sorted(os.listdir(td)),
+                             ['pickledir.current', 'v2'])
+            self.assertEqual(v2[5], 'new')
+            self.assertEqual(v2.purge_generations(), 0)
+
+    def test_purge_in_steps(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td, version=1, generations=True).set_many(
+                {i: i for i in range(200)})
+            old_files = count_files(Path(td) / 'v1')
+            v2 = PickleDir(td, version=2, generations=True)
+            # the old generation disappears at once
+            v2.purge_generations(max_files=0)
+            self.assertFalse((Path(td) / 'v1').exists())
+            self.assertEqual(len(PickleDir(td, version=1,
+                                           generations=True)), 0)
+            v2 = PickleDir(td, version=2, generations=True)
+
+            removed = 0
+            while True:
+                n = v2.purge_generations(max_files=50)
+                self.assertLessEqual(n, 50)
+                if n == 0:
+                    break
+                removed += n
+            self.assertEqual(removed, old_files)
+            # nothing is written to v2 yet
+            self.assertEqual(os.listdir(td), ['pickledir.current'])
+
+    def test_rate_limit(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td, version=1, generations=True).set_many(
+                {i: i for i in range(5)})
+            v2 = PickleDir(td, version=2, generations=True)
+            started = time.monotonic()
+            removed = v2.purge_generations(files_per_second=100)
+            self.assertGreaterEqual(time.monotonic() - started,
+                                    removed * 0.01)
+
+    def test_not_generations(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 1
+            self.assertEqual(cache.dirpath, Path(td))
+            self.assertEqual(cache.purge_generations(), 0)
+            self.assertFalse((Path(td) / 'pickledir.current').exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
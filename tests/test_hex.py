@@ -3,8 +3,10 @@
 
 import random
 import unittest
+import zlib
 
-from pickledir._hex import padded_hex, hex_last_n, mask_4096, hash_4096
+from pickledir._hex import padded_hex, hex_last_n, mask_4096, hash_4096, \
+    hash_hex, hash_hex_many
 
 
 class TestHex(unittest.TestCase):
@@ -36,3 +38,17 @@ class TestHex(unittest.TestCase):
             if len(hashes) >= 4096:
                 return
         raise AssertionError(len(hashes))
+
+    def test_hash_unchanged(self):
+        # the buckets of the existing files must not change
+        for i in range(5000):
+            data = str(i).encode() * (i % 7)
+            h = zlib.crc32(data)
+            self.assertEqual(hash_4096(data),
+                             mask_4096(h ^ (h >> 12) ^ (h >> 24)))
+
+    def test_hash_many(self):
+        items = [str(i).encode() for i in range(1000)]
+        for digits in (3, 4, 5):
+            self.assertEqual(hash_hex_many(items, digits),
+                             [hash_hex(x, digits) for x in items])
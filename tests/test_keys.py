@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import pickle
+import unittest
+
+from pickledir._keys import key_to_bytes, pickle_key
+
+
+class TestKeyToBytes(unittest.TestCase):
+
+    def test_same_as_pickle(self):
+        keys = ['a', '', 'ключ', b'bytes', 0, -5, 2 ** 70, ('a', 1),
+                ('a', b'a', 3), (), 'x' * 1000, (1, 2, 3, 4, 5, 6, 7, 8, 9),
+                frozenset([1, 2]), 1.5, None]
+        for _ in range(2):  # the second time from the cache
+            for key in keys:
+                self.assertEqual(key_to_bytes(key), pickle.dumps(key, 5))
+                self.assertEqual(pickle_key(key), pickle.dumps(key, 5))
+
+    def test_equal_keys_of_other_types(self):
+        # 1, 1.0 and True are equal, but pickled differently
+        for key in (1, 1.0, True, (1, 'a'), (1.0, 'a'), (True, 'a')):
+            self.assertEqual(key_to_bytes(key), pickle.dumps(key, 5))
+
+    def test_repeated_objects(self):
+        s = 'repeated'
+        same = (s, s)
+        different = (s, ''.join(['re', 'peated']))
+        self.assertEqual(same, different)
+        self.assertEqual(key_to_bytes(same), pickle.dumps(same, 5))
+        self.assertEqual(key_to_bytes(different), pickle.dumps(different, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import unittest
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+from pickledir._hex import hash_4096, hash_hex
+from pickledir._layout import Layout, Meta, write_meta
+
+
+def data_files(cache: PickleDir):
+    return sorted(str(p.relative_to(cache.dirpath))
+                  for p in cache.dirpath.rglob('*')
+                  if p.is_file() and p.name != 'pickledir.meta')
+
+
+class TestLayout(unittest.TestCase):
+
+    def test_hash_hex_compatible(self):
+        for i in range(1000):
+            data = str(i).encode()
+            self.assertEqual(hash_hex(data, 3), hash_4096(data))
+
+    def test_hash_hex_uses_all_buckets(self):
+        hashes = set(hash_hex(str(i).encode(), 4) for i in range(300000))
+        # with a uniform distribution about 99% of the buckets are hit
+        self.assertGreater(len(hashes), 64000)
+        self.assertTrue(all(len(h) == 4 for h in hashes))
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            Layout(1000)
+
+    def test_nested_files(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, buckets=65536)
+            cache['a'] = 1
+            files = data_files(cache)
+            self.assertEqual(len(files), 1)
+            self.assertRegex(files[0], r'^[0-9a-f]{2}[\\/][0-9a-f]{2}$')
+            self.assertEqual(cache['a'], 1)
+            self.assertEqual(list(cache.items()), [('a', 1)])
+
+    def test_buckets_remembered(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td, buckets=16 ** 5)['a'] = 1
+            cache = PickleDir(td)
+            self.assertEqual(cache.buckets, 16 ** 5)
+            self.assertEqual(cache['a'], 1)
+            with self.assertRaises(ValueError):
+                PickleDir(td, buckets=4096)
+
+    def test_cannot_change_without_reshard(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td)['a'] = 1
+            with self.assertRaises(ValueError):
+                PickleDir(td, buckets=65536)
+
+    def test_reshard(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            expected = {f'key{i}': i for i in range(300)}
+            cache.set_many(expected)
+
+            for buckets in [65536, 16 ** 5, 4096, 65536]:
+                cache.reshard(buckets)
+                self.assertEqual(cache.buckets, buckets)
+                self.assertEqual(PickleDir(td).buckets, buckets)
+                self.assertEqual(dict(cache.items()), expected)
+                self.assertEqual(
+                    cache.get_many(list(expected)), list(expected.values()))
+                self.assertEqual(len(data_files(cache)),
+                                 len(set(cache._key_bytes_to_file(
+                                     cache._key_to_bytes(k))
+                                     for k in expected)))
+
+    def test_other_objects_follow_reshard(self):
+        with TemporaryDirectory() as td:
+            old = PickleDir(td)
+            old['x'] = 1
+            PickleDir(td).reshard(65536)
+            self.assertEqual(old.buckets, 65536)
+            old['y'] = 2
+            self.assertEqual(PickleDir(td).get_many(['x', 'y']), [1, 2])
+
+            PickleDir(td).reshard(4096)
+            old['z'] = 3
+            self.assertEqual(dict(PickleDir(td).items()),
+                             {'x': 1, 'y': 2, 'z': 3})
+
+    def test_access_during_reshard(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({'a': 1, 'b': 2, 'c': 3})
+
+            # simulating the resharding that was interrupted
+            # before any bucket was moved
+            write_meta(cache.dirpath, Meta(Layout(65536), Layout(4096)))
+            cache = PickleDir(td)
+
+            cache['a'] = 10
+            del cache['b']
+            self.assertEqual(dict(cache.items()), {'a': 10, 'c': 3})
+            self.assertEqual(cache['c'], 3)
+            self.assertNotIn('b', cache)
+
+            cache.reshard(65536)
+            self.assertEqual(dict(cache.items()), {'a': 10, 'c': 3})
+            self.assertTrue(all('/' in f or '\\\\' in f
+                                for f in data_files(cache)))
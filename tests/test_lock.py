@@ -0,0 +1,98 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import multiprocessing
+import threading
+import time
+import unittest
+from itertools import islice
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+from pickledir._lock import file_lock
+from tests.test_cache import find_same_hash_keys
+
+PROCESSES = 4
+KEYS_PER_PROCESS = 5
+ROUNDS = 20
+
+
+def _writer(dirpath: str, keys, rounds: int):
+    cache = PickleDir(dirpath, concurrent=True)
+    for r in range(rounds):
+        for k in keys:
+            cache[k] = r
+
+
+class TestFileLock(unittest.TestCase):
+
+    def test_exclusive_between_threads(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / 'sub' / 'lock'
+            inside = []
+            overlaps = []
+
+            def work():
+                for _ in range(20):
+                    with file_lock(path):
+                        inside.append(1)
+                        if len(inside) > 1:
+                            overlaps.append(1)
+                        time.sleep(0.001)
+                        inside.pop()
+
+            threads = [threading.Thread(target=work) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(overlaps, [])
+
+    def test_reentrant(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / 'lock'
+            with file_lock(path):
+                with file_lock(path):
+                    pass
+
+
+class TestConcurrentWrites(unittest.TestCase):
+
+    def test_no_lost_updates(self):
+        # all the keys are stored in the same file, so each write is
+        # a read-modify-write of the file shared by all the processes
+        keys = list(islice(find_same_hash_keys(),
+                           PROCESSES * KEYS_PER_PROCESS))
+        chunks = [keys[i::PROCESSES] for i in range(PROCESSES)]
+
+        with TemporaryDirectory() as td:
+            processes = [
+                multiprocessing.Process(target=_writer,
+                                        args=(td, chunk, ROUNDS))
+                for chunk in chunks]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+
+            cache = PickleDir(td)
+            lost = [k for k in keys if cache.get(k) != ROUNDS - 1]
+            self.assertEqual(lost, [])
+            temps = [p for p in Path(td).glob('~*')]
+            self.assertEqual(temps, [])
+
+    def test_items_during_writes(self):
+        keys = list(islice(find_same_hash_keys(), 4))
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, concurrent=True)
+            cache.set_many({k: 0 for k in keys})
+            thread = threading.Thread(target=_writer,
+                                      args=(td, keys, ROUNDS))
+            thread.start()
+            while thread.is_alive():
+                # removing the temp files must not break the writer
+                self.assertEqual(len(list(cache.items())), len(keys))
+            thread.join()
+            self.assertEqual(cache.get_many(keys), [ROUNDS - 1] * len(keys))
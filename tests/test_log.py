@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import pickle
+import threading
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+
+
+def bucket_files(cache: PickleDir):
+    return list(cache._meta.layout.iter_files(cache.dirpath))
+
+
+class TestAppendOnly(unittest.TestCase):
+
+    def test_writes_append(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True)
+            cache['a'] = 1
+            cache.set_many({'b': 2, 'c': 3})
+            del cache['b']
+            self.assertEqual(bucket_files(cache), [])
+            self.assertEqual(len(cache._log.segments()), 1)
+
+            self.assertEqual(cache['a'], 1)
+            self.assertNotIn('b', cache)
+            self.assertEqual(cache.get_many(['a', 'b', 'c']), [1, None, 3])
+            self.assertEqual(dict(cache.items()), {'a': 1, 'c': 3})
+
+    def test_keys(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td).set_many({'a': 1, 'b': 2})
+            cache = PickleDir(td, append_only=True)
+            cache['c'] = 3
+            del cache['a']
+            cache.set('d', 4, max_age=timedelta(seconds=-1))
+            self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+            self.assertEqual(len(cache), 2)
+            self.assertNotIn('a', cache)
+            self.assertNotIn('d', cache)
+            self.assertIn('b', cache)
+            self.assertIn('c', cache)
+
+    def test_other_objects_see_appends(self):
+        with TemporaryDirectory() as td:
+            first = PickleDir(td, append_only=True)
+            second = PickleDir(td, append_only=True)
+            first['a'] = 1
+            self.assertEqual(second['a'], 1)
+            second['a'] = 2
+            self.assertEqual(first['a'], 2)
+
+    def test_compact(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True)
+            cache['a'] = 1
+            cache['a'] = 2
+            cache['b'] = 3
+            cache['c'] = 4
+            del cache['c']
+            cache.set('d', 5, max_age=timedelta(seconds=-1))
+
+            cache.compact()
+            self.assertEqual(cache._log.segments(), [2])  # empty new one
+
+            # the data is in the buckets now
+            self.assertEqual(dict(PickleDir(td).items()), {'a': 2, 'b': 3})
+            self.assertEqual(dict(cache.items()), {'a': 2, 'b': 3})
+
+            # log records override the compacted ones
+            cache['a'] = 10
+            del cache['b']
+            self.assertEqual(cache.get_many(['a', 'b']), [10, None])
+            self.assertEqual(dict(cache.items()), {'a': 10})
+            cache.compact()
+            self.assertEqual(dict(PickleDir(td).items()), {'a': 10})
+
+    def test_compact_with_stale_reader(self):
+        with TemporaryDirectory() as td:
+            writer = PickleDir(td, append_only=True)
+            reader = PickleDir(td, append_only=True)
+            writer['a'] = 1
+            self.assertEqual(reader['a'], 1)
+            writer.compact()
+            # the reader has the index pointing to the removed segment
+            self.assertEqual(reader['a'], 1)
+
+    def test_segment_rollover(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True, segment_bytes=200)
+            for i in range(20):
+                cache[i] = 'x' * 50
+            self.assertGreater(len(cache._log.segments()), 3)
+            self.assertEqual(dict(cache.items()),
+                             {i: 'x' * 50 for i in range(20)})
+            cache.compact()
+            self.assertEqual(dict(PickleDir(td).items()),
+                             {i: 'x' * 50 for i in range(20)})
+
+    def test_incomplete_frame_ignored(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True)
+            cache['a'] = 1
+            segment = cache._log.root / '00000001'
+            with segment.open('ab') as f:
+                f.write(b'\x10\x00')  # a frame is being written
+            other = PickleDir(td, append_only=True)
+            self.assertEqual(dict(other.items()), {'a': 1})
+
+    def test_out_of_band_blobs_released(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True, oob_threshold=16)
+            cache['a'] = pickle.PickleBuffer(b'1' * 100)
+            cache['a'] = pickle.PickleBuffer(b'2' * 100)
+            self.assertEqual(len(list(cache._blobs.iter_names())), 2)
+            cache.compact()
+            self.assertEqual(len(list(cache._blobs.iter_names())), 1)
+            self.assertEqual(bytes(cache['a']), b'2' * 100)
+
+    def test_concurrent_compactions(self):
+        with TemporaryDirectory() as td:
+            errors = []
+
+            def work(n):
+                cache = PickleDir(td, append_only=True, concurrent=True)
+                try:
+                    for i in range(30):
+                        cache[n] = i
+                        cache.compact()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=work, args=(n,))
+                       for n in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(dict(PickleDir(td, append_only=True).items()),
+                             {n: 29 for n in range(4)})
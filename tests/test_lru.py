@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import time
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pickledir import PickleDir
+from pickledir import _pickledir
+from pickledir._lru import LruCache
+
+
+class TestLruCache(unittest.TestCase):
+
+    def test_max_entries(self):
+        cache = LruCache(max_entries=2)
+        cache.put(Path('a'), (1, 1, 1), 'A', 10)
+        cache.put(Path('b'), (1, 1, 1), 'B', 10)
+        self.assertEqual(cache.get(Path('a'), (1, 1, 1)), 'A')
+        cache.put(Path('c'), (1, 1, 1), 'C', 10)
+        # 'b' was used least recently
+        self.assertIsNone(cache.get(Path('b'), (1, 1, 1)))
+        self.assertEqual(cache.get(Path('a'), (1, 1, 1)), 'A')
+        self.assertEqual(cache.get(Path('c'), (1, 1, 1)), 'C')
+
+    def test_max_bytes(self):
+        cache = LruCache(max_bytes=100)
+        cache.put(Path('a'), (1, 1, 1), 'A', 60)
+        cache.put(Path('b'), (1, 1, 1), 'B', 30)
+        cache.put(Path('c'), (1, 1, 1), 'C', 30)
+        self.assertEqual(cache.total_bytes, 60)
+        self.assertIsNone(cache.get(Path('a'), (1, 1, 1)))
+        cache.put(Path('huge'), (1, 1, 1), 'H', 1000)
+        self.assertIsNone(cache.get(Path('huge'), (1, 1, 1)))
+        self.assertEqual(len(cache), 2)
+
+    def test_signature_mismatch(self):
+        cache = LruCache(max_entries=2)
+        cache.put(Path('a'), (1, 1, 1), 'A', 10)
+        self.assertIsNone(cache.get(Path('a'), (2, 1, 1)))
+        self.assertEqual(len(cache), 0)
+
+
+class TestPickleDirLru(unittest.TestCase):
+
+    def test_reads_from_memory(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, lru_buckets=16)
+            cache['a'] = 1
+            with mock.patch.object(_pickledir, 'read_bucket') as read:
+                self.assertEqual(cache['a'], 1)
+                self.assertEqual(cache['a'], 1)
+                self.assertIn('a', cache)
+                read.assert_not_called()
+
+    def test_sees_other_writers(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, lru_buckets=16)
+            other = PickleDir(td)
+            cache['a'] = 1
+            self.assertEqual(cache['a'], 1)
+            other['a'] = 2
+            self.assertEqual(cache['a'], 2)
+            del other['a']
+            self.assertNotIn('a', cache)
+
+    def test_expiry_applies(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, lru_bytes=1 << 20)
+            cache.set('a', 1, max_age=timedelta(seconds=0.25))
+            self.assertEqual(cache['a'], 1)
+            time.sleep(0.5)
+            self.assertNotIn('a', cache)
+            self.assertEqual(
+                cache.get('b', max_age=timedelta(seconds=1)), None)
+
+    def test_values_not_shared(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, lru_buckets=16)
+            cache['a'] = [1, 2]
+            value = cache['a']
+            value.append(3)
+            self.assertEqual(cache['a'], [1, 2])
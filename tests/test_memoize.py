@@ -0,0 +1,162 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import multiprocessing
+import threading
+import time
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+
+
+def _memoized_call(dirpath: str) -> int:
+    cache = PickleDir(dirpath)
+
+    @cache.memoize()
+    def slow(x):
+        with (Path(dirpath) / 'calls').open('a') as f:
+            f.write('.')
+        time.sleep(0.3)
+        return x * 2
+
+    return slow(21)
+
+
+class TestMemoize(unittest.TestCase):
+
+    def test_arguments(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            calls = []
+
+            @cache.memoize()
+            def add(a, b=0):
+                calls.append((a, b))
+                return a + b
+
+            self.assertEqual(add(1, b=2), 3)
+            self.assertEqual(add(1, b=2), 3)
+            self.assertEqual(add(1), 1)
+            self.assertEqual(add(1), 1)
+            self.assertEqual(calls, [(1, 2), (1, 0)])
+
+            add.invalidate(1, b=2)
+            self.assertEqual(add(1, b=2), 3)
+            self.assertEqual(len(calls), 3)
+
+    def test_version(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+
+            @cache.memoize(version=1)
+            def f():
+                return 'one'
+
+            self.assertEqual(f(), 'one')
+
+            @cache.memoize(version=2)
+            def f():
+                return 'two'
+
+            self.assertEqual(f(), 'two')
+
+    def test_max_age(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            calls = []
+
+            @cache.memoize(max_age=timedelta(milliseconds=100))
+            def f():
+                calls.append(1)
+                return len(calls)
+
+            self.assertEqual(f(), 1)
+            self.assertEqual(f(), 1)
+            time.sleep(0.15)
+            self.assertEqual(f(), 2)
+
+    def test_threads_compute_once(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            calls = []
+
+            @cache.memoize()
+            def slow():
+                calls.append(1)
+                time.sleep(0.2)
+                return 'value'
+
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(slow()))
+                       for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(results, ['value'] * 8)
+            self.assertEqual(len(calls), 1)
+
+    def test_processes_compute_once(self):
+        with TemporaryDirectory() as td:
+            with multiprocessing.Pool(4) as pool:
+                results = pool.map(_memoized_call, [td] * 4)
+            self.assertEqual(results, [42] * 4)
+            self.assertEqual((Path(td) / 'calls').read_text(), '.')
+
+    def test_stale(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            calls = []
+
+            @cache.memoize(max_age=timedelta(milliseconds=50),
+                           stale=timedelta(seconds=60))
+            def slow():
+                calls.append(1)
+                if len(calls) > 1:
+                    time.sleep(0.5)
+                return len(calls)
+
+            self.assertEqual(slow(), 1)
+            time.sleep(0.1)
+            refresher = threading.Thread(target=slow)
+            refresher.start()
+            time.sleep(0.1)
+            # the refresh is in progress, the stale value is returned
+            started = time.monotonic()
+            self.assertEqual(slow(), 1)
+            self.assertLess(time.monotonic() - started, 0.3)
+            refresher.join()
+            self.assertEqual(slow(), 2)
+
+    def test_stale_requires_max_age(self):
+        with TemporaryDirectory() as td:
+            with self.assertRaises(ValueError):
+                PickleDir(td).memoize(stale=timedelta(seconds=1))
+
+
+class TestMemoizeAsync(unittest.IsolatedAsyncioTestCase):
+
+    async def test_compute_once(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            calls = []
+
+            @cache.memoize()
+            async def slow(x):
+                calls.append(x)
+                await asyncio.sleep(0.1)
+                return x * 2
+
+            results = await asyncio.gather(*[slow(5) for _ in range(10)])
+            self.assertEqual(results, [10] * 10)
+            self.assertEqual(calls, [5])
+            self.assertEqual(await slow(6), 12)
+            self.assertEqual(calls, [5, 6])
+
+
+if __name__ == "__main__":
+    unittest.main()
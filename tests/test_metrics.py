@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir, Metrics
+from pickledir._metrics import Histogram
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_disabled(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 1
+            self.assertIsNone(cache.metrics)
+            self.assertIsNone(cache.stats()['metrics'])
+
+    def test_counters_and_timings(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, metrics=True)
+            cache['a'] = 1
+            cache.set('old', 2, max_age=timedelta(seconds=-1))
+            self.assertEqual(cache['a'], 1)
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNone(cache.get('old'))
+            cache.get_many(['a', 'b'])
+            del cache['a']
+            list(cache.items())
+            list(cache.scan(workers=2))
+
+            snapshot = cache.metrics.snapshot()
+            counters = snapshot['counters']
+            self.assertEqual(counters['get.hit'], 1)
+            self.assertEqual(counters['get.miss'], 2)
+            self.assertEqual(counters['expired'], 1)
+            self.assertEqual(counters['files.written'], 2)
+            self.assertGreater(counters['bytes.written'], 0)
+            self.assertGreater(counters['bytes.read'], 0)
+            timings = snapshot['timings']
+            self.assertEqual(timings['get']['count'], 3)
+            self.assertEqual(timings['set']['count'], 2)
+            for name in ('delete', 'get_many', 'items', 'scan'):
+                self.assertEqual(timings[name]['count'], 1, name)
+
+    def test_callback(self):
+        events = []
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, metrics=Metrics(
+                callback=lambda *args: events.append(args)))
+            cache['a'] = 1
+            _ = cache['a']
+        names = [(kind, name) for kind, name, _ in events]
+        self.assertIn(('timing', 'set'), names)
+        self.assertIn(('timing', 'get'), names)
+        self.assertIn(('counter', 'get.hit'), names)
+
+    def test_lru_hits(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, metrics=True, lru_buckets=10)
+            cache['a'] = 1
+            for _ in range(3):
+                _ = cache['a']
+            self.assertEqual(cache.metrics.counters['lru.hit'], 3)
+            self.assertNotIn('files.read', cache.metrics.counters)
+
+    def test_histogram(self):
+        hist = Histogram()
+        for _ in range(99):
+            hist.observe(0.0001)
+        hist.observe(3.0)
+        self.assertEqual(hist.quantile(0.5), 0.0001)
+        self.assertEqual(hist.quantile(1.0), 5.0)
+        self.assertEqual(hist.count, 100)
+
+
+class TestStats(unittest.TestCase):
+
+    def test_stats(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({i: i for i in range(100)})
+            cache.set('old', 0, max_age=timedelta(seconds=-1))
+            stats = cache.stats()
+            self.assertEqual(stats['records'], 100)
+            self.assertEqual(stats['expired'], 1)
+            self.assertEqual(stats['files'], len(stats['buckets']))
+            self.assertEqual(sum(b.records + b.expired
+                                 for b in stats['buckets'].values()), 101)
+            self.assertEqual(stats['bytes'], sum(
+                b.size for b in stats['buckets'].values()))
+            self.assertGreaterEqual(stats['max_records'], 1)
+
+    def test_empty(self):
+        with TemporaryDirectory() as td:
+            stats = PickleDir(td).stats()
+            self.assertEqual(stats['files'], 0)
+            self.assertEqual(stats['mean_records'], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
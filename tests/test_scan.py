@@ -0,0 +1,92 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import pickle
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+
+
+def is_even(key, value):
+    return value % 2 == 0
+
+
+class TestScan(unittest.TestCase):
+
+    def test_same_as_items(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({f'k{i}': i for i in range(300)})
+            cache.set('expired', 0, max_age=timedelta(seconds=-1))
+            self.assertEqual(sorted(cache.scan(workers=4)),
+                             sorted(cache.items()))
+            self.assertEqual(len(list(cache.scan())), 300)
+
+    def test_prefix_and_predicate(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({f'a{i}': i for i in range(20)})
+            cache.set_many({f'b{i}': i for i in range(20)})
+            cache.set_many({i: i for i in range(20)})
+            self.assertEqual(sorted(k for k, _ in cache.scan(prefix='a')),
+                             sorted(f'a{i}' for i in range(20)))
+            self.assertEqual(
+                sorted(k for k, _ in cache.scan(prefix='b',
+                                                predicate=is_even)),
+                sorted(f'b{i}' for i in range(0, 20, 2)))
+
+    def test_processes(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({i: i for i in range(50)})
+            self.assertEqual(
+                sorted(cache.scan(workers=2, processes=True,
+                                  predicate=is_even)),
+                [(i, i) for i in range(0, 50, 2)])
+
+    def test_processes_with_buffers(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, oob_threshold=16)
+            cache['buffer'] = pickle.PickleBuffer(b'x' * 100)
+            with cache.open_writer('stream') as f:
+                f.write(b'streamed')
+            self.assertEqual(
+                dict(cache.scan(workers=2, processes=True)),
+                {'buffer': b'x' * 100, 'stream': b'streamed'})
+
+    def test_backpressure(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({i: i for i in range(200)})
+            with ThreadPoolExecutor(2) as executor:
+                it = cache.scan(executor=executor, max_pending=3)
+                next(it)
+                # the consumer is paused, but no more than 3 files
+                # are queued
+                self.assertLessEqual(executor._work_queue.qsize(), 3)
+                it.close()
+                self.assertEqual(len(list(cache.scan(executor=executor))),
+                                 200)
+
+    def test_log_and_reshard(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True)
+            cache.set_many({i: i for i in range(100)})
+            cache.compact()
+            cache.set_many({i: -i for i in range(50)})
+            del cache[99]
+            expected = sorted(cache.items())
+            self.assertEqual(sorted(cache.scan()), expected)
+
+            cache = PickleDir(td)
+            cache.reshard(65536)
+            cache[0] = 'new'
+            self.assertEqual(sorted(cache.scan(), key=str),
+                             sorted(cache.items(), key=str))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import pickle
+import unittest
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pickledir import ShardedPickleDir, PickleDir
+from pickledir._sharded import assign_buckets
+
+
+class TestAssignBuckets(unittest.TestCase):
+
+    def test_weights(self):
+        routes = assign_buckets([('a', 1), ('b', 1), ('c', 2)])
+        counts = Counter(routes)
+        self.assertAlmostEqual(counts[0] / 4096, 0.25, delta=0.04)
+        self.assertAlmostEqual(counts[1] / 4096, 0.25, delta=0.04)
+        self.assertAlmostEqual(counts[2] / 4096, 0.5, delta=0.04)
+
+    def test_adding_moves_only_to_new(self):
+        before = assign_buckets([('a', 1), ('b', 1), ('c', 1)])
+        after = assign_buckets([('a', 1), ('b', 1), ('c', 1), ('d', 1)])
+        moved = [i for i in range(4096) if before[i] != after[i]]
+        # only the buckets taken by the new directory
+        self.assertTrue(all(after[i] == 3 for i in moved))
+        self.assertAlmostEqual(len(moved) / 4096, 0.25, delta=0.04)
+
+    def test_order_does_not_matter(self):
+        ab = assign_buckets([('a', 1), ('b', 1)])
+        ba = assign_buckets([('b', 1), ('a', 1)])
+        self.assertEqual(ab, [1 - i for i in ba])
+
+
+class TestShardedPickleDir(unittest.TestCase):
+
+    def setUp(self):
+        self.td = TemporaryDirectory()
+        self.root = Path(self.td.name)
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def dirs(self, *names):
+        return [self.root / name for name in names]
+
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            ShardedPickleDir([])
+        with self.assertRaises(ValueError):
+            ShardedPickleDir([(self.root / 'a', 0)])
+        with self.assertRaises(ValueError):
+            ShardedPickleDir(self.dirs('a', 'a'))
+
+    def test_single_keys(self):
+        cache = ShardedPickleDir(self.dirs('a', 'b', 'c'))
+        for i in range(100):
+            cache[i] = i * 2
+        self.assertEqual(cache[7], 14)
+        self.assertIn(7, cache)
+        del cache[7]
+        self.assertNotIn(7, cache)
+        self.assertIsNone(cache.get(7))
+        with self.assertRaises(KeyError):
+            _ = cache[7]
+        self.assertEqual(cache.incr('n', 5), 5)
+        self.assertTrue(cache.compare_and_set('n', 5, 6))
+        self.assertEqual(cache.update('n', lambda v: v * 2), 12)
+        # the keys are spread over all the directories
+        self.assertTrue(all(len(shard) > 20 for shard in cache.shards))
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.shard_for(1)[1], 2)
+
+    def test_bulk(self):
+        cache = ShardedPickleDir(self.dirs('a', 'b'))
+        cache.set_many({i: str(i) for i in range(300)})
+        self.assertEqual(cache.get_many([5, 1000, 299]), ['5', None, '299'])
+        cache.delete_many(range(100))
+        self.assertEqual(sorted(cache.keys()), list(range(100, 300)))
+        cache.set_many([('x', 1)], max_age=timedelta(seconds=-1))
+        self.assertIsNone(cache.get('x'))
+
+    def test_items_and_scan(self):
+        cache = ShardedPickleDir(self.dirs('a', 'b', 'c'))
+        expected = {f'key{i}': i for i in range(500)}
+        cache.set_many(expected)
+        self.assertEqual(dict(cache.items()), expected)
+        self.assertEqual(dict(cache.scan()), expected)
+        self.assertEqual(dict(cache.scan(prefix='key1')),
+                         {k: v for k, v in expected.items()
+                          if k.startswith('key1')})
+        # stopping early
+        for _ in cache.scan(workers=1, max_pending=1):
+            break
+
+    def test_same_routes_for_same_dirs(self):
+        ShardedPickleDir(self.dirs('a', 'b')).set_many(
+            {i: i for i in range(100)})
+        cache = ShardedPickleDir(self.dirs('b', 'a'))
+        self.assertEqual(cache.get_many(range(100)), list(range(100)))
+
+    def test_rebalance_add(self):
+        old = ShardedPickleDir(self.dirs('a', 'b'))
+        old.set_many({i: i for i in range(1000)})
+        old.set('expiring', 1, max_age=timedelta(hours=1))
+        expires = old.shard_for('expiring')._get_record('expiring').expires
+
+        new = ShardedPickleDir(self.dirs('a', 'b', 'c'))
+        moved = new.rebalance()
+        # about a third of the keys moved to the new directory
+        self.assertEqual(moved, len(new.shards[2]))
+        self.assertAlmostEqual(moved / 1001, 1 / 3, delta=0.1)
+        self.assertEqual(new.get_many(range(1000)), list(range(1000)))
+        self.assertEqual(len(new), 1001)
+        self.assertEqual(
+            new.shard_for('expiring')._get_record('expiring').expires,
+            expires)
+        self.assertEqual(new.rebalance(), 0)
+
+    def test_rebalance_remove(self):
+        old = ShardedPickleDir(self.dirs('a', 'b', 'c'))
+        old.set_many({i: i for i in range(300)})
+        new = ShardedPickleDir(self.dirs('a', 'b'))
+        removed = self.root / 'c'
+        count = len(PickleDir(removed))
+        self.assertEqual(new.rebalance(removed=[removed]), count)
+        self.assertEqual(len(PickleDir(removed)), 0)
+        self.assertEqual(new.get_many(range(300)), list(range(300)))
+
+    def test_rebalance_keeps_newer(self):
+        ShardedPickleDir(self.dirs('a')).set_many(
+            {i: 'old' for i in range(100)})
+        new = ShardedPickleDir(self.dirs('a', 'b'))
+        moving = [i for i in range(100) if new.shard_for(i) is new.shards[1]]
+        new[moving[0]] = 'new'
+        new.rebalance()
+        self.assertEqual(new[moving[0]], 'new')
+        self.assertEqual(new[moving[1]], 'old')
+
+    def test_rebalance_blobs(self):
+        old = ShardedPickleDir(self.dirs('a'), oob_threshold=16)
+        for i in range(20):
+            old[i] = pickle.PickleBuffer(bytes([i]) * 100)
+        with old.shards[0].open_writer('stream') as f:
+            f.write(b'streamed')
+        new = ShardedPickleDir(self.dirs('a', 'b'), oob_threshold=16)
+        new.rebalance()
+        self.assertGreater(len(new.shards[1]), 0)
+        for i in range(20):
+            self.assertEqual(bytes(new[i]), bytes([i]) * 100)
+        with new.shard_for('stream').open_reader('stream') as f:
+            self.assertEqual(f.read(), b'streamed')
+
+
+if __name__ == "__main__":
+    unittest.main()
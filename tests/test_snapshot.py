@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import pickle
+import shutil
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pickledir import PickleDir, PickleDirSnapshot
+from pickledir import _snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_export_and_read(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(Path(td) / 'cache', version=3)
+            for i in range(300):
+                cache[i] = f'value {i}'
+            cache[('tuple', 1)] = [1, 2, 3]
+            path = Path(td) / 'snap'
+            self.assertEqual(cache.export_snapshot(path), 301)
+
+            with PickleDirSnapshot(path) as snap:
+                self.assertEqual(snap.version, 3)
+                self.assertEqual(len(snap), 301)
+                self.assertEqual(snap[5], 'value 5')
+                self.assertEqual(snap.get(('tuple', 1)), [1, 2, 3])
+                self.assertIn(299, snap)
+                self.assertNotIn(300, snap)
+                self.assertIsNone(snap.get(300))
+                self.assertEqual(snap.get(300, default=0), 0)
+                with self.assertRaises(KeyError):
+                    _ = snap[300]
+                self.assertEqual(sorted(snap.items(), key=repr),
+                                 sorted(cache.items(), key=repr))
+
+    def test_empty(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / 'snap'
+            self.assertEqual(PickleDir(Path(td) / 'cache')
+                             .export_snapshot(path), 0)
+            with PickleDirSnapshot(path) as snap:
+                self.assertEqual(len(snap), 0)
+                self.assertNotIn('a', snap)
+                self.assertEqual(list(snap.items()), [])
+
+    def test_not_a_snapshot(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / 'file'
+            path.write_bytes(b'\0' * 100)
+            with self.assertRaises(ValueError):
+                PickleDirSnapshot(path)
+
+    def test_hash_collisions(self):
+        # all the keys have the same hash, so the keys must be compared
+        with TemporaryDirectory() as td:
+            with mock.patch.object(_snapshot, '_key_hash', lambda _: 7):
+                cache = PickleDir(Path(td) / 'cache')
+                for i in range(10):
+                    cache[i] = i * 10
+                path = Path(td) / 'snap'
+                cache.export_snapshot(path)
+                with PickleDirSnapshot(path) as snap:
+                    for i in range(10):
+                        self.assertEqual(snap[i], i * 10)
+                    self.assertNotIn(10, snap)
+
+    def test_expiration(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(Path(td) / 'cache')
+            cache.set('short', 1, max_age=timedelta(seconds=1))
+            cache.set('long', 2, max_age=timedelta(days=1))
+            cache.set('expired', 3, max_age=timedelta(seconds=-1))
+            path = Path(td) / 'snap'
+            self.assertEqual(cache.export_snapshot(path), 2)
+            with PickleDirSnapshot(path) as snap:
+                self.assertEqual(snap['short'], 1)
+                self.assertEqual(snap.get('long',
+                                          max_age=timedelta(seconds=-1)),
+                                 None)
+                later = cache._now() + timedelta(seconds=2)
+                with mock.patch.object(PickleDirSnapshot, '_now',
+                                       staticmethod(lambda: later)):
+                    self.assertNotIn('short', snap)
+                    self.assertEqual(snap['long'], 2)
+                    self.assertEqual(len(snap), 1)
+
+    def test_values_stay_compressed(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(Path(td) / 'cache', codec='zlib')
+            cache['text'] = 'a' * 100000
+            path = Path(td) / 'snap'
+            cache.export_snapshot(path)
+            self.assertLess(path.stat().st_size, 10000)
+            with PickleDirSnapshot(path) as snap:
+                self.assertEqual(snap['text'], 'a' * 100000)
+
+    def test_out_of_band_values_inlined(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(Path(td) / 'cache', oob_threshold=1024)
+            big = os.urandom(100000)
+            cache['big'] = pickle.PickleBuffer(big)
+            self.assertTrue(any(rec.data.buffers is not None
+                                for _, rec in cache._iter_raw_records()))
+            path = Path(td) / 'snap'
+            cache.export_snapshot(path)
+            # the snapshot does not refer to the blob files
+            shutil.rmtree(cache.dirpath)
+            with PickleDirSnapshot(path) as snap:
+                self.assertEqual(snap['big'], big)
+
+    def test_import(self):
+        with TemporaryDirectory() as td:
+            source = PickleDir(Path(td) / 'source', codec='zlib')
+            for i in range(50):
+                source.set(i, str(i) * 100, max_age=timedelta(days=1))
+            path = Path(td) / 'snap'
+            source.export_snapshot(path)
+
+            for append_only in (False, True):
+                target = PickleDir(Path(td) / f'target{append_only}',
+                                   append_only=append_only)
+                target[0] = 'replaced'
+                target['other'] = 'kept'
+                self.assertEqual(target.import_snapshot(path), 50)
+                self.assertEqual(target[0], '0' * 100)
+                self.assertEqual(target['other'], 'kept')
+                self.assertEqual(len(target), 51)
+                self.assertEqual(target._get_record(7).expires,
+                                 source._get_record(7).expires)
+
+
+if __name__ == "__main__":
+    unittest.main()
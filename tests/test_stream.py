@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import io
+import os
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+from pickledir._blobs import BlobStore
+
+
+def blob_files(cache: PickleDir):
+    return list(BlobStore(cache.dirpath).iter_names())
+
+
+class Crash(Exception):
+    pass
+
+
+class TestStream(unittest.TestCase):
+
+    def test_write_and_read(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, append_only=append_only)
+                chunks = [os.urandom(100_000) for _ in range(10)]
+                with cache.open_writer('big') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                    self.assertEqual(f.tell(), 1_000_000)
+                    # nothing is stored until the writer is closed
+                    self.assertNotIn('big', cache)
+                data = b''.join(chunks)
+
+                with cache.open_reader('big') as f:
+                    self.assertEqual(f.read(10), data[:10])
+                    f.seek(500_000)
+                    self.assertEqual(f.read(1000), data[500_000:501_000])
+                    f.seek(-5, io.SEEK_END)
+                    self.assertEqual(f.read(), data[-5:])
+
+                # memory-mapped, not read
+                value = cache['big']
+                self.assertIsInstance(value, memoryview)
+                self.assertEqual(bytes(value), data)
+
+    def test_exception_stores_nothing(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 'old'
+            with self.assertRaises(Crash):
+                with cache.open_writer('a') as f:
+                    f.write(b'partial')
+                    raise Crash
+            self.assertEqual(cache['a'], 'old')
+            self.assertEqual(blob_files(cache), [])
+
+    def test_overwrite_and_delete_remove_blob(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            with cache.open_writer('a') as f:
+                f.write(b'first')
+            first = blob_files(cache)
+            self.assertEqual(len(first), 1)
+            with cache.open_writer('a') as f:
+                f.write(b'second')
+            self.assertEqual(len(blob_files(cache)), 1)
+            self.assertNotEqual(blob_files(cache), first)
+            with cache.open_reader('a') as f:
+                self.assertEqual(f.read(), b'second')
+            del cache['a']
+            self.assertEqual(blob_files(cache), [])
+
+    def test_expiry_and_version(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            with cache.open_writer('a',
+                                   max_age=timedelta(seconds=-1)) as f:
+                f.write(b'data')
+            with self.assertRaises(KeyError):
+                cache.open_reader('a')
+
+            with cache.open_writer('b') as f:
+                f.write(b'data')
+            with self.assertRaises(KeyError):
+                PickleDir(td, version=2).open_reader('b')
+
+    def test_regular_values(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['bytes'] = b'abc'
+            cache['int'] = 1
+            with cache.open_reader('bytes') as f:
+                self.assertEqual(f.read(), b'abc')
+            with self.assertRaises(TypeError):
+                cache.open_reader('int')
+            with self.assertRaises(KeyError):
+                cache.open_reader('missing')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from pickledir import PickleDir
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_expired_removed(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            for i in range(50):
+                cache.set(i, i, max_age=timedelta(seconds=-1)
+                          if i % 2 else None)
+            self.assertEqual(cache.sweep(), 25)
+            self.assertEqual(sorted(cache.keys()), list(range(0, 50, 2)))
+            self.assertEqual(cache.sweep(), 0)
+
+    def test_incremental(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({i: i for i in range(30)},
+                           max_age=timedelta(seconds=-1))
+            files = len(list(cache._iter_bucket_files()))
+
+            removed = 0
+            for _ in range(files // 5 + 1):
+                removed += cache.sweep(max_buckets=5)
+            self.assertEqual(removed, 30)
+            self.assertEqual(list(cache._iter_bucket_files()), [])
+
+    def test_other_version_removed(self):
+        with TemporaryDirectory() as td:
+            PickleDir(td, version=1).set_many({'a': 1, 'b': 2})
+            cache = PickleDir(td, version=2)
+            self.assertEqual(cache.sweep(), 2)
+            self.assertEqual(list(cache._iter_bucket_files()), [])
+
+    def test_max_items(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, max_items=10)
+            for i in range(30):
+                cache[i] = i
+            cache.sweep()
+            # the newest ones survive
+            self.assertEqual(sorted(cache.keys()), list(range(20, 30)))
+
+    def test_max_bytes(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, max_bytes=10_000)
+            for i in range(30):
+                cache[i] = 'x' * 1000
+            cache.sweep()
+            keys = sorted(cache.keys())
+            self.assertLessEqual(len(keys), 10)
+            self.assertGreaterEqual(len(keys), 8)
+            self.assertEqual(keys, list(range(30 - len(keys), 30)))
+
+    def test_max_items_same_created(self):
+        # the records written together have the same creation time
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, max_items=100)
+            cache.set_many({i: i for i in range(300)})
+            self.assertEqual(cache.sweep(), 200)
+            self.assertEqual(len(cache), 100)
+
+            cache.set_many({i: i for i in range(300, 400)})
+            cache.sweep()
+            self.assertEqual(sorted(cache.keys()), list(range(300, 400)))
+
+    def test_max_bytes_same_created(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, max_bytes=10_000)
+            cache.set_many({i: 'x' * 1000 for i in range(30)})
+            cache.sweep()
+            self.assertGreaterEqual(len(cache), 8)
+            self.assertLessEqual(len(cache), 10)
+
+    def test_max_items_incremental(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, max_items=5)
+            for i in range(20):
+                cache[i] = i
+            for _ in range(100):
+                cache.sweep(max_buckets=3)
+            self.assertEqual(sorted(cache.keys()), list(range(15, 20)))
+
+    def test_empty(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, max_items=5)
+            self.assertEqual(cache.sweep(), 0)
+            self.assertEqual(cache.sweep(max_buckets=1), 0)
@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import os
+import threading
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from pickledir import PickleDir
+from pickledir._journal import JOURNAL_DIRNAME
+
+
+class Crash(Exception):
+    pass
+
+
+def journals(td: str):
+    try:
+        return os.listdir(os.path.join(td, JOURNAL_DIRNAME))
+    except FileNotFoundError:
+        return []
+
+
+class TestTransaction(unittest.TestCase):
+
+    def test_commit(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['old'] = 0
+            with cache.transaction() as tx:
+                for i in range(20):
+                    tx[i] = i
+                del tx['old']
+                self.assertEqual(tx[5], 5)
+                self.assertIsNone(tx.get('old'))
+                # nothing is written yet
+                self.assertEqual(cache.get(5), None)
+                self.assertEqual(cache['old'], 0)
+            self.assertEqual(sorted(cache.items()),
+                             [(i, i) for i in range(20)])
+            self.assertEqual(journals(td), [])
+
+    def test_exception_discards(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            with self.assertRaises(Crash):
+                with cache.transaction() as tx:
+                    tx['a'] = 1
+                    raise Crash
+            self.assertEqual(len(cache), 0)
+
+    def test_one_write_per_file(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, metrics=True)
+            with cache.transaction() as tx:
+                for i in range(500):
+                    tx[i] = i
+            self.assertEqual(cache.metrics.counters['files.written'],
+                             cache.stats()['files'])
+
+    def test_crash_after_commit_point(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({i: 'old' for i in range(50)})
+            installed = []
+            original = PickleDir._install_file
+
+            def crash_on_second(self, filepath, temp):
+                if installed:
+                    raise Crash
+                installed.append(filepath)
+                original(self, filepath, temp)
+
+            with mock.patch.object(PickleDir, '_install_file',
+                                   crash_on_second):
+                with self.assertRaises(Crash):
+                    with cache.transaction() as tx:
+                        for i in range(50):
+                            tx[i] = 'new'
+
+            self.assertEqual(len(journals(td)), 1)
+            # the next object completes the commit
+            cache = PickleDir(td)
+            self.assertEqual(journals(td), [])
+            self.assertEqual(dict(cache.items()),
+                             {i: 'new' for i in range(50)})
+
+    def test_crash_before_commit_point(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache.set_many({i: 'old' for i in range(50)})
+            with mock.patch('pickledir._pickledir.write_journal',
+                            side_effect=Crash):
+                with self.assertRaises(Crash):
+                    with cache.transaction() as tx:
+                        for i in range(50):
+                            tx[i] = 'new'
+            cache = PickleDir(td)
+            self.assertEqual(dict(cache.items()),
+                             {i: 'old' for i in range(50)})
+            self.assertEqual(
+                [p for p in Path(td).rglob('~*')], [])
+
+    def test_consistent_get_many(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, concurrent=True)
+            keys = list(range(10))
+            cache.set_many({k: 0 for k in keys})
+            stop = threading.Event()
+
+            def write():
+                i = 0
+                while not stop.is_set():
+                    i += 1
+                    with cache.transaction() as tx:
+                        for k in keys:
+                            tx[k] = i
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            try:
+                for _ in range(300):
+                    self.assertEqual(len(set(cache.get_many(keys))), 1)
+            finally:
+                stop.set()
+                writer.join()
+
+    @unittest.skipIf(resource is None, "no resource module")
+    def test_many_files_few_descriptors(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+        try:
+            with TemporaryDirectory() as td:
+                cache = PickleDir(Path(td) / 'a', concurrent=True)
+                keys = range(5000)
+                cache.set_many({k: k for k in keys})
+                self.assertEqual(cache.get_many(keys), list(keys))
+                with cache.transaction() as tx:
+                    for k in keys:
+                        tx[k] = -k
+                self.assertEqual(cache.get_many(keys), [-k for k in keys])
+
+                cache.export_snapshot(Path(td) / 'snap')
+                other = PickleDir(Path(td) / 'b', concurrent=True)
+                self.assertEqual(other.import_snapshot(Path(td) / 'snap'),
+                                 5000)
+                self.assertEqual(other.get_many(keys), [-k for k in keys])
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+class TestLogTransaction(unittest.TestCase):
+
+    def test_commit(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True)
+            cache['x'] = 0
+            with cache.transaction() as tx:
+                tx['a'] = 1
+                tx['b'] = 2
+                del tx['x']
+            other = PickleDir(td, append_only=True)
+            self.assertEqual(sorted(other.items()), [('a', 1), ('b', 2)])
+            cache.compact()
+            self.assertEqual(sorted(PickleDir(td).items()),
+                             [('a', 1), ('b', 2)])
+
+    def test_partial_batch_ignored(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, append_only=True)
+            with cache.transaction() as tx:
+                tx['a'] = 1
+                tx['b'] = 2
+            # cutting the last frame, as if the writer crashed
+            segment = Path(td) / 'segments' / '00000001'
+            data = segment.read_bytes()
+            segment.write_bytes(data[:-3])
+
+            other = PickleDir(td, append_only=True)
+            self.assertEqual(list(other.items()), [])
+            other['c'] = 3
+            self.assertEqual(list(PickleDir(td, append_only=True).items()),
+                             [('c', 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+import multiprocessing
+import unittest
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from pickledir import PickleDir, AsyncPickleDir
+
+
+def _incrementer(dirpath: str, append_only: bool, rounds: int):
+    cache = PickleDir(dirpath, concurrent=True, append_only=append_only)
+    for _ in range(rounds):
+        cache.incr('counter')
+
+
+class TestUpdate(unittest.TestCase):
+
+    def test_update(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, append_only=append_only)
+                self.assertEqual(
+                    cache.update('a', lambda v: v + ['x'], default=[]),
+                    ['x'])
+                self.assertEqual(
+                    cache.update('a', lambda v: v + ['y'], default=[]),
+                    ['x', 'y'])
+                self.assertEqual(cache['a'], ['x', 'y'])
+
+    def test_single_load_and_save(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 1
+            with mock.patch.object(PickleDir, '_load_file',
+                                   wraps=cache._load_file) as load, \
+                    mock.patch.object(PickleDir, '_save_file',
+                                      wraps=cache._save_file) as save:
+                cache.update('a', lambda v: v * 10)
+            self.assertEqual(load.call_count, 1)
+            self.assertEqual(save.call_count, 1)
+            self.assertEqual(cache['a'], 10)
+
+    def test_keeps_expiration(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, append_only=append_only)
+                cache.set('a', 1, max_age=timedelta(hours=1))
+                expires = cache._get_record('a').expires
+                cache.incr('a')
+                self.assertEqual(cache._get_record('a').expires, expires)
+                cache.incr('a', max_age=timedelta(days=1))
+                self.assertGreater(cache._get_record('a').expires,
+                                   expires + timedelta(hours=20))
+                self.assertEqual(cache['a'], 3)
+
+                cache.incr('b')
+                self.assertIsNone(cache._get_record('b').expires)
+
+    def test_expired_is_missing(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, append_only=append_only)
+                cache.set('a', 5, max_age=timedelta(seconds=-1))
+                self.assertEqual(cache.incr('a', 2), 2)
+                self.assertIsNone(cache._get_record('a').expires)
+
+    def test_compare_and_set(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                cache = PickleDir(td, append_only=append_only)
+                self.assertFalse(cache.compare_and_set('a', 1, 2))
+                self.assertNotIn('a', cache)
+                self.assertTrue(cache.compare_and_set('a', None, 1))
+                self.assertFalse(cache.compare_and_set('a', 0, 2))
+                self.assertEqual(cache['a'], 1)
+                self.assertTrue(cache.compare_and_set('a', 1, 2))
+                self.assertEqual(cache['a'], 2)
+
+    def test_unchanged_not_written(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 1
+            with mock.patch.object(PickleDir, '_save_file',
+                                   side_effect=AssertionError):
+                self.assertFalse(cache.compare_and_set('a', 0, 2))
+
+    def test_exception_in_func(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td)
+            cache['a'] = 'text'
+            with self.assertRaises(TypeError):
+                cache.incr('a')
+            self.assertEqual(cache['a'], 'text')
+
+    def test_timings(self):
+        with TemporaryDirectory() as td:
+            cache = PickleDir(td, metrics=True)
+            cache.incr('a')
+            cache.update('a', lambda v: v * 2)
+            cache.compare_and_set('a', 2, 3)
+            timings = cache.metrics.snapshot()['timings']
+            self.assertEqual(timings['update']['count'], 2)
+            self.assertEqual(timings['compare_and_set']['count'], 1)
+
+    def test_processes(self):
+        for append_only in (False, True):
+            with TemporaryDirectory() as td:
+                processes = [
+                    multiprocessing.Process(target=_incrementer,
+                                            args=(td, append_only, 50))
+                    for _ in range(4)]
+                for p in processes:
+                    p.start()
+                for p in processes:
+                    p.join()
+                self.assertEqual(PickleDir(td, append_only=append_only)
+                                 ['counter'], 200)
+
+
+class TestAsyncUpdate(unittest.IsolatedAsyncioTestCase):
+
+    async def test_update(self):
+        with TemporaryDirectory() as td:
+            cache = AsyncPickleDir(td)
+            self.assertEqual(await cache.incr('a'), 1)
+            self.assertEqual(await cache.get('a'), 1)
+            self.assertEqual(await cache.update('a', lambda v: v * 10), 10)
+            self.assertTrue(await cache.compare_and_set('a', 10, 0))
+            self.assertEqual(await cache.get('a'), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()